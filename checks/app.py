@@ -2,10 +2,13 @@
 
 import os
 import logging
+import tempfile
 
 import tornado.web
 import tornado.ioloop
+import tornado.netutil
 import tornado.options
+import tornado.process
 import tornado.httpserver
 import tornado.gen
 
@@ -15,11 +18,28 @@ from ServiceDiscovery.discovery import ServiceDiscovery, Service
 from signal import signal, SIGINT, SIGTERM, SIGQUIT
 
 from checks.config import make_config
+from checks.engine import ExecutionEngine
+from checks.catalogue import Catalogue
+from checks.cache import SeriesCache, ResultCache
+from checks.resolver import ServiceResolver
+from checks.results import ResultsWriter
+from checks.indexes import ensure_indexes
+from checks.jobs import JobQueue
+from checks.downstream import Downstream
+from checks.offload import Offloader
+from checks.metrics import REGISTRY, collect_cache, log_request
+from checks.supervisor import Supervisor, Heartbeat
 
 from checks.controllers import CheckHandler, NotFoundHandler
 from checks.controllers import BulkHandler, CsvBulkHandler
 from checks.controllers import GroupChecksHandler, CheckExecHandler
 from checks.controllers import GroupChecksExecController
+from checks.controllers import ResultsHandler, ResultHandler
+from checks.controllers import IndexStatsHandler, BatchExecHandler
+from checks.controllers import JobHandler, JobResultsHandler
+from checks.controllers import DownstreamStatsHandler
+from checks.controllers import GroupChecksRerunHandler
+from checks.controllers import MetricsHandler, WorkersHandler
 
 from ServiceDiscovery.controllers import HealthHandler
 
@@ -28,12 +48,22 @@ log = logging.getLogger(__name__)
 
 def build_routes():
     routes = []
+    routes.extend(BatchExecHandler.routes())
+    routes.extend(GroupChecksRerunHandler.routes())
     routes.extend(GroupChecksExecController.routes())
     routes.extend(CheckExecHandler.routes())
     routes.extend(CheckHandler.routes())
     routes.extend(GroupChecksHandler.routes())
     routes.extend(CsvBulkHandler.routes())
     routes.extend(BulkHandler.routes())
+    routes.extend(JobResultsHandler.routes())
+    routes.extend(JobHandler.routes())
+    routes.extend(ResultHandler.routes())
+    routes.extend(ResultsHandler.routes())
+    routes.extend(IndexStatsHandler.routes())
+    routes.extend(DownstreamStatsHandler.routes())
+    routes.extend(MetricsHandler.routes())
+    routes.extend(WorkersHandler.routes())
     routes.extend(HealthHandler.routes())
 
     return routes
@@ -46,37 +76,170 @@ def get_app():
         "cookie_secret": os.environ.get('SECRET') or 'secret',
         "xsrf_cookies": False,
         "debug": config.getboolean('WebServer', 'debug'),
-        'default_handler_class': NotFoundHandler
+        'default_handler_class': NotFoundHandler,
+        'log_function': log_request
     }
 
     app = tornado.web.Application(build_routes(), **settings)
     app.config = config
 
-    mongodb_host = app.config.get('MongoDB', 'host')
-    mongodb_port = app.config.get('MongoDB', 'port')
-    app.db = MotorClient('mongodb://%s:%s' % (mongodb_host, mongodb_port))
-    app.sd = ServiceDiscovery(endpoint=config.get('ServiceDiscovery', 'sd'))
+    # per-process, created by `init_worker` once forked
+    app.db = None
+    app.sd = None
+    app.resolver = None
+    app.heartbeat = None
+    app.service = None
+    app.supervised = False
+    app.downstream = dict(
+        (name, Downstream.from_config(config, name))
+        for name in ('DataService', 'EvalService'))
+    app.series_cache = SeriesCache(
+        size=config.getint('SeriesCache', 'size'),
+        maxbytes=config.getint('SeriesCache', 'bytes'),
+        ttl=config.getint('SeriesCache', 'ttl'))
+    app.offload = Offloader(
+        kind=config.get('Offload', 'kind'),
+        workers=config.getint('Offload', 'workers'),
+        threshold=config.getint('Offload', 'threshold'))
+    app.catalogue = None
+    if config.getboolean('Catalogue', 'enabled'):
+        app.catalogue = Catalogue(
+            app, interval=config.getfloat('Catalogue', 'interval'))
+    app.results = ResultsWriter(
+        app, batch=config.getint('Results', 'batch'),
+        interval=config.getfloat('Results', 'interval'))
+    app.engine = ExecutionEngine(
+        app, parallelism=config.getint('Engine', 'parallelism'),
+        cache=app.series_cache, results=app.results,
+        fmt=config.get('Engine', 'format'),
+        evaluator=config.get('Engine', 'evaluator'),
+        offload=app.offload,
+        catalogue=app.catalogue,
+        memo=ResultCache(
+            size=config.getint('ResultCache', 'size'),
+            ttl=config.getint('ResultCache', 'ttl')))
+    app.jobs = JobQueue(
+        app, workers=config.getint('Jobs', 'workers'),
+        size=config.getint('Jobs', 'queue'),
+        expiry=config.getfloat('Jobs', 'expiry'))
+    collect_cache('series', app.series_cache)
+    collect_cache('results', app.engine.memo)
     return app
 
 
+def make_resolver(app):
+    """Factory for the non-blocking ServiceResolver in front of `app.sd`"""
+    return ServiceResolver(
+        app.sd, app.config.get('ServiceDiscovery', 'sd'),
+        ttl=app.config.getint('ServiceDiscovery', 'ttl'),
+        refresh=app.config.getint('ServiceDiscovery', 'refresh'))
+
+
+def make_db(config):
+    """Factory for the MotorClient of a process"""
+    mongodb_url = config.get('MongoDB', 'url')
+    if mongodb_url != '':
+        return MotorClient(mongodb_url)
+
+    mongodb_host = config.get('MongoDB', 'host')
+    mongodb_port = config.get('MongoDB', 'port')
+    return MotorClient('mongodb://%s:%s' % (mongodb_host, mongodb_port))
+
+
+def worker_status(app):
+    """details of the health of a worker, see `Heartbeat`"""
+    return {
+        'downstream': dict((name, client.stats())
+                           for name, client in app.downstream.items()),
+        'jobs': app.jobs.queue.qsize(),
+        'results': len(app.results.buffer)
+    }
+
+
+def init_worker(app, task_id=0):
+    """
+    creates the clients of this process and starts its background tasks
+
+    called in every worker once forked: MongoDB, Consul and the IOLoop
+    must never be shared across a fork
+    """
+    config = app.config
+    app.db = make_db(config)
+    app.sd = ServiceDiscovery(endpoint=config.get('ServiceDiscovery', 'sd'))
+    app.resolver = make_resolver(app)
+    app.resolver.start()
+    app.results.start()
+    app.jobs.start()
+    if app.catalogue is not None:
+        app.catalogue.start()
+
+    run_dir = config.get('Workers', 'rundir')
+    metrics_dir = config.get('Metrics', 'dir') or run_dir
+    if metrics_dir != '':
+        REGISTRY.start(metrics_dir,
+                       interval=config.getfloat('Metrics', 'interval'))
+
+    app.heartbeat = Heartbeat(
+        run_dir, task_id, interval=config.getfloat('Workers', 'heartbeat'),
+        extra=lambda: worker_status(app))
+    app.heartbeat.start()
+    tornado.ioloop.IOLoop.current().spawn_callback(ensure_indexes, app.db)
+
+
+def register(sd, service_name, addr, port):
+    """registers the service on Consul, returns it"""
+    service = Service(service_name, addr, port)
+    try:
+        sd.register(service)
+        service.registered = True
+    except Exception as e:
+        log.error("Cannot register the service on Consul: %s", str(e))
+        service.registered = False
+    return service
+
+
+def unregister(sd, service):
+    if service is None or not service.registered:
+        return
+
+    try:
+        sd.unregister(service)
+        service.registered = False
+    except Exception as e:
+        log.error("Cannot de-register on Consul: %s", str(e))
+
+
+@tornado.gen.coroutine
 def on_shutdown(app):
     """shutdown callback"""
     log.info("Shutdown started")
-    if app.service.registered:
-        try:
-            app.sd.unregister(app.service)
-        except Exception as e:
-            log.error("Cannot de-register on Consul: %s", str(e))
-
-    app.db.close()
+    # set only when this process owns the registration
+    unregister(app.sd, app.service)
+    yield close_worker(app)
     tornado.ioloop.IOLoop.instance().stop()
     log.info("Shutdown completed")
 
 
+@tornado.gen.coroutine
+def close_worker(app):
+    """stops what `init_worker` started and closes the clients"""
+    app.heartbeat.stop()
+    app.resolver.stop()
+    if app.catalogue is not None:
+        app.catalogue.stop()
+    REGISTRY.stop()
+    app.jobs.stop()
+    yield app.results.stop()
+    for downstream in app.downstream.values():
+        downstream.close()
+    app.offload.shutdown()
+    app.db.close()
+
+
 def build_ssl_options(config):
     ssl_options = {
-        "certfile": config.get('WebServer', 'servercert'),
-        "keyfile": config.get('WebServer', 'serverkey')
+        "certfile": config.get('WebServer', 'certfile'),
+        "keyfile": config.get('WebServer', 'keyfile')
     }
 
     if os.path.isfile(ssl_options['certfile']) and \
@@ -88,61 +251,32 @@ def build_ssl_options(config):
     return ssl_options
 
 
-def startWebServer():
-    app = get_app()
-    server = tornado.httpserver.HTTPServer(app)
-
-    protocol = app.config.get('WebServer', 'protocol')
-    addr = app.config.get('WebServer', 'address')
-    port = app.config.getint('WebServer', 'port')
-    service_name = app.config.get('WebServer', 'servicename')
-
-    ssl_options = build_ssl_options(app.config)
-    if ssl_options is None:
-        protocol = "http"
-        log.warning("Server should be always on HTTPS!")
-    else:
-        protocol = "https"
-        log.info("Good body, you have HTTPS configured")
-
-    app.config.set('WebServer', 'protocol', protocol)
-
-    server = tornado.httpserver.HTTPServer(app, ssl_options=ssl_options)
-
+def bind(port, reuse_port=False):
+    """binds the first free port from `port`, returns (sockets, port)"""
     while True:
         try:
             log.info('try port %s', port)
-            server.bind(port)
-            log.info("%s at %s://%s:%s", service_name, protocol, addr, port)
-            app.config.set('WebServer', 'port', str(port))
-            break
+            sockets = tornado.netutil.bind_sockets(port,
+                                                   reuse_port=reuse_port)
+            return sockets, port
         except Exception as e:
             log.info('port %s already used (%s) ... ', str(port), str(e))
             port += 1
 
-    app.service = Service(service_name, addr, port)
-    try:
-        app.sd.register(app.service)
-        app.service.registered = True
-    except Exception as e:
-        log.error("Cannot register the service on Consul: %s", str(e))
-        app.service.registered = False
-
-    server.start(app.config.getint('WebServer', 'nproc'))
 
-    mongodb_host = app.config.get('MongoDB', 'host')
-    mongodb_port = app.config.get('MongoDB', 'port')
-    mongodb_url = app.config.get('MongoDB', 'url')
+def run_worker(app, sockets, ssl_options, task_id=0):
+    """serves `app` on `sockets` until shutdown"""
+    if sockets is None:
+        # SO_REUSEPORT: each worker listens on its own socket and the
+        # kernel balances the connections
+        sockets = tornado.netutil.bind_sockets(
+            app.config.getint('WebServer', 'port'), reuse_port=True)
 
-    if mongodb_url != '':
-        app.db = MotorClient(mongodb_url)
-    else:
-        app.db = MotorClient('mongodb://%s:%s' % (mongodb_host, mongodb_port))
-
-    app.sd = ServiceDiscovery(
-        endpoint=app.config.get('ServiceDiscovery', 'sd'))
+    server = tornado.httpserver.HTTPServer(app, ssl_options=ssl_options)
+    server.add_sockets(sockets)
+    init_worker(app, task_id)
 
-    ioloop = tornado.ioloop.IOLoop.instance()
+    ioloop = tornado.ioloop.IOLoop.current()
 
     def callback_for_signal(sig, frame):
         ioloop.add_callback_from_signal(on_shutdown, app)
@@ -150,14 +284,78 @@ def startWebServer():
     for sig in (SIGINT, SIGTERM, SIGQUIT):
         signal(sig, callback_for_signal)
 
-    if app.service.registered:
-        log.info("%s started and registered (PID: %s)",
-                 service_name, os.getpid())
+    log.info("Worker %s started (PID: %s)", task_id, os.getpid())
+    ioloop.start()
+
+
+def startWebServer():
+    app = get_app()
+    config = app.config
+
+    addr = config.get('WebServer', 'address')
+    port = config.getint('WebServer', 'port')
+    service_name = config.get('WebServer', 'servicename')
+
+    ssl_options = build_ssl_options(config)
+    if ssl_options is None:
+        protocol = "http"
+        log.warning("Server should be always on HTTPS!")
     else:
-        log.info("%s started but *not* registered (PID: %s)",
-                 service_name, os.getpid())
+        protocol = "https"
+        log.info("Good body, you have HTTPS configured")
 
-    ioloop.start()
+    config.set('WebServer', 'protocol', protocol)
+
+    nproc = config.getint('WebServer', 'nproc')
+    if nproc <= 0:
+        nproc = tornado.process.cpu_count()
+    reuse_port = nproc > 1 and config.getboolean('Workers', 'reuseport')
+
+    sockets, port = bind(port, reuse_port)
+    config.set('WebServer', 'port', str(port))
+    log.info("%s at %s://%s:%s", service_name, protocol, addr, port)
+
+    metrics_dir = config.get('Metrics', 'dir')
+    if metrics_dir != '':
+        REGISTRY.clear(metrics_dir)
+
+    # one instance per address and port, registered by the process owning
+    # its lifecycle: the supervisor when there are workers
+    sd = ServiceDiscovery(endpoint=config.get('ServiceDiscovery', 'sd'))
+    service = register(sd, service_name, addr, port)
+    if service.registered:
+        log.info("%s registered (PID: %s)", service_name, os.getpid())
+    else:
+        log.info("%s *not* registered (PID: %s)", service_name, os.getpid())
+
+    if nproc == 1:
+        app.service = service
+        run_worker(app, sockets, ssl_options)
+        return
+
+    run_dir = config.get('Workers', 'rundir')
+    if run_dir == '':
+        # created before the fork, to be shared by all the processes
+        run_dir = tempfile.mkdtemp(prefix='checks-')
+        config.set('Workers', 'rundir', run_dir)
+    if metrics_dir == '':
+        REGISTRY.clear(run_dir)
+
+    if reuse_port:
+        # the port is taken: workers bind their own sockets
+        for sock in sockets:
+            sock.close()
+        sockets = None
+
+    app.supervised = True
+    supervisor = Supervisor(
+        nproc, lambda task_id: run_worker(app, sockets, ssl_options, task_id),
+        run_dir, max_restarts=config.getint('Workers', 'maxrestarts'))
+    try:
+        supervisor.run()
+    finally:
+        unregister(sd, service)
+        log.info("Shutdown completed")
 
 
 def main():
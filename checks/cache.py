@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+
+import json
+import time
+import hashlib
+import logging
+
+from collections import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 10000
+DEFAULT_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 3600
+DEFAULT_RESULT_SIZE = 100000
+DEFAULT_RESULT_TTL = 24 * 3600
+
+
+class LRUCache(object):
+    """
+    In-process LRU cache with TTL and byte-size limits
+
+    Each entry is stored with its size in bytes: the least recently used
+    entries are evicted as soon as there are more than `size` entries or
+    their sizes add up to more than `maxbytes`. Entries older than `ttl`
+    seconds are never returned.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, maxbytes=DEFAULT_BYTES,
+                 ttl=DEFAULT_TTL, clock=time.time):
+        self.size = size
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, count=True):
+        """returns the value cached for `key` or `None`"""
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[2] < self.clock():
+            self.bytes -= entry[1]
+            entry = None
+
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+
+        # re-inserting moves the entry to the most recent end
+        self.entries[key] = entry
+        if count:
+            self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, nbytes=0):
+        self.delete(key)
+        if nbytes > self.maxbytes:
+            log.debug("%s too big to be cached (%s bytes)", key, nbytes)
+            return
+
+        self.entries[key] = (value, nbytes, self.clock() + self.ttl)
+        self.bytes += nbytes
+        while len(self.entries) > self.size or self.bytes > self.maxbytes:
+            _, (_, evicted, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class SeriesCache(LRUCache):
+    """Caches the decoded DataService series by (tag, dep name)"""
+
+    def get_series(self, tag, dep_name):
+        return self.get((tag, dep_name))
+
+    def put_series(self, tag, dep_name, series, nbytes):
+        self.put((tag, dep_name), series, nbytes)
+
+
+def definition(check):
+    """
+    what the result of `check` depends on (formula, deps, operator,
+    threshold, tolerance), serialized
+    """
+    return json.dumps([
+        check['group'],
+        check['name'],
+        check['formula'],
+        sorted(check['deps']),
+        check['operator'],
+        check['threshold'],
+        check.get('tolerance', 0.0)
+    ], sort_keys=True, default=str)
+
+
+def check_key(check, tag):
+    """
+    hash of the definition of `check` executed on `tag`
+
+    any change to the definition changes the key; plans from the
+    `Catalogue` carry their definition already serialized
+    """
+    serialized = check.get('.definition') or definition(check)
+    key = serialized + json.dumps(tag, default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ResultCache(LRUCache):
+    """
+    Memoizes the results of the executions
+
+    Results are keyed by `check_key`, so a changed check never gets the
+    result of its former definition, even from a process which missed the
+    invalidation. `invalidate` drops the results of a check (or a whole
+    group) as soon as it changes, `invalidate_series` those depending on
+    series changed on a tag, whatever their group.
+    """
+
+    def __init__(self, size=DEFAULT_RESULT_SIZE, maxbytes=DEFAULT_BYTES,
+                 ttl=DEFAULT_RESULT_TTL, clock=time.time):
+        super(ResultCache, self).__init__(size=size, maxbytes=maxbytes,
+                                          ttl=ttl, clock=clock)
+        self.keys = {}
+        self.series = {}
+
+    def get_result(self, check, tag):
+        return self.get(check_key(check, tag))
+
+    def has_result(self, check, tag):
+        return check_key(check, tag) in self
+
+    def put_result(self, check, tag, res):
+        key = check_key(check, tag)
+        self.put(key, res)
+        self.index(self.keys, (check['group'], check['name']), key)
+        for dep_name in check['deps']:
+            self.index(self.series, (tag, dep_name), key)
+
+    def index(self, index, entry, key):
+        # forget the keys evicted in the meantime
+        keys = set(k for k in index.get(entry, ()) if k in self.entries)
+        keys.add(key)
+        index[entry] = keys
+
+    def invalidate(self, group, name=None):
+        if name is None:
+            checks = [k for k in self.keys if k[0] == group]
+        else:
+            checks = [(group, name)]
+
+        for check in checks:
+            for key in self.keys.pop(check, ()):
+                self.delete(key)
+
+    def invalidate_series(self, tag, series):
+        for dep_name in series:
+            for key in self.series.pop((tag, dep_name), ()):
+                self.delete(key)
@@ -0,0 +1,277 @@
+# -*- coding:utf-8 -*-
+
+import logging
+
+import tornado.gen
+import tornado.ioloop
+
+from pymongo.errors import PyMongoError, OperationFailure
+
+from checks.cache import definition
+from checks.compare import OPERATORS
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 30.0
+
+
+def compile_check(check):
+    """
+    the execution plan of `check`: a copy with threshold and tolerance as
+    floats, the operator stripped, deps as distinct strings in their
+    order and the definition pre-serialized for `check_key`
+
+    checks with an unknown operator or a threshold which isn't a number
+    keep them: they fail when executed, as they did before
+    """
+    plan = dict(check)
+    plan['operator'] = str(check.get('operator')).strip()
+    if plan['operator'] not in OPERATORS:
+        log.warning("Check %s/%s has an unknown operator: %s",
+                    check['group'], check['name'], plan['operator'])
+    plan.setdefault('tolerance', 0.0)
+    for field in ('threshold', 'tolerance'):
+        try:
+            plan[field] = float(plan.get(field))
+        except (TypeError, ValueError):
+            log.warning("Check %s/%s has a %s which isn't a number: %s",
+                        check['group'], check['name'], field,
+                        plan.get(field))
+    deps = []
+    for dep in check.get('deps', []):
+        dep = str(dep)
+        if dep not in deps:
+            deps.append(dep)
+    plan['deps'] = deps
+    plan['.definition'] = definition(plan)
+    return plan
+
+
+class Catalogue(object):
+    """
+    The compiled checks, in memory, by group and name
+
+    `start` loads every check and keeps the catalogue current from a change
+    stream on `db.checks.checks` or, when the deployment has none (e.g. a
+    standalone mongod), by reloading it every `interval` seconds. Lookups
+    cost no I/O: until the first load (`ready`), and for checks it doesn't
+    know yet, the engine reads MongoDB as it did before and `put`s what it
+    found. Groups are answered only when `complete`, i.e. loaded as a
+    whole since they were last `forget`-ten: a group holding just the
+    checks looked up one by one would run partially. Plans are shared:
+    never change them.
+
+    What the engine reads may be older than the catalogue by the time it
+    arrives: it takes the `generation` of the group before reading and
+    passes it to `put`/`put_group`, which keep the catalogue as it is when
+    a change was applied (or the group forgotten) meanwhile.
+    """
+
+    def __init__(self, app, interval=DEFAULT_INTERVAL):
+        # `app.db` is rebound after the fork: always go through `app`
+        self.app = app
+        self.interval = interval
+        self.groups = {}
+        self.ids = {}
+        self.loaded = set()
+        self.generations = {}
+        self.epoch = 0
+        self.ready = False
+        self.stopped = False
+        self.stream = None
+        self.periodic = None
+
+    @property
+    def collection(self):
+        return self.app.db.checks.checks
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, group, name):
+        return self.groups.get(group, {}).get(name)
+
+    def group(self, group):
+        return list(self.groups.get(group, {}).values())
+
+    def complete(self, group):
+        return group in self.loaded
+
+    def generation(self, group):
+        """bumped by every change to `group` the catalogue learns of"""
+        return (self.epoch, self.generations.get(group, 0))
+
+    def changed(self, group, generation):
+        return generation is not None and generation != self.generation(group)
+
+    def touch(self, group):
+        self.generations[group] = self.generations.get(group, 0) + 1
+
+    def touch_id(self, _id):
+        key = self.ids.get(_id)
+        if key is None:
+            # its group is unknown: any of them
+            self.epoch += 1
+        else:
+            self.touch(key[0])
+
+    def affected(self, group, series):
+        """the checks of `group` depending on any of `series`"""
+        series = set(series)
+        return [plan for plan in self.group(group)
+                if not series.isdisjoint(plan['deps'])]
+
+    def put(self, check, generation=None):
+        """
+        adds `check`, unless its group changed since `generation`: then
+        its plan is only returned
+        """
+        plan = compile_check(check)
+        if self.changed(plan['group'], generation):
+            return plan
+        # a check may have been renamed
+        self.remove(check['_id'])
+        self.groups.setdefault(plan['group'], {})[plan['name']] = plan
+        self.ids[plan['_id']] = (plan['group'], plan['name'])
+        return plan
+
+    def remove(self, _id):
+        key = self.ids.pop(_id, None)
+        if key is None:
+            return
+        group, name = key
+        checks = self.groups.get(group, {})
+        checks.pop(name, None)
+        if len(checks) == 0:
+            self.groups.pop(group, None)
+
+    def put_group(self, group, checks, generation=None):
+        """
+        replaces the checks of `group` with `checks`, all of them, unless
+        the group changed since `generation`: then their plans are only
+        returned
+        """
+        if self.changed(group, generation):
+            return [compile_check(check) for check in checks]
+        self.forget(group)
+        plans = [self.put(check) for check in checks]
+        self.loaded.add(group)
+        return plans
+
+    def forget(self, group):
+        """drops the checks of `group` until they're read again"""
+        self.touch(group)
+        self.loaded.discard(group)
+        for plan in self.group(group):
+            self.remove(plan['_id'])
+
+    @tornado.gen.coroutine
+    def load(self):
+        """(re)loads every check"""
+        cursor = self.collection.find({})
+        checks = yield cursor.to_list(length=None)
+        groups, ids = {}, {}
+        for check in checks:
+            try:
+                plan = compile_check(check)
+            except (KeyError, TypeError, ValueError) as e:
+                log.warning("Cannot compile check %s: %s", check['_id'], e)
+                continue
+            groups.setdefault(plan['group'], {})[plan['name']] = plan
+            ids[plan['_id']] = (plan['group'], plan['name'])
+        self.groups, self.ids = groups, ids
+        self.loaded = set(groups)
+        self.epoch += 1
+        self.ready = True
+        log.debug("%s checks in the catalogue", len(ids))
+
+    def apply(self, change):
+        """applies an event of the change stream"""
+        op = change['operationType']
+        if op in ('insert', 'update', 'replace'):
+            check = change.get('fullDocument')
+            if check is None:
+                # deleted before the lookup
+                self.touch_id(change['documentKey']['_id'])
+                self.remove(change['documentKey']['_id'])
+                return
+            # the group it leaves and the one it joins
+            self.touch_id(check['_id'])
+            if 'group' in check:
+                self.touch(check['group'])
+            try:
+                self.put(check)
+            except (KeyError, TypeError, ValueError) as e:
+                log.warning("Cannot compile check %s: %s", check['_id'], e)
+                self.remove(check['_id'])
+        elif op == 'delete':
+            self.touch_id(change['documentKey']['_id'])
+            self.remove(change['documentKey']['_id'])
+        elif op in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+            self.groups, self.ids, self.loaded = {}, {}, set()
+            self.epoch += 1
+
+    def start(self):
+        tornado.ioloop.IOLoop.current().spawn_callback(self.run)
+
+    def stop(self):
+        self.stopped = True
+        if self.periodic is not None:
+            self.periodic.stop()
+        if self.stream is not None:
+            self.stream.close()
+
+    @tornado.gen.coroutine
+    def run(self):
+        while not self.stopped:
+            try:
+                watching = yield self.watch()
+            except PyMongoError as e:
+                if self.stopped:
+                    return
+                log.error("Change stream on the checks failed: %s", e)
+                yield tornado.gen.sleep(self.interval)
+                continue
+            if not watching:
+                yield self.poll()
+                return
+
+    @tornado.gen.coroutine
+    def watch(self):
+        """
+        loads the checks and follows their changes until the stream ends;
+        returns False when change streams are unavailable
+        """
+        self.stream = self.collection.watch(full_document='updateLookup')
+        try:
+            # the stream is opened before loading: no change is missed
+            change = yield self.stream.try_next()
+        except OperationFailure as e:
+            log.warning("Change streams unavailable (%s): reloading the "
+                        "checks every %s seconds", e, self.interval)
+            self.stream = None
+            raise tornado.gen.Return(False)
+
+        yield self.load()
+        while not self.stopped:
+            if change is not None:
+                self.apply(change)
+                if change['operationType'] == 'invalidate':
+                    break
+            change = yield self.stream.next()
+        raise tornado.gen.Return(True)
+
+    @tornado.gen.coroutine
+    def poll(self):
+        yield self.reload()
+        self.periodic = tornado.ioloop.PeriodicCallback(
+            self.reload, self.interval * 1000)
+        self.periodic.start()
+
+    @tornado.gen.coroutine
+    def reload(self):
+        try:
+            yield self.load()
+        except PyMongoError as e:
+            log.error("Cannot load the checks: %s", e)
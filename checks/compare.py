@@ -0,0 +1,62 @@
+# -*- coding:utf-8 -*-
+
+import numpy
+
+
+def _less(values, threshold, tolerance):
+    return values < threshold + tolerance
+
+
+def _less_equal(values, threshold, tolerance):
+    return values <= threshold + tolerance
+
+
+def _greater(values, threshold, tolerance):
+    return values > threshold - tolerance
+
+
+def _greater_equal(values, threshold, tolerance):
+    return values >= threshold - tolerance
+
+
+def _equal(values, threshold, tolerance):
+    return numpy.abs(values - threshold) <= tolerance
+
+
+def _not_equal(values, threshold, tolerance):
+    return numpy.abs(values - threshold) > tolerance
+
+
+# every operator accepted by `controllers.validateCheck`
+OPERATORS = {
+    '<': _less,
+    '<=': _less_equal,
+    '>': _greater,
+    '>=': _greater_equal,
+    '==': _equal,
+    '<>': _not_equal,
+}
+
+
+def compare(dataresult, operator, threshold, tolerance=0.0):
+    """
+    Applies `operator` to each point of `dataresult` against `threshold`
+
+    NaN (and null) points are ignored. `tolerance` widens the band in
+    which a point passes: `x <= threshold + tolerance`, `x >= threshold -
+    tolerance`, `|x - threshold| <= tolerance` for `==` and its opposite
+    for `<>`.
+
+    returns a tuple (ok, failures) where `failures` are the indices of the
+    points not passing the comparison, `ok` is True when there are none.
+    Raises `ValueError` for an unknown operator.
+    """
+    if operator not in OPERATORS:
+        raise ValueError("unknown operator: %s" % operator)
+
+    values = numpy.asarray(dataresult, dtype=numpy.float64).ravel()
+    with numpy.errstate(invalid='ignore'):
+        passed = OPERATORS[operator](values, float(threshold),
+                                     float(tolerance))
+    failures = numpy.flatnonzero(~passed & ~numpy.isnan(values))
+    return len(failures) == 0, failures.tolist()
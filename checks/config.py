@@ -7,6 +7,29 @@ from socket import gethostname
 
 from tornado.options import options, define
 
+from checks.cache import DEFAULT_SIZE as DEFAULT_SERIES_CACHE_SIZE
+from checks.cache import DEFAULT_BYTES as DEFAULT_SERIES_CACHE_BYTES
+from checks.cache import DEFAULT_TTL as DEFAULT_SERIES_CACHE_TTL
+from checks.cache import DEFAULT_RESULT_SIZE as DEFAULT_RESULT_CACHE_SIZE
+from checks.cache import DEFAULT_RESULT_TTL as DEFAULT_RESULT_CACHE_TTL
+from checks.catalogue import DEFAULT_INTERVAL as DEFAULT_CATALOGUE_INTERVAL
+from checks.deps import DEFAULT_FANOUT as DEFAULT_DEPS_FANOUT
+from checks.downstream import DEFAULT_MAX_CLIENTS, DEFAULT_CONNECT_TIMEOUT
+from checks.downstream import DEFAULT_REQUEST_TIMEOUT
+from checks.engine import DEFAULT_PARALLELISM as DEFAULT_EXEC_PARALLELISM
+from checks.jobs import DEFAULT_WORKERS as DEFAULT_JOB_WORKERS
+from checks.jobs import DEFAULT_QUEUE as DEFAULT_JOB_QUEUE
+from checks.jobs import DEFAULT_EXPIRY as DEFAULT_JOB_EXPIRY
+from checks.metrics import DEFAULT_INTERVAL as DEFAULT_METRICS_INTERVAL
+from checks.offload import DEFAULT_KIND as DEFAULT_OFFLOAD
+from checks.offload import DEFAULT_WORKERS as DEFAULT_OFFLOAD_WORKERS
+from checks.offload import DEFAULT_THRESHOLD as DEFAULT_OFFLOAD_THRESHOLD
+from checks.resolver import DEFAULT_TTL as DEFAULT_SD_TTL
+from checks.resolver import DEFAULT_REFRESH as DEFAULT_SD_REFRESH
+from checks.results import DEFAULT_BATCH as DEFAULT_RESULTS_BATCH
+from checks.results import DEFAULT_INTERVAL as DEFAULT_RESULTS_INTERVAL
+from checks.supervisor import DEFAULT_MAX_RESTARTS, DEFAULT_HEARTBEAT
+
 try:
     from ConfigParser import ConfigParser
 except ImportError:
@@ -19,6 +42,11 @@ DEFAULT_CERT_PATH = 'server.crt'
 DEFAULT_SD = 'http://localhost:8500'
 DEFAULT_MONGODB_HOST = 'localhost'
 DEFAULT_MONGODB_PORT = '27017'
+DEFAULT_MONGODB_BATCH = 1000
+DEFAULT_CSV_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_WIRE_FORMAT = 'json'
+DEFAULT_EVALUATOR = 'remote'
+DOWNSTREAM_SERVICES = (('data', 'DataService'), ('eval', 'EvalService'))
 
 if 'nproc' not in options:
     define("nproc", default=1, type=int, help="Numero processi")
@@ -27,6 +55,23 @@ if 'debug' not in options:
     define("debug", default=False, type=bool,
            help="Starts the server in debug mode")
 
+if 'reuse-port' not in options:
+    define('reuse-port', default=False, type=bool,
+           help='with nproc > 1, a SO_REUSEPORT socket per worker')
+
+if 'max-restarts' not in options:
+    define('max-restarts', default=DEFAULT_MAX_RESTARTS, type=int,
+           help='crashed workers restarted before giving up')
+
+if 'run-dir' not in options:
+    define('run-dir', default='', type=str,
+           help='directory where workers share their state '
+                '(a temporary one when empty and nproc > 1)')
+
+if 'heartbeat' not in options:
+    define('heartbeat', default=DEFAULT_HEARTBEAT, type=float,
+           help='seconds between health reports of a worker')
+
 if 'certfile' not in options:
     define('certfile', default=DEFAULT_CERT_PATH, type=str,
            help='Path to you cert file')
@@ -35,10 +80,73 @@ if 'keyfile' not in options:
     define('keyfile', default=DEFAULT_KEY_PATH, type=str,
            help='Path to your key file')
 
+if 'csv-max-bytes' not in options:
+    define('csv-max-bytes', default=DEFAULT_CSV_MAX_BYTES, type=int,
+           help='max size of a CSV import')
+
 if 'sd' not in options:
     define('sd', default=DEFAULT_SD, type=str,
            help='URL for Consul')
 
+if 'result-cache-size' not in options:
+    define('result-cache-size', default=DEFAULT_RESULT_CACHE_SIZE, type=int,
+           help='max number of execution results memoized')
+
+if 'result-cache-ttl' not in options:
+    define('result-cache-ttl', default=DEFAULT_RESULT_CACHE_TTL, type=int,
+           help='seconds an execution result stays memoized')
+
+if 'results-batch' not in options:
+    define('results-batch', default=DEFAULT_RESULTS_BATCH, type=int,
+           help='results buffered before they are stored')
+
+if 'results-interval' not in options:
+    define('results-interval', default=DEFAULT_RESULTS_INTERVAL, type=float,
+           help='max seconds results stay buffered')
+
+if 'job-workers' not in options:
+    define('job-workers', default=DEFAULT_JOB_WORKERS, type=int,
+           help='async group executions run at the same time')
+
+if 'job-queue' not in options:
+    define('job-queue', default=DEFAULT_JOB_QUEUE, type=int,
+           help='max async group executions waiting')
+
+if 'job-expiry' not in options:
+    define('job-expiry', default=DEFAULT_JOB_EXPIRY, type=float,
+           help='seconds without a beat before a job is failed')
+
+for prefix, service in DOWNSTREAM_SERVICES:
+    if '%s-max-clients' % prefix not in options:
+        define('%s-max-clients' % prefix, default=DEFAULT_MAX_CLIENTS,
+               type=int, help='connection pool size for %s' % service)
+
+    if '%s-connect-timeout' % prefix not in options:
+        define('%s-connect-timeout' % prefix, type=float,
+               default=DEFAULT_CONNECT_TIMEOUT,
+               help='seconds to connect to %s' % service)
+
+    if '%s-request-timeout' % prefix not in options:
+        define('%s-request-timeout' % prefix, type=float,
+               default=DEFAULT_REQUEST_TIMEOUT,
+               help='seconds to wait for a response from %s' % service)
+
+    if '%s-keep-alive' % prefix not in options:
+        define('%s-keep-alive' % prefix, default=True, type=bool,
+               help='keep connections to %s alive' % service)
+
+    if '%s-compress' % prefix not in options:
+        define('%s-compress' % prefix, default=False, type=bool,
+               help='ask %s for gzip compressed responses' % service)
+
+if 'sd-ttl' not in options:
+    define('sd-ttl', default=DEFAULT_SD_TTL, type=int,
+           help='seconds a service endpoint stays cached')
+
+if 'sd-refresh' not in options:
+    define('sd-refresh', default=DEFAULT_SD_REFRESH, type=int,
+           help='seconds between background refreshes of endpoints')
+
 if 'mongodb-host' not in options:
     define('mongodb-host', default=DEFAULT_MONGODB_HOST,
            help='host of mongodb')
@@ -50,6 +158,70 @@ if 'mongodb-port' not in options:
 if 'mongodb-url' not in options:
     define('mongodb-url', default='')
 
+if 'mongodb-batch' not in options:
+    define('mongodb-batch', default=DEFAULT_MONGODB_BATCH, type=int,
+           help='documents streamed to the client at a time')
+
+if 'deps-fanout' not in options:
+    define('deps-fanout', default=DEFAULT_DEPS_FANOUT, type=int,
+           help='max concurrent requests to DataService for a check')
+
+if 'exec-parallelism' not in options:
+    define('exec-parallelism', default=DEFAULT_EXEC_PARALLELISM, type=int,
+           help='max checks executed concurrently in a group')
+
+if 'wire-format' not in options:
+    define('wire-format', default=DEFAULT_WIRE_FORMAT, type=str,
+           help='format of the series sent to EvalService: json or bson')
+
+if 'evaluator' not in options:
+    define('evaluator', default=DEFAULT_EVALUATOR, type=str,
+           help='where formulas are evaluated: remote (EvalService), '
+                'local (in-process) or auto (local when possible)')
+
+if 'series-cache-size' not in options:
+    define('series-cache-size', default=DEFAULT_SERIES_CACHE_SIZE, type=int,
+           help='max number of DataService series cached')
+
+if 'series-cache-bytes' not in options:
+    define('series-cache-bytes', default=DEFAULT_SERIES_CACHE_BYTES,
+           type=int, help='max bytes of DataService series cached')
+
+if 'series-cache-ttl' not in options:
+    define('series-cache-ttl', default=DEFAULT_SERIES_CACHE_TTL, type=int,
+           help='seconds a DataService series stays cached')
+
+if 'offload' not in options:
+    define('offload', default=DEFAULT_OFFLOAD, type=str,
+           help='where big payloads are decoded, encoded and compared: '
+                'none (the IOLoop), thread or process')
+
+if 'offload-workers' not in options:
+    define('offload-workers', default=DEFAULT_OFFLOAD_WORKERS, type=int,
+           help='threads or processes of the offload pool')
+
+if 'offload-threshold' not in options:
+    define('offload-threshold', default=DEFAULT_OFFLOAD_THRESHOLD, type=int,
+           help='bytes from which a payload is offloaded')
+
+if 'catalogue' not in options:
+    define('catalogue', default=True, type=bool,
+           help='keep the checks compiled in memory')
+
+if 'catalogue-interval' not in options:
+    define('catalogue-interval', default=DEFAULT_CATALOGUE_INTERVAL,
+           type=float, help='seconds between reloads of the checks when '
+                            'MongoDB has no change streams')
+
+if 'metrics-dir' not in options:
+    define('metrics-dir', default='', type=str,
+           help='directory where processes share their metrics '
+                '(the run dir when empty)')
+
+if 'metrics-interval' not in options:
+    define('metrics-interval', default=DEFAULT_METRICS_INTERVAL, type=float,
+           help='seconds between dumps of the metrics of a process')
+
 
 def make_config():
     """init the config object"""
@@ -63,12 +235,56 @@ def make_config():
     config.set('WebServer', 'servicename', 'CheckService')
     config.set('WebServer', 'certfile', options.certfile)
     config.set('WebServer', 'keyfile', options.keyfile)
+    config.set('WebServer', 'csvmaxbytes', str(options['csv-max-bytes']))
+    config.add_section('Workers')
+    config.set('Workers', 'reuseport', str(options['reuse-port']))
+    config.set('Workers', 'maxrestarts', str(options['max-restarts']))
+    config.set('Workers', 'rundir', options['run-dir'])
+    config.set('Workers', 'heartbeat', str(options['heartbeat']))
     config.add_section('MongoDB')
     config.set('MongoDB', 'host', options['mongodb-host'])
     config.set('MongoDB', 'port', options['mongodb-port'])
     config.set('MongoDB', 'url', options['mongodb-url'])
+    config.set('MongoDB', 'batch', str(options['mongodb-batch']))
+    for prefix, service in DOWNSTREAM_SERVICES:
+        config.add_section(service)
+        for key in ('max-clients', 'connect-timeout', 'request-timeout',
+                    'keep-alive', 'compress'):
+            config.set(service, key.replace('-', ''),
+                       str(options['%s-%s' % (prefix, key)]))
+    config.set('DataService', 'fanout', str(options['deps-fanout']))
+    config.add_section('SeriesCache')
+    config.set('SeriesCache', 'size', str(options['series-cache-size']))
+    config.set('SeriesCache', 'bytes', str(options['series-cache-bytes']))
+    config.set('SeriesCache', 'ttl', str(options['series-cache-ttl']))
+    config.add_section('ResultCache')
+    config.set('ResultCache', 'size', str(options['result-cache-size']))
+    config.set('ResultCache', 'ttl', str(options['result-cache-ttl']))
+    config.add_section('Results')
+    config.set('Results', 'batch', str(options['results-batch']))
+    config.set('Results', 'interval', str(options['results-interval']))
+    config.add_section('Jobs')
+    config.set('Jobs', 'workers', str(options['job-workers']))
+    config.set('Jobs', 'queue', str(options['job-queue']))
+    config.set('Jobs', 'expiry', str(options['job-expiry']))
+    config.add_section('Engine')
+    config.set('Engine', 'parallelism', str(options['exec-parallelism']))
+    config.set('Engine', 'format', options['wire-format'])
+    config.set('Engine', 'evaluator', options['evaluator'])
+    config.add_section('Offload')
+    config.set('Offload', 'kind', options['offload'])
+    config.set('Offload', 'workers', str(options['offload-workers']))
+    config.set('Offload', 'threshold', str(options['offload-threshold']))
+    config.add_section('Catalogue')
+    config.set('Catalogue', 'enabled', str(options['catalogue']))
+    config.set('Catalogue', 'interval', str(options['catalogue-interval']))
+    config.add_section('Metrics')
+    config.set('Metrics', 'dir', options['metrics-dir'])
+    config.set('Metrics', 'interval', str(options['metrics-interval']))
     config.add_section('ServiceDiscovery')
     config.set('ServiceDiscovery', 'sd', options.sd)
+    config.set('ServiceDiscovery', 'ttl', str(options['sd-ttl']))
+    config.set('ServiceDiscovery', 'refresh', str(options['sd-refresh']))
     for key, value in options.items():
         config.set('WebServer', str(key), str(value))
 
@@ -1,17 +1,32 @@
 # -*- coding:utf-8 -*-
 
+import csv
 import json
+import codecs
 import logging
-import numpy
 
 import tornado.web
 import tornado.gen
 import tornado.escape
 
 from tornado.httpclient import AsyncHTTPClient
-from bson.json_util import dumps, loads
+from bson import ObjectId
+from bson.json_util import dumps
 
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from checks.engine import ExecutionError
+from checks.indexes import index_stats
+from checks.jobs import JobError
+from checks.metrics import REGISTRY
+from checks.trace import Trace
+from checks.supervisor import worker_health
 
 
 AsyncHTTPClient.configure("tornado.curl_httpclient.CurlAsyncHTTPClient")
@@ -27,51 +42,238 @@ def setError(handler, **params):
         'host': handler.request.host
     }
 
-    handler.set_status(ret['code'])
-
     for key, value in params.items():
         ret[key] = value
 
+    handler.set_status(ret['code'])
+
     handler.finish(json.dumps(ret))
 
 
-def validateCheck(handler, check):
+def checkError(check, require_author=True):
     """
     Apply validation check
 
-    Makes sure 'check' is properly compiled and set an Error
-    on handler in case it's not.
+    Makes sure 'check' is properly compiled, filling in the default
+    threshold and operator.
 
-    return `True` on validation, `False` otherwise
+    return the validation error, `None` when there's none
     """
 
     if 'formula' not in check:
-        setError(handler, error='Check must have a "formula"', code=400)
-        return False
+        return 'Check must have a "formula"'
 
     if 'deps' not in check:
-        setError(handler, error='Check must have "deps" specified', code=400)
-        return False
+        return 'Check must have "deps" specified'
 
-    if 'autore' not in check:
-        setError(handler, error='Check must have an "author"', code=400)
-        return False
+    if require_author and 'autore' not in check:
+        return 'Check must have an "author"'
 
     if 'threshold' not in check:
         check['threshold'] = 0.1
 
+    try:
+        float(check['threshold'])
+    except (TypeError, ValueError):
+        return 'Malformed threshold %s' % check['threshold']
+
     if 'operator' not in check:
         check['operator'] = '<='
     else:
         operator = check['operator']
         if operator not in ('<', '>', '==', '<=', '>=', '<>'):
-            setError(
-                handler,
-                error='Malformed operator %s' % operator, code=400)
-            return False
+            return 'Malformed operator %s' % operator
+    return None
+
+
+def validateCheck(handler, check):
+    """
+    Apply validation check
+
+    Makes sure 'check' is properly compiled and set an Error
+    on handler in case it's not.
+
+    return `True` on validation, `False` otherwise
+    """
+    error = checkError(check)
+    if error is not None:
+        setError(handler, error=error, code=400)
+        return False
     return True
 
 
+def batch_size(handler, cursor):
+    """sets the [MongoDB] batch config on `cursor` and returns it"""
+    size = handler.application.config.getint('MongoDB', 'batch')
+    cursor.batch_size(size)
+    return size
+
+
+def closed(handler):
+    """whether the client of `handler` went away"""
+    return handler.request.connection.stream.closed()
+
+
+def flush_event(handler):
+    """
+    flushes what `handler` wrote so far without waiting, unless its client
+    went away: then it's dropped
+    """
+    if closed(handler):
+        handler.clear()
+        return
+
+    def flushed(future):
+        # retrieved: a client closing meanwhile isn't an error
+        if future.exception() is not None:
+            log.debug("Client gone: %s", future.exception())
+    handler.flush().add_done_callback(flushed)
+
+
+@tornado.gen.coroutine
+def stream_json(handler, cursor):
+    """writes `cursor` as a JSON array, flushing a batch at a time"""
+    size = batch_size(handler, cursor)
+    separator = '['
+    while True:
+        batch = yield cursor.to_list(length=size)
+        if len(batch) == 0:
+            break
+        handler.write(separator)
+        handler.write(','.join(dumps(doc) for doc in batch))
+        separator = ','
+        yield handler.flush()
+
+    if separator == '[':
+        handler.write(separator)
+    handler.finish(']')
+
+
+@tornado.gen.coroutine
+def stream_csv(handler, cursor):
+    """writes the checks in `cursor` as CSV, flushing a batch at a time"""
+    size = batch_size(handler, cursor)
+    while True:
+        batch = yield cursor.to_list(length=size)
+        if len(batch) == 0:
+            break
+        buf = StringIO()
+        writer = csv.writer(buf, delimiter=';', lineterminator='\n')
+        for check in batch:
+            writer.writerow([
+                check['name'],
+                check['group'],
+                check['formula'],
+                check['operator'],
+                check['threshold']
+            ] + list(check['deps']))
+        handler.write(buf.getvalue())
+        yield handler.flush()
+
+    handler.finish()
+
+
+def listing_query(handler, condition):
+    """
+    Reads the listing arguments of the request
+
+    - `author`, `operator`: only the checks with this author/operator
+    - `dep`: only the checks depending on any of these series
+    - `fields`: comma separated fields to return (`_id` is always there)
+    - `after`, `limit`: keyset pagination on `_id`, at most `limit` checks
+      (capped to the [MongoDB] batch config) with `_id` after `after`
+
+    returns a tuple (condition, projection, limit); `limit` is `None` when
+    the listing isn't paginated. Raises `ValueError` on bad arguments.
+    """
+    condition = dict(condition)
+    for argument, field in (('author', 'autore'), ('operator', 'operator')):
+        value = handler.get_argument(argument, None)
+        if value is not None:
+            condition[field] = {'$eq': value}
+
+    deps = handler.get_arguments('dep')
+    if len(deps) > 0:
+        condition['deps'] = {'$in': deps}
+
+    fields = handler.get_argument('fields', None)
+    projection = None
+    if fields is not None:
+        projection = dict((field.strip(), True)
+                          for field in fields.split(',') if field.strip())
+
+    limit = paginate(handler, condition)
+    return condition, projection, limit
+
+
+def paginate(handler, condition, paginated=False, descending=False):
+    """
+    Reads the `after`, `limit` arguments of the request: keyset pagination
+    on `_id`, at most `limit` documents (capped to the [MongoDB] batch
+    config) with `_id` after `after` (before it when `descending`)
+
+    sets the `_id` bound in `condition` and returns `limit`, `None` when
+    the request isn't `paginated` and has none of them. Raises
+    `ValueError` on bad arguments.
+    """
+    after = handler.get_argument('after', None)
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise ValueError("Malformed cursor %s" % after)
+        condition['_id'] = {'$lt' if descending else '$gt': ObjectId(after)}
+
+    limit = handler.get_argument('limit', None)
+    if paginated or limit is not None or after is not None:
+        size = handler.application.config.getint('MongoDB', 'batch')
+        try:
+            limit = min(int(limit or size), size)
+        except ValueError:
+            raise ValueError("Malformed limit %s" % limit)
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+    return limit
+
+
+@tornado.gen.coroutine
+def write_page(handler, cursor, limit, descending=False):
+    """writes a page of `cursor`, with `X-Next-After` when it's full"""
+    cursor = cursor.sort('_id', -1 if descending else 1).limit(limit)
+    page = yield cursor.to_list(length=limit)
+    if len(page) == limit:
+        handler.set_header('X-Next-After', str(page[-1]['_id']))
+    handler.finish(dumps(page))
+
+
+@tornado.gen.coroutine
+def list_checks(handler, condition):
+    """
+    writes the checks matching `condition` and the listing arguments
+
+    Paginated listings answer with a page and, when it's full, the
+    `X-Next-After` header to pass as `after` for the next one; the others
+    are streamed.
+    """
+    try:
+        condition, projection, limit = listing_query(handler, condition)
+    except ValueError as e:
+        setError(handler, error=str(e), code=400)
+        return
+
+    cursor = handler.application.db.checks.checks.find(condition, projection)
+    if limit is None:
+        yield stream_json(handler, cursor)
+        return
+
+    yield write_page(handler, cursor, limit)
+
+
+def make_trace(handler):
+    """a `Trace` of the execution when the request asks for `trace=1`"""
+    if handler.get_argument('trace', '0') in ('1', 'true'):
+        return Trace()
+    return None
+
+
 class NotFoundHandler(tornado.web.RequestHandler):
     def prepare(self):
         setError(self)
@@ -111,12 +313,15 @@ class CheckHandler(tornado.web.RequestHandler):
         if not validateCheck(self, check):
             return
 
+        check['group'] = group
+        check['name'] = name
         try:
-            res = yield db.checks.checks.find_one_and_update({
+            res = yield db.checks.checks.find_one_and_replace({
                 'group': {'$eq': group},
                 'name': {'$eq': name}
             }, check, upsert=True, return_document=ReturnDocument.AFTER)
 
+            self.application.engine.invalidate(group, name)
             self.set_status(201)
             self.finish(dumps(res))
         except Exception as e:
@@ -124,37 +329,47 @@ class CheckHandler(tornado.web.RequestHandler):
             setError(self, error=str(e), code=500)
             return
 
+    @tornado.gen.coroutine
     def put(self, group, name):
         db = self.application.db
         check = tornado.escape.json_decode(self.request.body)
-        res = yield db.checks.checks.find_one({
+        res = yield db.checks.checks.find_one_and_update({
             'group': {'$eq': group},
             'name': {'$eq': name}
-        })
+        }, {
+            '$set': check
+        }, return_document=ReturnDocument.AFTER)
 
         if res is None:
             setError(self, error='Check %s/%s not found' % (group, name))
             return
 
-        res = yield db.checks.checks.find_one_and_update({
-
-        }, {
-            '$set': check
-        }, return_document=ReturnDocument.AFTER)
-
-        self.finish(json.dumps(res))
+        self.application.engine.invalidate(group, name)
+        self.finish(dumps(res))
 
+    @tornado.gen.coroutine
     def delete(self, group, name):
         db = self.application.db
         res = yield db.checks.checks.find_one_and_delete({
             'group': {'$eq': group},
             'name': {'$eq': name}
         })
+        self.application.engine.invalidate(group, name)
         self.set_status(202)
         self.finish(dumps(res))
 
 
+@tornado.web.stream_request_body
 class CsvBulkHandler(tornado.web.RequestHandler):
+    """
+    Exports and imports checks as CSV
+
+    Imports are streamed: rows are parsed as the body arrives, validated
+    one by one and upserted on (group, name) with `bulk_write`, [MongoDB]
+    batch rows at a time. Rows failing validation are reported and
+    skipped.
+    """
+
     @classmethod
     def routes(cls):
         return [
@@ -164,62 +379,118 @@ class CsvBulkHandler(tornado.web.RequestHandler):
     def set_default_headers(self):
         self.set_header('Content-Type', 'text/csv')
 
+    def prepare(self):
+        if self.request.method != 'POST':
+            return
+
+        config = self.application.config
+        self.request.connection.set_max_body_size(
+            config.getint('WebServer', 'csvmaxbytes'))
+        self.batch = config.getint('MongoDB', 'batch')
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.pending = ''
+        self.delimiter = None
+        self.rows = 0
+        self.operations = []
+        self.report = {
+            'rows': 0,
+            'upserted': 0,
+            'matched': 0,
+            'errors': []
+        }
+
+    @tornado.gen.coroutine
+    def data_received(self, chunk):
+        lines = (self.pending + self.decoder.decode(chunk)).split('\n')
+        self.pending = lines.pop()
+        self.parse(lines)
+        if len(self.operations) >= self.batch:
+            yield self.write_batch()
+
+    def parse(self, lines):
+        lines = [line for line in lines if len(line.strip()) > 0]
+        if len(lines) == 0:
+            return
+
+        if self.delimiter is None:
+            for delimiter in (';', ',', '\t'):
+                if delimiter in lines[0]:
+                    self.delimiter = delimiter
+                    break
+            else:
+                # no rows can be read: reported by `post`
+                self.rows += len(lines)
+                return
+
+        for row in csv.reader(lines, delimiter=self.delimiter):
+            self.rows += 1
+            row = [x.strip() for x in row if len(x.strip()) > 0]
+            try:
+                check = self.row_to_dict(row)
+            except Exception as e:
+                self.report['errors'].append({
+                    'row': self.rows, 'error': str(e)})
+                continue
+
+            error = checkError(check, require_author=False)
+            if error is not None:
+                self.report['errors'].append({
+                    'row': self.rows, 'error': error})
+                continue
+
+            self.operations.append((self.rows, check, UpdateOne({
+                'group': check['group'],
+                'name': check['name']
+            }, {'$set': check}, upsert=True)))
+
+    @tornado.gen.coroutine
+    def write_batch(self):
+        while len(self.operations) > 0:
+            batch = self.operations[:self.batch]
+            self.operations = self.operations[self.batch:]
+            db = self.application.db
+            try:
+                res = yield db.checks.checks.bulk_write(
+                    [operation for _, _, operation in batch], ordered=False)
+                res = res.bulk_api_result
+            except BulkWriteError as e:
+                res = e.details
+                for error in res['writeErrors']:
+                    self.report['errors'].append({
+                        'row': batch[error['index']][0],
+                        'error': error['errmsg']
+                    })
+            self.report['upserted'] += res['nUpserted']
+            self.report['matched'] += res['nMatched']
+            for _, check, _ in batch:
+                self.application.engine.invalidate(
+                    check['group'], check['name'])
+
     @tornado.gen.coroutine
     def get(self):
         db = self.application.db
-        length = yield db.checks.checks.count_documents({})
-        checks = db.checks.checks.find()
-        checks = yield checks.to_list(length=length)
-        for check in checks:
-            row = ';'.join([
-                check['name'],
-                check['group'],
-                check['formula'],
-                check['operator'],
-                check['threshold'],
-                ';'.join(check['deps'])
-            ])
-            self.write(row)
-            self.write('\n')
-
-        self.finish()
+        yield stream_csv(self, db.checks.checks.find())
 
     @tornado.gen.coroutine
     def post(self):
-        db = self.application.db
-        data = self.request.body.decode("UTF-8")
-        if ";" in data:
-            delimiter = ";"
-        elif "," in data:
-            delimiter = ","
-        elif "\t" in data:
-            delimiter = "\t"
-        else:
+        self.parse([self.pending + self.decoder.decode(b'', final=True)])
+        if self.delimiter is None and self.rows > 0:
             setError(self,
                      error="Cannot undestand delimiter in file",
                      code=400)
             return
 
-        lines = data.split("\n")
-        log.debug("Length : %s", len(lines))
-        log.debug(self.request.body.decode("UTF-8"))
-        csv_reader = [
-            [x.strip() for x in row.split(delimiter) if len(x.strip()) > 0]
-            for row in lines
-        ]
-        list_to_insert = []
-        for row in csv_reader:
-            if len(row) > 0:
-                list_to_insert.append(self.row_to_dict(row))
-
-        yield db.checks.checks.insert_many(list_to_insert)
+        yield self.write_batch()
+        self.report['rows'] = self.rows
+        log.debug("Import report: %s", self.report)
 
+        self.set_header('Content-Type', 'application/json')
         self.set_status(201)
-        self.finish()
+        self.finish(json.dumps(self.report))
 
     def row_to_dict(self, row):
         if (len(row) < 6):
-            raise Exception("Malformed checks row: " % row)
+            raise Exception("Malformed checks row: %s" % row)
 
         ret = dict(zip(
             ["name", "group", "formula", "operator", "threshold"],
@@ -250,11 +521,7 @@ class BulkHandler(tornado.web.RequestHandler):
 
     @tornado.gen.coroutine
     def get(self):
-        db = self.application.db
-        length = yield db.checks.checks.count_documents({})
-        checks = db.checks.checks.find()
-        checks = yield checks.to_list(length=length)
-        self.finish(dumps(checks))
+        yield list_checks(self, {})
 
 
 class GroupChecksHandler(tornado.web.RequestHandler):
@@ -269,20 +536,14 @@ class GroupChecksHandler(tornado.web.RequestHandler):
 
     @tornado.gen.coroutine
     def get(self, group):
-        db = self.application.db
-
-        condition = {'group': {'$eq': group}}
-
-        length = yield db.checks.checks.count_documents(condition)
-        checks = db.checks.checks.find(condition)
-        checks = yield checks.to_list(length=length)
-        self.finish(dumps(checks))
+        yield list_checks(self, {'group': {'$eq': group}})
 
     @tornado.gen.coroutine
     def delete(self, group):
         db = self.application.db
         condition = {'group': {'$eq': group}}
         yield db.checks.checks.delete_many(condition)
+        self.application.engine.invalidate(group)
         self.set_status(202)
         self.finish()
 
@@ -299,143 +560,438 @@ class CheckExecHandler(tornado.web.RequestHandler):
 
     @tornado.gen.coroutine
     def get(self, group, name, tag):
-        sd = self.application.sd
-        checkurl = sd.getService("CheckService") + "/checks"
-        dataurl = sd.getService("DataService") + "/data"
-        execurl = sd.getService("EvalService") + "/eval"
+        engine = self.application.engine
+        trace = make_trace(self)
+        try:
+            check = yield engine.load_check(group, name, trace)
+            log.debug("check: %s", check)
+            res = yield engine.execute(check, tag, trace=trace)
+        except ExecutionError as e:
+            setError(self, error=str(e), code=e.code)
+            return
 
-        log.debug("check url: %s", checkurl)
-        log.debug("data url: %s", dataurl)
-        log.debug("exec url: %s", execurl)
+        if trace is not None:
+            # `res` may be memoized: don't add the trace to it
+            res = dict(res, trace=trace.to_dict())
+        self.finish(dumps(res))
 
-        http_client = AsyncHTTPClient()
 
-        url = "/".join([checkurl, group, name])
-        log.debug("connecting to %s" % url)
-        res = yield http_client.fetch(url, validate_cert=False)
-        check = loads(res.body)
+class GroupChecksExecController(tornado.web.RequestHandler):
+    """
+    Executes all the checks of a group
+
+    By default the results are sent at once, as a dict check name ->
+    result. With `?stream=ndjson` (or `Accept: application/x-ndjson`) each
+    result is written as a JSON line as soon as its check completes; with
+    `?stream=sse` (or `Accept: text/event-stream`) as a `result` server-sent
+    event, followed by a final `done` event.
+    """
 
-        if res.code == 404:
-            setError(self, error="Check not found %s/%s" % (group, name))
+    STREAMS = {
+        'ndjson': 'application/x-ndjson',
+        'sse': 'text/event-stream'
+    }
+
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/checks/(\w+)/exec/(\w+)', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    def stream_mode(self):
+        mode = self.get_argument('stream', None)
+        if mode is not None:
+            return mode
+
+        accept = self.request.headers.get('Accept', '')
+        for mode, content_type in self.STREAMS.items():
+            if content_type in accept:
+                return mode
+        return None
+
+    @tornado.gen.coroutine
+    def get(self, group, tag):
+        mode = self.stream_mode()
+        if mode is not None:
+            if mode not in self.STREAMS:
+                setError(self, error='Unknown stream %s' % mode, code=400)
+                return
+            yield self.stream(group, tag, mode)
             return
 
-        check = loads(res.body)
-
-        log.debug("check: %s", check)
-        log.debug("type check: %s", type(check))
-
-        formula = check['formula']
-        deps_name = check['deps']
-        deps = {}
-
-        for dep_name in deps_name:
-            dataurl = sd.getService("DataService") + "/data"
-            url = dataurl + "/" + tag + "/" + dep_name
-            log.debug("URL to call for deps: %s", url)
-            res = yield http_client.fetch(url, validate_cert=False,
-                                          raise_error=False)
-            if res.code == 404:
-                log.warn("Deps %s for check %s/%s not found",
-                         dep_name, group, name)
-                url = dataurl + "/" + tag + "/ZERIQ"
-                res = yield http_client.fetch(url, validate_cert=False,
-                                              raise_error=False)
-                if res.code == 404:
-                    setError(self,
-                             error="Couldn't load ZERIQ after deps unmatched",
-                             code=500)
-                    return
-
-            deps[dep_name] = loads(res.body)
-
-            if 'formula' in deps[dep_name]:
-                # questo sta qui solo per ovviare problemi di codec
-                # sul fronte EvalService.
-                #
-                # vanno corretti i dati ed i vari codec delle stringhe
-                del deps[dep_name]['formula']
-
-        # see exes params in exes/consts.py
-        body = {
-            '.formula': formula,
-            '.deps': deps,
-            '.expected': check['name']
-        }
+        engine = self.application.engine
+        trace = make_trace(self)
+        try:
+            ret = yield engine.execute_group(group, tag, trace)
+        except ExecutionError as e:
+            setError(self, error=str(e), code=e.code)
+            return
+
+        if trace is not None:
+            # not a valid check name: can't clash with a result
+            ret['.trace'] = trace.to_dict()
+        self.finish(dumps(ret))
 
-        res = yield http_client.fetch(execurl,
-                                      method='POST',
-                                      body=dumps(body),
-                                      validate_cert=False,
-                                      raise_error=False)
+    @tornado.gen.coroutine
+    def stream(self, group, tag, mode):
+        """writes each result as soon as its check completes"""
+        engine = self.application.engine
+        trace = make_trace(self)
+        try:
+            checks = yield engine.load_group(group, trace)
+        except ExecutionError as e:
+            setError(self, error=str(e), code=e.code)
+            return
+
+        self.set_header('Content-Type', self.STREAMS[mode])
+        if mode == 'sse':
+            self.set_header('Cache-Control', 'no-cache')
+
+        def callback(check, tag, res):
+            self.write_event(mode, 'result', {
+                'group': check['group'],
+                'name': check['name'],
+                'tag': tag,
+                'result': res
+            })
+            flush_event(self)
 
-        if res.code < 200 or res.code > 299:
-            setError(self, error="Error connecting to EvalService: %s" %
-                     res.body, code=res.code)
+        try:
+            # no client, no point in running the rest of the group
+            yield engine.execute_many(checks, [tag], callback, trace=trace,
+                                      cancelled=lambda: closed(self))
+        except ExecutionError as e:
+            # nothing has been written yet: no check has run
+            setError(self, error=str(e), code=e.code)
+            return
+        if closed(self):
             return
 
-        res = loads(res.body)
-        log.debug("Res: %s", res)
-        dataresult = res[check['name']]['numbers']
-        threshold = check['threshold']
-        operator = check['operator']
+        if trace is not None:
+            self.write_event(mode, 'trace', {'.trace': trace.to_dict()})
+        if mode == 'sse':
+            self.write_event(mode, 'done', {'count': len(checks)})
+        self.finish()
 
-        if operator == '<=':
-            ok = all([x <= threshold
-                      for x in dataresult
-                      if not numpy.isnan(x)])
-        elif operator == '==':
-            ok = all([x == threshold
-                      for x in dataresult
-                      if not numpy.isnan(x)])
-        elif operator == '>=':
-            ok = all([x >= threshold
-                      for x in dataresult
-                      if not numpy.isnan(x)])
-        elif operator == '>':
-            ok = all([x > threshold
-                      for x in dataresult
-                      if not numpy.isnan(x)])
-        elif operator == '<':
-            ok = all([x < threshold
-                      for x in dataresult
-                      if not numpy.isnan(x)])
+    def write_event(self, mode, event, data):
+        if mode == 'sse':
+            self.write('event: %s\ndata: %s\n\n' % (event, dumps(data)))
         else:
-            setError(self, error="unknown operator: %s" % operator, code=500)
+            self.write(dumps(data))
+            self.write('\n')
 
-        res['ok'] = ok
-        self.finish(dumps(res))
+    @tornado.gen.coroutine
+    def post(self, group, tag):
+        """with `async=1` queues the execution and answers with its job"""
+        if self.get_argument('async', '0') not in ('1', 'true'):
+            yield self.get(group, tag)
+            return
 
+        try:
+            job_id = yield self.application.jobs.submit(group, tag)
+        except JobError as e:
+            setError(self, error=str(e), code=e.code)
+            return
+
+        self.set_status(202)
+        self.set_header('Location', '/jobs/%s' % job_id)
+        self.finish(dumps({'job': str(job_id)}))
+
+
+class GroupChecksRerunHandler(tornado.web.RequestHandler):
+    """
+    Re-executes the checks of a group depending on changed series
+
+    The body is `{"series": [name, ...]}`; the response has the same shape
+    of a group execution, the results of the checks not depending on the
+    changed series being the latest stored ones.
+    """
 
-class GroupChecksExecController(tornado.web.RequestHandler):
     @classmethod
     def routes(cls):
         return [
-            (r'/checks/(\w+)/exec/(\w+)', cls)
+            (r'/checks/(\w+)/exec/(\w+)/changed', cls)
         ]
 
     def set_default_headers(self):
         self.set_header('Content-Type', 'application/json')
 
     @tornado.gen.coroutine
-    def get(self, group, tag):
-        sd = self.application.sd
-        checkurl = sd.getService("CheckService") + "/checks"
-        url = "/".join([checkurl, group])
-        http_client = AsyncHTTPClient()
-        res = yield http_client.fetch(url, validate_cert=False)
-        if res.code == 404:
-            res = loads(res.body)
-            setError(self, error=res['error'])
+    def post(self, group, tag):
+        try:
+            series = tornado.escape.json_decode(self.request.body)['series']
+            series = [str(name) for name in series]
+        except (ValueError, KeyError, TypeError) as e:
+            setError(self, error='Malformed series: %s' % e, code=400)
             return
 
-        checks = loads(res.body)
-        ret = {}
-        for check in checks:
-            checkurl = sd.getService("CheckService") + "/checks"
-            exec_url = '/'.join([checkurl, group, check['name'], 'exec', tag])
-            res = yield http_client.fetch(exec_url,
-                                          validate_cert=False,
-                                          raise_error=False)
-            ret[check['name']] = loads(res.body)
+        engine = self.application.engine
+        try:
+            ret, executed = yield engine.rerun_group(group, tag, series)
+        except ExecutionError as e:
+            setError(self, error=str(e), code=e.code)
+            return
 
+        self.set_header('X-Executed', str(executed))
         self.finish(dumps(ret))
+
+
+class JobHandler(tornado.web.RequestHandler):
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/jobs/([0-9a-f]{24})', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    @tornado.gen.coroutine
+    def get(self, job_id):
+        # failed, when the process running it stopped
+        job = yield self.application.jobs.get(ObjectId(job_id))
+        if job is None:
+            setError(self, error='Job %s not found' % job_id)
+            return
+
+        self.finish(dumps(job))
+
+
+class JobResultsHandler(tornado.web.RequestHandler):
+    """the results stored so far by a job"""
+
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/jobs/([0-9a-f]{24})/results', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    @tornado.gen.coroutine
+    def get(self, job_id):
+        db = self.application.db
+        results = db.checks.results.find({'job': ObjectId(job_id)})
+        yield stream_json(self, results)
+
+
+class ResultsHandler(tornado.web.RequestHandler):
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/results', cls),
+            (r'/results/(\w+)', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    @tornado.gen.coroutine
+    def get(self, tag=None):
+        """
+        the stored results, newest first, a page at a time (see
+        `paginate`): every execution is stored, there's no listing them
+        all
+        """
+        db = self.application.db
+        condition = {} if tag is None else {'tag': {'$eq': tag}}
+        try:
+            limit = paginate(self, condition, paginated=True,
+                             descending=True)
+        except ValueError as e:
+            setError(self, error=str(e), code=400)
+            return
+
+        results = db.checks.results.find(condition)
+        yield write_page(self, results, limit, descending=True)
+
+
+class ResultHandler(tornado.web.RequestHandler):
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/results/([0-9a-f]{24})', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    @tornado.gen.coroutine
+    def get(self, result_id):
+        db = self.application.db
+        res = yield db.checks.results.find_one({'_id': ObjectId(result_id)})
+        if res is None:
+            setError(self, error='Result %s not found' % result_id)
+            return
+
+        self.finish(dumps(res))
+
+
+class IndexStatsHandler(tornado.web.RequestHandler):
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/admin/indexes', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    @tornado.gen.coroutine
+    def get(self):
+        try:
+            stats = yield index_stats(self.application.db)
+        except Exception as e:
+            log.error(e)
+            setError(self, error=str(e), code=500)
+            return
+
+        self.finish(dumps(stats))
+
+
+class BatchExecHandler(tornado.web.RequestHandler):
+    """
+    Executes a list of checks on a list of tags in one call
+
+    The body is `{"checks": [[group, name], ...], "tags": [tag, ...]}`;
+    results are streamed back as newline delimited JSON, one line per
+    (check, tag) as soon as it completes.
+    """
+
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/exec', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/x-ndjson')
+
+    def parse(self):
+        """returns the ((group, name), ...) and tags asked for"""
+        body = tornado.escape.json_decode(self.request.body)
+        keys = []
+        for key in body['checks']:
+            if isinstance(key, dict):
+                key = (key['group'], key['name'])
+            group, name = key
+            keys.append((str(group), str(name)))
+        tags = [str(tag) for tag in body['tags']]
+        return keys, tags
+
+    @tornado.gen.coroutine
+    def post(self):
+        try:
+            keys, tags = self.parse()
+        except (ValueError, KeyError, TypeError) as e:
+            setError(self, error='Malformed batch: %s' % e, code=400)
+            return
+
+        engine = self.application.engine
+        try:
+            checks = yield engine.load_checks(keys)
+        except Exception as e:
+            log.error(e)
+            setError(self, error=str(e), code=500)
+            return
+
+        def callback(check, tag, res):
+            self.write_line(check['group'], check['name'], tag, res)
+            flush_event(self)
+
+        try:
+            yield engine.execute_many(checks, tags, callback,
+                                      cancelled=lambda: closed(self))
+        except ExecutionError as e:
+            setError(self, error=str(e), code=e.code)
+            return
+        if closed(self):
+            return
+
+        found = set((check['group'], check['name']) for check in checks)
+        for group, name in keys:
+            if (group, name) not in found:
+                error = ExecutionError(
+                    "Check not found %s/%s" % (group, name), code=404)
+                for tag in tags:
+                    self.write_line(group, name, tag, error.to_dict())
+
+        self.finish()
+
+    def write_line(self, group, name, tag, res):
+        self.write(dumps({
+            'group': group,
+            'name': name,
+            'tag': tag,
+            'result': res
+        }))
+        self.write('\n')
+
+
+class DownstreamStatsHandler(tornado.web.RequestHandler):
+    """connection pool usage of the downstream services"""
+
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/admin/downstream', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    def get(self):
+        downstream = self.application.downstream
+        self.finish(json.dumps(dict(
+            (name, client.stats()) for name, client in downstream.items())))
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """metrics of all the processes, in the Prometheus text format"""
+
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/metrics', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+
+    def get(self):
+        self.finish(REGISTRY.render())
+
+
+class WorkersHandler(tornado.web.RequestHandler):
+    """
+    health of the worker processes
+
+    for each worker: its pid, restarts, last exit status and, while it's
+    alive, its last heartbeat (IOLoop lag, downstream usage, jobs queued,
+    results buffered)
+    """
+
+    @classmethod
+    def routes(cls):
+        return [
+            (r'/admin/workers', cls)
+        ]
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    def get(self):
+        app = self.application
+        if app.supervised:
+            health = worker_health(app.config.get('Workers', 'rundir'))
+        else:
+            health = {
+                'supervisor': None,
+                'restarts': 0,
+                'workers': [dict(app.heartbeat.status(), alive=True)]
+            }
+        self.finish(json.dumps(health, default=str))
@@ -0,0 +1,178 @@
+# -*- coding:utf-8 -*-
+
+import logging
+
+import tornado.gen
+import tornado.locks
+
+from checks.downstream import TRANSPORT_ERRORS, transport_code
+from checks.wire import accept, content_type, decode_dep, is_raw
+from checks.metrics import DEP_BYTES, FALLBACKS
+from checks.trace import stage
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FANOUT = 16
+FALLBACK_DEP = 'ZERIQ'
+
+
+class DependencyError(Exception):
+    """Raised when the dependencies of a check cannot be loaded"""
+
+    def __init__(self, message, code=500):
+        super(DependencyError, self).__init__(message)
+        self.code = code
+
+
+class DependencyLoader(object):
+    """
+    Loads the dependencies of a check from DataService
+
+    All the deps are fetched concurrently on the IOLoop, at most `fanout`
+    requests in flight at the same time. Deps missing on DataService are
+    replaced by the `ZERIQ` series of the same tag, which is fetched once
+    and shared by all the missing deps.
+
+    When a `SeriesCache` is given, decoded series are looked up there
+    first and stored there once fetched. With `fmt` 'bson' series are
+    asked as BSON and, when DataService agrees, kept undecoded (see
+    `wire.decode_dep`).
+
+    Fetches, cache hits and fallbacks are recorded in `trace`, when given.
+    Big series are decoded through `offload`, an `Offloader`, when given.
+    """
+
+    def __init__(self, http_client, dataurl, fanout=DEFAULT_FANOUT,
+                 cache=None, fmt='json', trace=None, offload=None):
+        self.http_client = http_client
+        self.dataurl = dataurl
+        self.semaphore = tornado.locks.Semaphore(fanout)
+        self.cache = cache
+        self.headers = {'Accept': accept(fmt)}
+        self.fallbacks = {}
+        self.trace = trace
+        self.offload = offload
+
+    def url(self, tag, dep_name):
+        return "/".join([self.dataurl, tag, dep_name])
+
+    @tornado.gen.coroutine
+    def fetch(self, tag, dep_name):
+        url = self.url(tag, dep_name)
+        log.debug("URL to call for deps: %s", url)
+        with (yield self.semaphore.acquire()):
+            with stage('dep_fetch', self.trace, dep=dep_name,
+                       tag=tag) as span:
+                try:
+                    res = yield self.http_client.fetch(
+                        url, raise_error=False, headers=dict(self.headers))
+                except TRANSPORT_ERRORS as e:
+                    span['code'] = transport_code(e)
+                    raise DependencyError(
+                        "Cannot reach DataService for %s/%s: %s" % (
+                            tag, dep_name, e), code=span['code'])
+                span['code'] = res.code
+                span['bytes'] = len(res.body or b'')
+        if res.body:
+            DEP_BYTES.observe(len(res.body))
+        raise tornado.gen.Return(res)
+
+    @tornado.gen.coroutine
+    def load_series(self, tag, dep_name):
+        """returns the decoded series, `None` if DataService hasn't it"""
+        if self.cache is not None:
+            dep = self.cache.get_series(tag, dep_name)
+            if dep is not None:
+                if self.trace is not None:
+                    self.trace.event('cache_hit', dep=dep_name, tag=tag)
+                raise tornado.gen.Return(dep)
+
+        res = yield self.fetch(tag, dep_name)
+        if res.code == 404:
+            raise tornado.gen.Return(None)
+
+        if res.code < 200 or res.code > 299:
+            raise DependencyError(
+                "Error loading %s/%s from DataService: %s" % (
+                    tag, dep_name, res.code))
+
+        if self.offload is None:
+            dep = decode_dep(res.body, content_type(res))
+        else:
+            dep = yield self.offload.run(len(res.body), decode_dep,
+                                         res.body, content_type(res))
+        if not is_raw(dep) and 'formula' in dep:
+            # questo sta qui solo per ovviare problemi di codec
+            # sul fronte EvalService.
+            #
+            # vanno corretti i dati ed i vari codec delle stringhe
+            del dep['formula']
+
+        if self.cache is not None:
+            self.cache.put_series(tag, dep_name, dep, len(res.body))
+        raise tornado.gen.Return(dep)
+
+    def fallback(self, tag):
+        """returns the (shared) future loading the fallback series"""
+        if tag not in self.fallbacks:
+            self.fallbacks[tag] = self.load_series(tag, FALLBACK_DEP)
+        return self.fallbacks[tag]
+
+    @tornado.gen.coroutine
+    def load_one(self, tag, dep_name):
+        dep = yield self.load_series(tag, dep_name)
+        if dep is None:
+            log.warning("Deps %s for tag %s not found", dep_name, tag)
+            FALLBACKS.inc()
+            if self.trace is not None:
+                self.trace.event('zeriq_fallback', dep=dep_name, tag=tag)
+            dep = yield self.fallback(tag)
+            if dep is None:
+                raise DependencyError(
+                    "Couldn't load ZERIQ after deps unmatched")
+            # not cached under `dep_name`: the series may be published
+            # later; ZERIQ itself is
+
+        raise tornado.gen.Return(dep)
+
+    @tornado.gen.coroutine
+    def load(self, tag, deps_name):
+        """returns a dict dep_name -> series for all the `deps_name`"""
+        deps = yield dict(
+            (dep_name, self.load_one(tag, dep_name))
+            for dep_name in deps_name)
+        raise tornado.gen.Return(deps)
+
+    @tornado.gen.coroutine
+    def load_shared(self, tag, deps_name):
+        """
+        loads each distinct dep in `deps_name` exactly once
+
+        returns a dict dep_name -> series; deps which can't be loaded are
+        mapped to their `DependencyError` instead of failing the whole load,
+        so that only the checks depending on them fail (see `select`)
+        """
+        @tornado.gen.coroutine
+        def load_or_error(dep_name):
+            try:
+                dep = yield self.load_one(tag, dep_name)
+            except DependencyError as e:
+                dep = e
+            raise tornado.gen.Return(dep)
+
+        deps = yield dict(
+            (dep_name, load_or_error(dep_name))
+            for dep_name in set(deps_name))
+        raise tornado.gen.Return(deps)
+
+
+def select(shared, deps_name):
+    """picks `deps_name` from a `load_shared` result"""
+    deps = {}
+    for dep_name in deps_name:
+        dep = shared[dep_name]
+        if isinstance(dep, DependencyError):
+            raise dep
+        deps[dep_name] = dep
+    return deps
@@ -0,0 +1,120 @@
+# -*- coding:utf-8 -*-
+
+import socket
+import logging
+
+import tornado.gen
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.simple_httpclient import HTTPTimeoutError
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CLIENTS = 20
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_REQUEST_TIMEOUT = 120.0
+# CURLE_OPERATION_TIMEDOUT
+CURL_TIMEOUT = 28
+# what a failure to reach a downstream service raises, even with
+# `raise_error=False`
+TRANSPORT_ERRORS = (HTTPClientError, IOError)
+
+
+def transport_code(error):
+    """the status of a check failing on `error`: 504 on timeouts, else 502"""
+    # the simple client raises HTTPTimeoutError, curl a CurlError
+    timeout = isinstance(error, (HTTPTimeoutError, socket.timeout)) or (
+        isinstance(error, HTTPClientError) and
+        getattr(error, 'errno', None) == CURL_TIMEOUT)
+    return 504 if timeout else 502
+
+
+class Downstream(object):
+    """
+    HTTP client for a downstream service
+
+    Each service gets its own connection pool of `max_clients`
+    connections, kept alive between requests unless `keep_alive` is False,
+    its own timeouts and, with `compress`, gzip compressed responses.
+    Requests beyond `max_clients` wait for a free connection: they are
+    counted as `saturated`.
+
+    The underlying client is created on first use, so that it's never
+    shared across a fork.
+    """
+
+    def __init__(self, name, max_clients=DEFAULT_MAX_CLIENTS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 keep_alive=True, compress=False):
+        self.name = name
+        self.max_clients = max_clients
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.keep_alive = keep_alive
+        self.compress = compress
+        self._client = None
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = 0
+        self.saturated = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, config, name):
+        return cls(
+            name,
+            max_clients=config.getint(name, 'maxclients'),
+            connect_timeout=config.getfloat(name, 'connecttimeout'),
+            request_timeout=config.getfloat(name, 'requesttimeout'),
+            keep_alive=config.getboolean(name, 'keepalive'),
+            compress=config.getboolean(name, 'compress'))
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncHTTPClient(force_instance=True,
+                                           max_clients=self.max_clients)
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    @tornado.gen.coroutine
+    def fetch(self, url, **kwargs):
+        kwargs.setdefault('connect_timeout', self.connect_timeout)
+        kwargs.setdefault('request_timeout', self.request_timeout)
+        kwargs.setdefault('decompress_response', self.compress)
+        kwargs.setdefault('validate_cert', False)
+        headers = kwargs.setdefault('headers', {})
+        headers.setdefault('Connection',
+                           'keep-alive' if self.keep_alive else 'close')
+
+        self.requests += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        if self.in_flight > self.max_clients:
+            self.saturated += 1
+        try:
+            res = yield self.client.fetch(url, **kwargs)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+        raise tornado.gen.Return(res)
+
+    def stats(self):
+        return {
+            'max_clients': self.max_clients,
+            'in_flight': self.in_flight,
+            'queued': max(0, self.in_flight - self.max_clients),
+            'peak': self.peak,
+            'requests': self.requests,
+            'saturated': self.saturated,
+            'errors': self.errors
+        }
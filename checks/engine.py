@@ -0,0 +1,422 @@
+# -*- coding:utf-8 -*-
+
+import logging
+
+import tornado.gen
+import tornado.locks
+
+
+from checks.deps import DependencyLoader, DependencyError, select
+from checks.resolver import ResolverError
+from checks.compare import compare
+from checks.evaluators import EvalError, make_evaluator
+from checks.offload import Offloader
+from checks.results import make_result, latest_results
+from checks.metrics import EXECUTIONS
+from checks.trace import stage
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PARALLELISM = 8
+
+
+class ExecutionError(Exception):
+    """Raised when a check cannot be executed"""
+
+    def __init__(self, message, code=500):
+        super(ExecutionError, self).__init__(message)
+        self.code = code
+
+    def to_dict(self):
+        return {'error': str(self), 'code': self.code}
+
+
+class ExecutionEngine(object):
+    """
+    Executes checks in-process
+
+    Checks are read straight from MongoDB and their deps loaded from
+    DataService, through the `Downstream` clients in `app.downstream`;
+    their formulas are evaluated by the `evaluator` backend (see
+    `checks.evaluators`), on EvalService by default. Groups are
+    loaded with a single query and their checks run concurrently, at most
+    `parallelism` at the same time. Series are shared through `cache`, a
+    `SeriesCache`, when given; every outcome is stored through `results`,
+    a `ResultsWriter`, when given. Results are memoized in `memo`, a
+    `ResultCache`, when given. CPU-bound work on big payloads runs through
+    `offload`, an `Offloader`, when given. Checks are looked up in
+    `catalogue`, a `Catalogue`, when given and loaded, and read from
+    MongoDB only when it misses them.
+
+    Methods taking a `trace` record the stages they go through in it (see
+    `checks.trace.Trace`).
+    """
+
+    def __init__(self, app, parallelism=DEFAULT_PARALLELISM, cache=None,
+                 results=None, fmt='json', memo=None, evaluator='remote',
+                 offload=None, catalogue=None):
+        # `app.db` and `app.resolver` are rebound after the fork: always go
+        # through `app` to get them
+        self.app = app
+        self.parallelism = parallelism
+        self.cache = cache
+        self.results = results
+        self.format = fmt
+        self.memo = memo
+        self.offload = offload if offload is not None else Offloader('none')
+        self.evaluator = make_evaluator(evaluator, self)
+        self.catalogue = catalogue
+
+    @property
+    def cataloged(self):
+        return self.catalogue is not None and self.catalogue.ready
+
+    def generations(self, groups):
+        """the catalogue generation of each group, before reading them"""
+        if not self.cataloged:
+            return {}
+        return dict((group, self.catalogue.generation(group))
+                    for group in groups)
+
+    def compiled(self, checks, generations):
+        """
+        `checks` read from MongoDB, added to the catalogue unless their
+        group changed since `generations`
+        """
+        if not self.cataloged:
+            return checks
+        return [self.catalogue.put(check, generations.get(check['group']))
+                for check in checks]
+
+    def loader(self, dataurl, trace=None):
+        return DependencyLoader(self.app.downstream['DataService'], dataurl,
+                                fanout=self.fanout, cache=self.cache,
+                                fmt=self.format, trace=trace,
+                                offload=self.offload)
+
+    @property
+    def collection(self):
+        return self.app.db.checks.checks
+
+    @property
+    def fanout(self):
+        return self.app.config.getint('DataService', 'fanout')
+
+    @tornado.gen.coroutine
+    def endpoints(self, trace=None):
+        resolver = self.app.resolver
+        services = ["DataService"]
+        if self.evaluator.service is not None:
+            services.append(self.evaluator.service)
+        try:
+            with stage('sd_lookup', trace):
+                urls = yield [resolver.resolve(name) for name in services]
+        except ResolverError as e:
+            raise ExecutionError(str(e), code=503)
+
+        dataurl = urls[0] + "/data"
+        execurl = urls[1] + "/eval" if len(urls) > 1 else None
+        log.debug("data url: %s", dataurl)
+        log.debug("exec url: %s", execurl)
+        raise tornado.gen.Return((dataurl, execurl))
+
+    @tornado.gen.coroutine
+    def load_check(self, group, name, trace=None):
+        with stage('check_load', trace):
+            check = None
+            if self.cataloged:
+                check = self.catalogue.get(group, name)
+            if check is None:
+                generations = self.generations([group])
+                check = yield self.collection.find_one({
+                    'group': {'$eq': group},
+                    'name': {'$eq': name}
+                })
+                if check is not None:
+                    check = self.compiled([check], generations)[0]
+        if check is None:
+            raise ExecutionError(
+                "Check not found %s/%s" % (group, name), code=404)
+        raise tornado.gen.Return(check)
+
+    @tornado.gen.coroutine
+    def load_group(self, group, trace=None):
+        with stage('check_load', trace):
+            if self.cataloged and self.catalogue.complete(group):
+                checks = self.catalogue.group(group)
+            else:
+                generation = self.generations([group]).get(group)
+                cursor = self.collection.find({'group': {'$eq': group}})
+                checks = yield cursor.to_list(length=None)
+                if self.cataloged:
+                    # not if a change arrived while reading
+                    checks = self.catalogue.put_group(group, checks,
+                                                      generation)
+        raise tornado.gen.Return(checks)
+
+    @tornado.gen.coroutine
+    def load_checks(self, keys):
+        """loads the checks with the (group, name) `keys` in one query"""
+        if len(keys) == 0:
+            raise tornado.gen.Return([])
+
+        with stage('check_load'):
+            checks, missing = [], keys
+            if self.cataloged:
+                checks = [self.catalogue.get(group, name)
+                          for group, name in keys]
+                missing = [key for key, check in zip(keys, checks)
+                           if check is None]
+                checks = [check for check in checks if check is not None]
+            if len(missing) > 0:
+                generations = self.generations(
+                    set(group for group, _ in missing))
+                cursor = self.collection.find({'$or': [
+                    {'group': {'$eq': group}, 'name': {'$eq': name}}
+                    for group, name in missing
+                ]})
+                found = yield cursor.to_list(length=None)
+                checks.extend(self.compiled(found, generations))
+        raise tornado.gen.Return(checks)
+
+    @tornado.gen.coroutine
+    def execute(self, check, tag, endpoints=None, shared=None, job=None,
+                trace=None):
+        """
+        executes `check` against `tag`, returns the EvalService result
+
+        `shared` are the deps already loaded by `DependencyLoader.load_shared`:
+        when given, nothing is fetched from DataService. The stored result
+        is tagged with `job`, when given.
+        """
+        res = None
+        if self.memo is not None:
+            res = self.memo.get_result(check, tag)
+
+        if res is None:
+            try:
+                res = yield self.evaluate(check, tag, endpoints, shared,
+                                          trace)
+            except ExecutionError as e:
+                EXECUTIONS.inc(outcome='error')
+                self.record(check, tag, error=e, job=job)
+                raise
+            EXECUTIONS.inc(outcome='ok' if res['ok'] else 'failed')
+            if self.memo is not None:
+                self.memo.put_result(check, tag, res)
+        else:
+            EXECUTIONS.inc(outcome='memoized')
+            if trace is not None:
+                trace.event('memoized')
+
+        self.record(check, tag, res, job=job)
+        raise tornado.gen.Return(res)
+
+    def invalidate(self, group, name=None):
+        """
+        forgets the memoized results of a check, or of a whole group, and
+        the plans of the group until they're read again: a group is looked
+        up in the catalogue as a whole
+        """
+        if self.memo is not None:
+            self.memo.invalidate(group, name)
+        if self.catalogue is not None:
+            self.catalogue.forget(group)
+
+    def record(self, check, tag, res=None, error=None, job=None):
+        if self.results is not None:
+            self.results.add(make_result(check, tag, res, error, job))
+
+    @tornado.gen.coroutine
+    def evaluate(self, check, tag, endpoints=None, shared=None, trace=None):
+        if endpoints is None:
+            endpoints = yield self.endpoints(trace)
+        dataurl, execurl = endpoints
+
+        try:
+            if shared is None:
+                loader = self.loader(dataurl, trace)
+                deps = yield loader.load(tag, check['deps'])
+            else:
+                missing = [name for name in check['deps']
+                           if name not in shared]
+                if len(missing) > 0:
+                    # memoized when the shared deps were picked, evicted
+                    # since
+                    loader = self.loader(dataurl, trace)
+                    loaded = yield loader.load(tag, missing)
+                    shared = dict(shared)
+                    shared.update(loaded)
+                deps = select(shared, check['deps'])
+        except DependencyError as e:
+            raise ExecutionError(str(e), code=e.code)
+
+        try:
+            res = yield self.evaluator.evaluate(check, deps, execurl, trace)
+        except EvalError as e:
+            raise ExecutionError(str(e), code=e.code)
+
+        log.debug("Res: %s", res)
+        if check['name'] not in res:
+            raise ExecutionError("No result for %s in %s" % (
+                check['name'], ', '.join(res)), code=502)
+        numbers = res[check['name']]['numbers']
+        try:
+            with stage('compare', trace):
+                res['ok'], res['failures'] = yield self.offload.run(
+                    8 * len(numbers), compare, numbers, check['operator'],
+                    check['threshold'], check.get('tolerance', 0.0))
+        except (TypeError, ValueError) as e:
+            # e.g. numbers which aren't
+            raise ExecutionError(str(e))
+        raise tornado.gen.Return(res)
+
+    @tornado.gen.coroutine
+    def load_shared(self, checks, tag, endpoints, trace=None):
+        """loads once every distinct dep of `checks` for `tag`"""
+        dataurl, _ = endpoints
+        names = set()
+        for check in checks:
+            names.update(check['deps'])
+        log.debug("%s distinct deps for %s checks", len(names), len(checks))
+        loader = self.loader(dataurl, trace)
+        shared = yield loader.load_shared(tag, names)
+        raise tornado.gen.Return(shared)
+
+    @tornado.gen.coroutine
+    def execute_many(self, checks, tags, callback=None, job=None,
+                     trace=None, cancelled=None):
+        """
+        executes every check in `checks` against every tag in `tags`
+
+        The union of the deps of `checks` is fetched once per tag and shared
+        by all the executions on that tag. `callback(check, tag, res)` is
+        called as each execution completes; failed executions report their
+        error as `res`. Stored results are tagged with `job`, when given.
+        With `trace`, shared stages are recorded there and each execution
+        in a child trace. Once `cancelled()` is true, the executions not
+        started yet are skipped.
+        """
+        endpoints = yield self.endpoints(trace)
+        semaphore = tornado.locks.Semaphore(self.parallelism)
+        shared = {}
+        remaining = dict((tag, len(checks)) for tag in tags)
+
+        # decided once: the memo may change while the executions run
+        memoized = set()
+        if self.memo is not None:
+            memoized = set((i, tag) for tag in tags
+                           for i, check in enumerate(checks)
+                           if self.memo.has_result(check, tag))
+
+        def shared_for(tag):
+            if tag not in shared:
+                # memoized checks need no deps
+                shared[tag] = self.load_shared(
+                    [c for i, c in enumerate(checks)
+                     if (i, tag) not in memoized],
+                    tag, endpoints, trace)
+            return shared[tag]
+
+        @tornado.gen.coroutine
+        def run(i, check, tag):
+            with (yield semaphore.acquire()):
+                res = None
+                if cancelled is None or not cancelled():
+                    res = yield attempt(i, check, tag)
+
+                remaining[tag] -= 1
+                if remaining[tag] == 0:
+                    # all done with this tag: free its series
+                    shared.pop(tag, None)
+
+            if res is not None and callback is not None:
+                callback(check, tag, res)
+
+        @tornado.gen.coroutine
+        def attempt(i, check, tag):
+            child = None
+            if trace is not None:
+                child = trace.child(check=check['name'], tag=tag,
+                                    deps=check['deps'])
+            try:
+                deps = None
+                if (i, tag) not in memoized:
+                    deps = yield shared_for(tag)
+                res = yield self.execute(check, tag, shared=deps, job=job,
+                                         trace=child)
+            except ExecutionError as e:
+                log.warning("Check %s/%s failed on %s: %s",
+                            check['group'], check['name'], tag, e)
+                res = e.to_dict()
+            raise tornado.gen.Return(res)
+
+        yield [run(i, check, tag) for tag in tags
+               for i, check in enumerate(checks)]
+
+    @tornado.gen.coroutine
+    def execute_group(self, group, tag, trace=None):
+        """
+        executes all the checks in `group` against `tag`
+
+        returns a dict check name -> result; checks failing to execute
+        report their error in place of the result.
+        """
+        checks = yield self.load_group(group, trace)
+        ret = {}
+
+        def collect(check, tag, res):
+            ret[check['name']] = res
+
+        yield self.execute_many(checks, [tag], collect, trace=trace)
+        raise tornado.gen.Return(ret)
+
+    @tornado.gen.coroutine
+    def load_affected(self, group, series):
+        """loads the checks of `group` depending on any of `series`"""
+        if self.cataloged and self.catalogue.complete(group):
+            raise tornado.gen.Return(self.catalogue.affected(group, series))
+
+        generations = self.generations([group])
+        cursor = self.collection.find({
+            'group': {'$eq': group},
+            'deps': {'$in': list(series)}
+        })
+        checks = yield cursor.to_list(length=None)
+        raise tornado.gen.Return(self.compiled(checks, generations))
+
+    @tornado.gen.coroutine
+    def rerun_group(self, group, tag, series):
+        """
+        re-executes the checks of `group` on `tag` depending on `series`
+
+        `series` have changed on `tag`: they're dropped from the series
+        cache and the results on `tag` of the checks depending on them
+        forgotten, in every group. Returns a tuple (results, executed)
+        where `results` are the new results merged over the latest stored
+        ones, by check name.
+
+        Caches are per process: the other workers keep serving the
+        series and results they hold until they expire (see the
+        [SeriesCache] and [ResultCache] ttl).
+        """
+        if self.cache is not None:
+            for dep_name in series:
+                self.cache.delete((tag, dep_name))
+        if self.memo is not None:
+            # the definitions didn't change: the plans are kept
+            self.memo.invalidate_series(tag, series)
+
+        checks = yield self.load_affected(group, series)
+
+        if self.results is not None:
+            yield self.results.flush()
+        ret = yield latest_results(self.app.db, group, tag)
+
+        def collect(check, tag, res):
+            ret[check['name']] = res
+
+        if len(checks) > 0:
+            yield self.execute_many(checks, [tag], collect)
+        raise tornado.gen.Return((ret, len(checks)))
@@ -0,0 +1,274 @@
+# -*- coding:utf-8 -*-
+
+import re
+import ast
+import logging
+
+import numpy
+import tornado.gen
+
+from checks import wire
+from checks.downstream import TRANSPORT_ERRORS, transport_code
+from checks.cache import LRUCache
+from checks.trace import stage
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 10000
+
+# functions a formula may call when evaluated in-process
+FUNCTIONS = {
+    'abs': numpy.abs,
+    'sqrt': numpy.sqrt,
+    'log': numpy.log,
+    'exp': numpy.exp,
+    'round': numpy.round,
+    'min': numpy.minimum,
+    'max': numpy.maximum
+}
+
+OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+             ast.Pow, ast.USub, ast.UAdd)
+NUMBERS = (ast.Constant,) if hasattr(ast, 'Constant') else (ast.Num,)
+
+
+class EvalError(Exception):
+    """Raised when a formula cannot be evaluated"""
+
+    def __init__(self, message, code=500):
+        super(EvalError, self).__init__(message)
+        self.code = code
+
+
+class RemoteEvaluator(object):
+    """
+    Evaluates the formulas on EvalService
+
+    Bodies are posted in the wire format of the engine; a request falls
+    back to JSON when EvalService doesn't accept BSON, the engine keeps
+    its format.
+    """
+
+    service = 'EvalService'
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @tornado.gen.coroutine
+    def evaluate(self, check, deps, execurl, trace=None):
+        # see exes params in exes/consts.py
+        body = {
+            '.formula': check['formula'],
+            '.deps': deps,
+            '.expected': check['name']
+        }
+
+        res = yield self.post(execurl, body, trace)
+        if res.code < 200 or res.code > 299:
+            code = res.code if res.code >= 400 else 502
+            raise EvalError("Error connecting to EvalService: %s" %
+                            res.body, code=code)
+        res = yield self.engine.offload.run(len(res.body), wire.decode,
+                                            res.body, wire.content_type(res))
+        raise tornado.gen.Return(res)
+
+    @tornado.gen.coroutine
+    def post(self, execurl, body, trace=None, fmt=None):
+        engine = self.engine
+        fmt = fmt or engine.format
+        if fmt == 'json':
+            # BSON deps are kept raw, `formula` included
+            body = dict(body)
+            body['.deps'] = dict((name, wire.plain(dep))
+                                 for name, dep in body['.deps'].items())
+        evalservice = engine.app.downstream['EvalService']
+        payload, content_type = yield engine.offload.run(
+            wire.size(body), wire.encode, body, fmt)
+        with stage('eval', trace, backend='remote', format=fmt) as span:
+            try:
+                res = yield evalservice.fetch(
+                    execurl,
+                    method='POST',
+                    body=payload,
+                    headers={
+                        'Content-Type': content_type,
+                        'Accept': wire.accept(fmt)
+                    },
+                    raise_error=False)
+            except TRANSPORT_ERRORS as e:
+                span['code'] = transport_code(e)
+                raise EvalError("Cannot reach EvalService: %s" % e,
+                                code=span['code'])
+            span['code'] = res.code
+            span['bytes'] = len(res.body or b'')
+        if res.code == 415 and fmt != 'json':
+            log.warning("EvalService doesn't accept %s, using JSON", fmt)
+            res = yield self.post(execurl, body, trace, fmt='json')
+        raise tornado.gen.Return(res)
+
+
+class Constants(ast.NodeTransformer):
+    """
+    replaces the numbers of a formula with names bound to float64 values:
+    no unbounded integer arithmetic (e.g. `9**9**9`) runs on the IOLoop
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def constant(self, node, value):
+        # not an identifier: can't clash with a dep
+        name = '.%d' % len(self.values)
+        self.values[name] = numpy.float64(value)
+        return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+    def visit_Constant(self, node):
+        return self.constant(node, node.value)
+
+    def visit_Num(self, node):
+        return self.constant(node, node.n)
+
+
+class Formula(object):
+    """a formula `target=expression` compiled for `LocalEvaluator`"""
+
+    def __init__(self, formula):
+        target, sep, expression = formula.partition('=')
+        self.target = target.strip()
+        if sep == '' or re.match(r'^\w+$', self.target) is None:
+            raise EvalError("Not a formula: %s" % formula, code=422)
+
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise EvalError("Cannot parse %s: %s" % (formula, e), code=422)
+
+        self.names = set()
+        # functions are only called, never operands
+        called = set(id(node.func) for node in ast.walk(tree)
+                     if isinstance(node, ast.Call))
+        for node in ast.walk(tree):
+            self.validate(node, formula, called)
+        constants = Constants()
+        tree = ast.fix_missing_locations(constants.visit(tree))
+        self.constants = constants.values
+        self.code = compile(tree, '<formula>', 'eval')
+
+    def validate(self, node, formula, called):
+        if isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp,
+                             ast.Load) + OPERATORS):
+            return
+        if isinstance(node, NUMBERS):
+            value = node.value if hasattr(node, 'value') else node.n
+            if isinstance(value, (int, float)) and \
+               not isinstance(value, bool):
+                return
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and \
+               node.func.id in FUNCTIONS and len(node.keywords) == 0:
+                return
+        elif isinstance(node, ast.Name):
+            if node.id not in FUNCTIONS:
+                self.names.add(node.id)
+                return
+            if id(node) in called:
+                return
+        raise EvalError("Cannot evaluate %s in-process: %s not allowed" % (
+            formula, type(node).__name__), code=422)
+
+
+class LocalEvaluator(object):
+    """
+    Evaluates the formulas in-process
+
+    A formula is an arithmetic expression of its deps, the functions in
+    `FUNCTIONS` and numbers: anything else (attributes, subscripts,
+    builtins...) is refused. Formulas are compiled once and kept in an LRU
+    cache of `size` entries, failures included; they're evaluated without
+    builtins over the numbers of the deps as float64 arrays, aligned by
+    position.
+    """
+
+    service = None
+
+    def __init__(self, engine=None, size=DEFAULT_SIZE):
+        self.formulas = LRUCache(size=size, ttl=float('inf'))
+
+    def compile(self, formula):
+        compiled = self.formulas.get(formula)
+        if compiled is None:
+            try:
+                compiled = Formula(formula)
+            except EvalError as e:
+                compiled = e
+            self.formulas.put(formula, compiled)
+        if isinstance(compiled, EvalError):
+            raise compiled
+        return compiled
+
+    def supports(self, check):
+        try:
+            formula = self.compile(check['formula'])
+        except EvalError:
+            return False
+        return formula.names.issubset(check['deps'])
+
+    @tornado.gen.coroutine
+    def evaluate(self, check, deps, execurl=None, trace=None):
+        formula = self.compile(check['formula'])
+        missing = formula.names.difference(deps)
+        if len(missing) > 0:
+            raise EvalError("Unknown names in %s: %s" % (
+                check['formula'], ', '.join(sorted(missing))), code=422)
+
+        with stage('eval', trace, backend='local'):
+            namespace = dict(FUNCTIONS)
+            namespace.update(formula.constants)
+            for name in formula.names:
+                namespace[name] = numpy.asarray(deps[name]['numbers'],
+                                                dtype=numpy.float64)
+            try:
+                with numpy.errstate(all='ignore'):
+                    result = eval(formula.code, {'__builtins__': {}},
+                                  namespace)
+            except (ValueError, TypeError, ArithmeticError) as e:
+                raise EvalError("Cannot evaluate %s: %s" % (
+                    check['formula'], e))
+            result = numpy.atleast_1d(result)
+            if result.dtype.kind not in 'biuf':
+                raise EvalError("%s is not a number" % check['formula'],
+                                code=422)
+
+        raise tornado.gen.Return({
+            formula.target: {'numbers': result.tolist()}
+        })
+
+
+class AutoEvaluator(object):
+    """in-process when the formula allows it, on EvalService otherwise"""
+
+    service = 'EvalService'
+
+    def __init__(self, engine):
+        self.local = LocalEvaluator(engine)
+        self.remote = RemoteEvaluator(engine)
+
+    def evaluate(self, check, deps, execurl, trace=None):
+        if self.local.supports(check):
+            return self.local.evaluate(check, deps, execurl, trace)
+        return self.remote.evaluate(check, deps, execurl, trace)
+
+
+EVALUATORS = {
+    'remote': RemoteEvaluator,
+    'local': LocalEvaluator,
+    'auto': AutoEvaluator
+}
+
+
+def make_evaluator(name, engine):
+    if name not in EVALUATORS:
+        raise ValueError("Unknown evaluator %s, not in %s" % (
+            name, ', '.join(sorted(EVALUATORS))))
+    return EVALUATORS[name](engine)
@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+
+import logging
+
+import tornado.gen
+
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+
+log = logging.getLogger(__name__)
+
+# indexes of the collections in the `checks` database
+INDEXES = {
+    'checks': [
+        IndexModel([('group', ASCENDING), ('name', ASCENDING)],
+                   unique=True, name='group_name'),
+        IndexModel([('deps', ASCENDING)], name='deps'),
+    ],
+    'results': [
+        IndexModel([('tag', ASCENDING), ('timestamp', DESCENDING)],
+                   name='tag_timestamp'),
+        IndexModel([('tag', ASCENDING), ('_id', DESCENDING)],
+                   name='tag_id'),
+        IndexModel([('group', ASCENDING), ('tag', ASCENDING),
+                    ('timestamp', DESCENDING)],
+                   name='group_tag_timestamp'),
+        IndexModel([('timestamp', DESCENDING)], name='timestamp'),
+        IndexModel([('job', ASCENDING)], name='job', sparse=True),
+    ]
+}
+
+
+@tornado.gen.coroutine
+def ensure_indexes(db):
+    """
+    builds the `INDEXES` missing in `db`
+
+    Creating an index which already exists is a no-op, so this can run at
+    every startup. Failures (e.g. duplicated checks preventing the unique
+    index) are logged and don't stop the service.
+    """
+    for collection, indexes in sorted(INDEXES.items()):
+        try:
+            names = yield db.checks[collection].create_indexes(indexes)
+            log.info("Indexes on %s: %s", collection, ', '.join(names))
+        except Exception as e:
+            log.error("Cannot create indexes on %s: %s", collection, e)
+
+
+@tornado.gen.coroutine
+def index_stats(db):
+    """returns the usage stats of the indexes, by collection"""
+    stats = {}
+    for collection in sorted(INDEXES):
+        cursor = db.checks[collection].aggregate([{'$indexStats': {}}])
+        indexes = yield cursor.to_list(length=None)
+        stats[collection] = dict(
+            (index['name'], {
+                'key': index['key'],
+                'ops': index['accesses']['ops'],
+                'since': index['accesses']['since']
+            }) for index in indexes)
+    raise tornado.gen.Return(stats)
@@ -0,0 +1,214 @@
+# -*- coding:utf-8 -*-
+
+import os
+import time
+import logging
+import datetime
+
+import tornado.gen
+import tornado.ioloop
+import tornado.queues
+
+from bson import ObjectId
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 100
+DEFAULT_INTERVAL = 1.0
+DEFAULT_EXPIRY = 60.0
+ACTIVE = ('queued', 'running')
+
+
+class JobError(Exception):
+    """Raised when a job cannot be submitted"""
+
+    def __init__(self, message, code=503):
+        super(JobError, self).__init__(message)
+        self.code = code
+
+
+class JobQueue(object):
+    """
+    Bounded in-process queue of group executions
+
+    Jobs are run by `workers` coroutines, at most `size` of them waiting.
+    Their state lives in `db.checks.jobs`, so that any process can report
+    it; progress (checks done, not passing and failing to execute) is
+    written at most every `interval` seconds. Results are stored by the
+    engine, tagged with the job id.
+
+    The process owning queued and running jobs beats on them every
+    `expiry` / 4 seconds: jobs left without a beat for `expiry` seconds
+    belonged to a process which died, they're `expire`-d as failed when a
+    queue starts and when they're looked up (see `get`).
+    """
+
+    def __init__(self, app, workers=DEFAULT_WORKERS, size=DEFAULT_QUEUE,
+                 interval=DEFAULT_INTERVAL, expiry=DEFAULT_EXPIRY,
+                 clock=time.time):
+        # `app.db` is rebound after the fork: always go through `app`
+        self.app = app
+        self.workers = workers
+        self.queue = tornado.queues.Queue(maxsize=size)
+        self.interval = interval
+        self.expiry = expiry
+        self.clock = clock
+        self.owned = set()
+        self.periodic = None
+
+    @property
+    def collection(self):
+        return self.app.db.checks.jobs
+
+    def start(self):
+        io_loop = tornado.ioloop.IOLoop.current()
+        for _ in range(self.workers):
+            io_loop.spawn_callback(self.work)
+        io_loop.spawn_callback(self.expire)
+        self.periodic = tornado.ioloop.PeriodicCallback(
+            self.beat, self.expiry * 1000 / 4)
+        self.periodic.start()
+
+    def stop(self):
+        if self.periodic is not None:
+            self.periodic.stop()
+
+    @tornado.gen.coroutine
+    def beat(self):
+        """tells the jobs of this process are still alive"""
+        if len(self.owned) == 0:
+            return
+        try:
+            yield self.collection.update_many(
+                {'_id': {'$in': list(self.owned)}},
+                {'$set': {'heartbeat': datetime.datetime.utcnow()}})
+        except Exception as e:
+            log.error("Cannot beat on %s jobs: %s", len(self.owned), e)
+
+    @tornado.gen.coroutine
+    def expire(self, condition=None):
+        """marks as failed the jobs matching `condition` without a beat"""
+        last = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self.expiry)
+        condition = dict(condition or {}, status={'$in': list(ACTIVE)})
+        # jobs submitted before the beats have none
+        condition['$or'] = [
+            {'heartbeat': {'$lt': last}},
+            {'heartbeat': {'$exists': False}, 'created': {'$lt': last}}
+        ]
+        try:
+            res = yield self.collection.update_many(condition, {'$set': {
+                'status': 'failed',
+                'error': 'The process running the job stopped',
+                'finished': datetime.datetime.utcnow()
+            }})
+        except Exception as e:
+            log.error("Cannot expire the jobs: %s", e)
+            return
+        if res.modified_count > 0:
+            log.warning("%s jobs of stopped processes failed",
+                        res.modified_count)
+
+    @tornado.gen.coroutine
+    def get(self, job_id):
+        """the job `job_id`, `None` if unknown"""
+        job = yield self.collection.find_one({'_id': job_id})
+        if job is not None and job['status'] in ACTIVE:
+            yield self.expire({'_id': job_id})
+            job = yield self.collection.find_one({'_id': job_id})
+        raise tornado.gen.Return(job)
+
+    @tornado.gen.coroutine
+    def submit(self, group, tag):
+        """queues the execution of `group` on `tag`, returns the job id"""
+        if self.queue.full():
+            raise JobError("Too many jobs queued, retry later")
+
+        job = {
+            '_id': ObjectId(),
+            'group': group,
+            'tag': tag,
+            'status': 'queued',
+            'total': None,
+            'done': 0,
+            'failures': 0,
+            'errors': 0,
+            'pid': os.getpid(),
+            'created': datetime.datetime.utcnow()
+        }
+        job['heartbeat'] = job['created']
+        yield self.collection.insert_one(job)
+        try:
+            self.queue.put_nowait(job)
+        except tornado.queues.QueueFull:
+            # filled up by other submissions while inserting
+            yield self.collection.delete_one({'_id': job['_id']})
+            raise JobError("Too many jobs queued, retry later")
+        self.owned.add(job['_id'])
+        raise tornado.gen.Return(job['_id'])
+
+    @tornado.gen.coroutine
+    def work(self):
+        while True:
+            job = yield self.queue.get()
+            try:
+                yield self.run(job)
+            except Exception as e:
+                log.error("Job %s failed: %s", job['_id'], e)
+                yield self.update(job, {
+                    'status': 'failed',
+                    'error': str(e),
+                    'finished': datetime.datetime.utcnow()
+                })
+            finally:
+                self.owned.discard(job['_id'])
+                self.queue.task_done()
+
+    @tornado.gen.coroutine
+    def run(self, job):
+        engine = self.app.engine
+        checks = yield engine.load_group(job['group'])
+        job['total'] = len(checks)
+        yield self.update(job, {
+            'status': 'running',
+            'total': job['total'],
+            'started': datetime.datetime.utcnow()
+        })
+
+        progress = {'written': self.clock()}
+
+        def callback(check, tag, res):
+            job['done'] += 1
+            if 'error' in res:
+                job['errors'] += 1
+            if not res.get('ok'):
+                job['failures'] += 1
+            if self.clock() - progress['written'] >= self.interval:
+                progress['written'] = self.clock()
+                tornado.ioloop.IOLoop.current().spawn_callback(
+                    self.update, job, {})
+
+        yield engine.execute_many(checks, [job['tag']], callback,
+                                  job=job['_id'])
+        yield self.update(job, {
+            'status': 'done',
+            'finished': datetime.datetime.utcnow()
+        })
+
+    @tornado.gen.coroutine
+    def update(self, job, fields):
+        # counters only grow: `$max` keeps a late progress write from
+        # rolling them back
+        update = {'$max': {
+            'done': job['done'],
+            'failures': job['failures'],
+            'errors': job['errors']
+        }}
+        if len(fields) > 0:
+            update['$set'] = fields
+        try:
+            yield self.collection.update_one({'_id': job['_id']}, update)
+        except Exception as e:
+            log.error("Cannot update job %s: %s", job['_id'], e)
@@ -0,0 +1,274 @@
+# -*- coding:utf-8 -*-
+
+import os
+import glob
+import json
+import time
+import logging
+import contextlib
+
+import tornado.ioloop
+
+from tornado.log import access_log
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                 16777216, 67108864)
+DEFAULT_INTERVAL = 5.0
+
+
+class Metric(object):
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        if key not in self.values:
+            # a count per bucket, then the total count and sum
+            self.values[key] = [0] * len(self.buckets) + [0, 0.0]
+        sample = self.values[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                sample[i] += 1
+        sample[-2] += 1
+        sample[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+
+class Registry(object):
+    """
+    Counters and histograms of this process, in Prometheus format
+
+    With `path` set, processes forked by `server.start(nproc)` share their
+    metrics through it: every process dumps its own snapshot there every
+    `interval` seconds (see `start`) and `render` sums all the snapshots.
+    `collectors` are called at each snapshot to refresh counters kept
+    elsewhere (e.g. cache hits).
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.path = None
+        self.periodic = None
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self, path):
+        """removes the snapshots left in `path` by former processes"""
+        for filename in glob.glob(os.path.join(path, 'metrics-*.json')):
+            try:
+                os.remove(filename)
+            except OSError as e:
+                log.warning("Cannot remove %s: %s", filename, e)
+
+    def start(self, path, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.periodic = tornado.ioloop.PeriodicCallback(
+            self.dump, interval * 1000)
+        self.periodic.start()
+
+    def stop(self):
+        if self.periodic is not None:
+            self.periodic.stop()
+            self.dump()
+
+    def snapshot(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                log.warning("Metrics collector failed: %s", e)
+
+        return dict((metric.name, [
+            [list(key), value] for key, value in metric.values.items()
+        ]) for metric in self.metrics)
+
+    def filename(self, pid=None):
+        return os.path.join(self.path,
+                            'metrics-%s.json' % (pid or os.getpid()))
+
+    def dump(self):
+        filename = self.filename()
+        try:
+            with open(filename + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.rename(filename + '.tmp', filename)
+        except (IOError, OSError) as e:
+            log.warning("Cannot dump metrics to %s: %s", filename, e)
+
+    def snapshots(self):
+        """the snapshots of all the processes, this one up to date"""
+        if self.path is None:
+            return [self.snapshot()]
+
+        snapshots = [self.snapshot()]
+        for filename in glob.glob(os.path.join(self.path, 'metrics-*.json')):
+            if filename == self.filename():
+                continue
+            try:
+                with open(filename) as f:
+                    snapshots.append(json.load(f))
+            except (IOError, OSError, ValueError) as e:
+                log.warning("Cannot read metrics from %s: %s", filename, e)
+        return snapshots
+
+    def merge(self, snapshots):
+        merged = {}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                values = merged.setdefault(name, {})
+                for key, value in samples:
+                    key = tuple(key)
+                    if key not in values:
+                        values[key] = value
+                    elif isinstance(value, list):
+                        values[key] = [a + b
+                                       for a, b in zip(values[key], value)]
+                    else:
+                        values[key] += value
+        return merged
+
+    def render(self):
+        """all the metrics in the Prometheus text format"""
+        merged = self.merge(self.snapshots())
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for key, value in sorted(merged.get(metric.name, {}).items()):
+                labels = list(zip(metric.labels, key))
+                if metric.type == 'counter':
+                    lines.append(sample(metric.name, labels, value))
+                    continue
+
+                for bound, count in zip(metric.buckets, value):
+                    lines.append(sample(metric.name + '_bucket',
+                                        labels + [('le', repr(bound))],
+                                        count))
+                lines.append(sample(metric.name + '_bucket',
+                                    labels + [('le', '+Inf')], value[-2]))
+                lines.append(sample(metric.name + '_count', labels,
+                                    value[-2]))
+                lines.append(sample(metric.name + '_sum', labels, value[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+def sample(name, labels, value):
+    if len(labels) == 0:
+        return '%s %s' % (name, value)
+    return '%s{%s} %s' % (name, ','.join(
+        '%s="%s"' % (label, text.replace('\\', '\\\\').replace('"', '\\"'))
+        for label, text in labels), value)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'checks_stage_seconds',
+    'Time spent in each stage of a check execution', ('stage',))
+DEP_BYTES = REGISTRY.histogram(
+    'checks_dep_bytes', 'Size of the series fetched from DataService',
+    buckets=BYTES_BUCKETS)
+FALLBACKS = REGISTRY.counter(
+    'checks_zeriq_fallbacks_total', 'Deps replaced by the ZERIQ series')
+EXECUTIONS = REGISTRY.counter(
+    'checks_executions_total', 'Check executions by outcome', ('outcome',))
+REQUESTS = REGISTRY.counter(
+    'checks_requests_total', 'HTTP requests served',
+    ('handler', 'method', 'code'))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'checks_request_seconds', 'Time spent serving HTTP requests',
+    ('handler', 'method'))
+REQUEST_BYTES = REGISTRY.histogram(
+    'checks_request_bytes', 'Size of the HTTP request bodies',
+    ('handler',), buckets=BYTES_BUCKETS)
+RESPONSE_BYTES = REGISTRY.histogram(
+    'checks_response_bytes',
+    'Size of the HTTP responses (streamed ones are not counted)',
+    ('handler',), buckets=BYTES_BUCKETS)
+OFFLOADED = REGISTRY.counter(
+    'checks_offloaded_total', 'Work run off the IOLoop', ('work',))
+CACHE = REGISTRY.counter(
+    'checks_cache_total', 'Cache lookups by cache and outcome',
+    ('cache', 'outcome'))
+
+
+def collect_cache(name, cache):
+    """exports the hits and misses of `cache` at every snapshot"""
+    def collector():
+        stats = cache.stats()
+        CACHE.values[CACHE.key({'cache': name, 'outcome': 'hit'})] = \
+            stats['hits']
+        CACHE.values[CACHE.key({'cache': name, 'outcome': 'miss'})] = \
+            stats['misses']
+    REGISTRY.collectors.append(collector)
+
+
+def log_request(handler):
+    """
+    `log_function` of the application: counts the request, then logs it
+    as tornado does
+    """
+    name = type(handler).__name__
+    method = handler.request.method
+    status = handler.get_status()
+    request_time = handler.request.request_time()
+
+    REQUESTS.inc(handler=name, method=method, code=status)
+    REQUEST_SECONDS.observe(request_time, handler=name, method=method)
+    if handler.request.body:
+        REQUEST_BYTES.observe(len(handler.request.body), handler=name)
+    length = handler._headers.get('Content-Length')
+    if length is not None:
+        RESPONSE_BYTES.observe(int(length), handler=name)
+
+    if status < 400:
+        log_method = access_log.info
+    elif status < 500:
+        log_method = access_log.warning
+    else:
+        log_method = access_log.error
+    log_method("%d %s %.2fms", status, handler._request_summary(),
+               1000.0 * request_time)
@@ -0,0 +1,71 @@
+# -*- coding:utf-8 -*-
+
+import logging
+
+import tornado.gen
+import tornado.ioloop
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from checks.metrics import OFFLOADED
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_KIND = 'thread'
+DEFAULT_WORKERS = 4
+DEFAULT_THRESHOLD = 1024 * 1024
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor
+}
+
+
+class Offloader(object):
+    """
+    Runs CPU-bound work (decoding, encoding, comparisons) off the IOLoop
+
+    Work on payloads of `threshold` bytes or more runs on a pool of
+    `workers` threads or processes, depending on `kind`; smaller payloads
+    are handled inline, where the hop would cost more than it saves. With
+    `kind` 'none' everything runs inline.
+
+    Processes get their arguments and return their results pickled: they
+    pay off for decoding, where only bytes go in. The pool is created on
+    first use, so that it's never shared across a fork.
+    """
+
+    def __init__(self, kind=DEFAULT_KIND, workers=DEFAULT_WORKERS,
+                 threshold=DEFAULT_THRESHOLD):
+        if kind != 'none' and kind not in EXECUTORS:
+            raise ValueError("Unknown executor %s, not in none, %s" % (
+                kind, ', '.join(sorted(EXECUTORS))))
+        self.kind = kind
+        self.workers = workers
+        self.threshold = threshold
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = EXECUTORS[self.kind](max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def offloads(self, size):
+        return self.kind != 'none' and size >= self.threshold
+
+    @tornado.gen.coroutine
+    def run(self, size, fn, *args):
+        """returns `fn(*args)`, run on the pool when `size` is big enough"""
+        if not self.offloads(size):
+            raise tornado.gen.Return(fn(*args))
+
+        OFFLOADED.inc(work=fn.__name__)
+        res = yield tornado.ioloop.IOLoop.current().run_in_executor(
+            self.executor, fn, *args)
+        raise tornado.gen.Return(res)
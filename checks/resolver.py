@@ -0,0 +1,140 @@
+# -*- coding:utf-8 -*-
+
+import time
+import json
+import logging
+
+import tornado.gen
+import tornado.ioloop
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado.httpclient import AsyncHTTPClient
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TTL = 30
+DEFAULT_REFRESH = 10
+
+
+class ResolverError(Exception):
+    """Raised when a service cannot be resolved"""
+
+
+class Endpoints(object):
+    """the healthy instances of a service, served round-robin"""
+
+    def __init__(self, urls, expires):
+        self.urls = urls
+        self.expires = expires
+        self.next = 0
+
+    def pick(self):
+        url = self.urls[self.next % len(self.urls)]
+        self.next += 1
+        return url
+
+
+class ServiceResolver(object):
+    """
+    Non-blocking, cached front-end to `ServiceDiscovery`
+
+    `ServiceDiscovery.getService` blocks on Consul: it runs here on a
+    thread pool and only to learn the scheme of the service. Healthy
+    instances come from the Consul health API, queried asynchronously.
+    Endpoints are cached for `ttl` seconds and refreshed in background
+    every `refresh` seconds once `start` has been called; when a refresh
+    fails the last known endpoints are kept.
+    """
+
+    def __init__(self, sd, endpoint, ttl=DEFAULT_TTL, refresh=DEFAULT_REFRESH,
+                 clock=time.time):
+        self.sd = sd
+        self.endpoint = endpoint.rstrip('/')
+        self.ttl = ttl
+        self.refresh = refresh
+        self.clock = clock
+        self.cache = {}
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.periodic = None
+
+    def start(self):
+        self.periodic = tornado.ioloop.PeriodicCallback(
+            self.refresh_all, self.refresh * 1000)
+        self.periodic.start()
+
+    def stop(self):
+        if self.periodic is not None:
+            self.periodic.stop()
+        self.executor.shutdown(wait=False)
+
+    @tornado.gen.coroutine
+    def resolve(self, name):
+        """returns the URL of a healthy instance of service `name`"""
+        endpoints = self.cache.get(name)
+        if endpoints is None or endpoints.expires < self.clock():
+            endpoints = yield self.lookup(name)
+        raise tornado.gen.Return(endpoints.pick())
+
+    @tornado.gen.coroutine
+    def refresh_all(self):
+        for name in list(self.cache):
+            try:
+                yield self.lookup(name)
+            except Exception as e:
+                log.warning("Cannot refresh endpoints of %s: %s", name, e)
+
+    def lookup(self, name):
+        """looks `name` up, sharing the lookup among concurrent callers"""
+        if name not in self.pending:
+            future = self.fetch(name)
+            self.pending[name] = future
+            future.add_done_callback(lambda _: self.pending.pop(name, None))
+        return self.pending[name]
+
+    @tornado.gen.coroutine
+    def fetch(self, name):
+        try:
+            url = yield tornado.ioloop.IOLoop.current().run_in_executor(
+                self.executor, self.sd.getService, name)
+            urls = yield self.healthy(name, urlparse(url).scheme or 'http')
+            if len(urls) == 0:
+                urls = [url]
+        except Exception as e:
+            if name not in self.cache:
+                raise ResolverError("Cannot resolve %s: %s" % (name, e))
+            log.warning("Using stale endpoints for %s: %s", name, e)
+            raise tornado.gen.Return(self.cache[name])
+
+        log.debug("Endpoints for %s: %s", name, urls)
+        endpoints = Endpoints(urls, self.clock() + self.ttl)
+        previous = self.cache.get(name)
+        if previous is not None:
+            endpoints.next = previous.next
+        self.cache[name] = endpoints
+        raise tornado.gen.Return(endpoints)
+
+    @tornado.gen.coroutine
+    def healthy(self, name, scheme):
+        """returns the URLs of the instances passing the Consul checks"""
+        url = "%s/v1/health/service/%s?passing=true" % (self.endpoint, name)
+        try:
+            res = yield AsyncHTTPClient().fetch(url, validate_cert=False)
+            instances = json.loads(res.body)
+        except Exception as e:
+            log.debug("Cannot list healthy %s instances: %s", name, e)
+            raise tornado.gen.Return([])
+
+        urls = []
+        for instance in instances:
+            service = instance.get('Service', {})
+            address = service.get('Address') or \
+                instance.get('Node', {}).get('Address')
+            urls.append("%s://%s:%s" % (scheme, address, service['Port']))
+        raise tornado.gen.Return(sorted(urls))
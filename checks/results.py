@@ -0,0 +1,144 @@
+# -*- coding:utf-8 -*-
+
+import logging
+import datetime
+
+import tornado.gen
+import tornado.ioloop
+import tornado.locks
+
+from pymongo.errors import BulkWriteError
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH = 500
+DEFAULT_INTERVAL = 1.0
+DUPLICATE_KEY = 11000
+
+
+def make_result(check, tag, res=None, error=None, job=None):
+    """builds the document stored for an execution of `check` on `tag`"""
+    doc = {
+        'group': check['group'],
+        'name': check['name'],
+        'tag': tag,
+        'timestamp': datetime.datetime.utcnow()
+    }
+    if job is not None:
+        doc['job'] = job
+    if error is not None:
+        doc['ok'] = False
+        doc['error'] = str(error)
+        doc['code'] = getattr(error, 'code', 500)
+    else:
+        doc['ok'] = res['ok']
+        doc['failures'] = res['failures']
+        doc['result'] = res.get(check['name'])
+    return doc
+
+
+def from_result(doc):
+    """rebuilds the response of an execution from its stored document"""
+    if 'error' in doc:
+        return {'error': doc['error'], 'code': doc['code']}
+    return {
+        doc['name']: doc['result'],
+        'ok': doc['ok'],
+        'failures': doc['failures']
+    }
+
+
+@tornado.gen.coroutine
+def latest_results(db, group, tag):
+    """returns the latest stored result of each check of `group` on `tag`"""
+    cursor = db.checks.results.aggregate([
+        {'$match': {'group': group, 'tag': tag}},
+        {'$sort': {'timestamp': -1}},
+        {'$group': {'_id': '$name', 'doc': {'$first': '$$ROOT'}}}
+    ])
+    docs = yield cursor.to_list(length=None)
+    raise tornado.gen.Return(dict(
+        (doc['_id'], from_result(doc['doc'])) for doc in docs))
+
+
+class ResultsWriter(object):
+    """
+    Buffers execution results and stores them in bulk
+
+    Results are written with `insert_many`, `batch` at a time, as soon as
+    `batch` of them are buffered or, at the latest, every `interval`
+    seconds once `start` has been called. A failed write is retried with
+    the next one, keeping at most `10 * batch` results buffered; of a
+    partial write only the results not stored are retried.
+    """
+
+    def __init__(self, app, batch=DEFAULT_BATCH, interval=DEFAULT_INTERVAL):
+        # `app.db` is rebound after the fork: always go through `app`
+        self.app = app
+        self.batch = batch
+        self.interval = interval
+        self.buffer = []
+        self.lock = tornado.locks.Lock()
+        self.scheduled = False
+        self.periodic = None
+
+    @property
+    def collection(self):
+        return self.app.db.checks.results
+
+    def start(self):
+        self.periodic = tornado.ioloop.PeriodicCallback(
+            self.flush, self.interval * 1000)
+        self.periodic.start()
+
+    @tornado.gen.coroutine
+    def stop(self):
+        if self.periodic is not None:
+            self.periodic.stop()
+        yield self.flush()
+
+    def add(self, doc):
+        self.buffer.append(doc)
+        if len(self.buffer) >= self.batch and not self.scheduled:
+            self.scheduled = True
+            tornado.ioloop.IOLoop.current().spawn_callback(self.flush)
+
+    @tornado.gen.coroutine
+    def flush(self):
+        # one write at a time
+        with (yield self.lock.acquire()):
+            self.scheduled = False
+            while len(self.buffer) > 0:
+                docs = self.buffer[:self.batch]
+                self.buffer = self.buffer[self.batch:]
+                try:
+                    yield self.collection.insert_many(docs, ordered=False)
+                    log.debug("%s results stored", len(docs))
+                except BulkWriteError as e:
+                    failed = self.failed(docs, e.details)
+                    if len(failed) > 0:
+                        log.error("Cannot store %s of %s results: %s",
+                                  len(failed), len(docs), e)
+                        self.requeue(failed)
+                        return
+                    log.debug("%s results stored, the others already were",
+                              e.details['nInserted'])
+                except Exception as e:
+                    # _ids set by insert_many are kept: the documents
+                    # already stored fail the retry as duplicates and are
+                    # not doubled
+                    log.error("Cannot store %s results: %s", len(docs), e)
+                    self.requeue(docs)
+                    return
+
+    def failed(self, docs, details):
+        """
+        the `docs` a bulk write didn't store: stored ones, and those
+        already stored by a former attempt (duplicate keys), are dropped
+        """
+        return [docs[error['index']] for error in details['writeErrors']
+                if error['code'] != DUPLICATE_KEY]
+
+    def requeue(self, docs):
+        self.buffer = (docs + self.buffer)[-10 * self.batch:]
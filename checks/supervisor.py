@@ -0,0 +1,259 @@
+# -*- coding:utf-8 -*-
+
+import os
+import glob
+import json
+import time
+import errno
+import signal
+import logging
+
+import tornado.ioloop
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_RESTARTS = 100
+DEFAULT_HEARTBEAT = 5.0
+MIN_UPTIME = 1.0
+SUPERVISOR_FILE = 'supervisor.json'
+WORKER_FILE = 'worker-%s.json'
+
+
+def write_json(path, data):
+    """writes `data` to `path` atomically"""
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, default=str)
+        os.rename(path + '.tmp', path)
+    except (IOError, OSError) as e:
+        log.warning("Cannot write %s: %s", path, e)
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class Supervisor(object):
+    """
+    Pre-forks `nproc` workers and keeps them running
+
+    Each worker runs `worker(task_id)` in a child process, forked before
+    any IOLoop, database or HTTP client exists, so that every worker
+    creates its own. Workers exiting while the supervisor is not stopping
+    are restarted, after a pause when they didn't last `MIN_UPTIME`
+    seconds; past `max_restarts` restarts the supervisor stops all the
+    workers and gives up.
+
+    The state of the workers (pid, start, restarts, last exit status) is
+    written to `run_dir`, where workers write their heartbeats (see
+    `Heartbeat` and `worker_health`).
+    """
+
+    def __init__(self, nproc, worker, run_dir,
+                 max_restarts=DEFAULT_MAX_RESTARTS, clock=time.time,
+                 sleep=time.sleep):
+        self.nproc = nproc
+        self.worker = worker
+        self.run_dir = run_dir
+        self.max_restarts = max_restarts
+        self.clock = clock
+        self.sleep = sleep
+        self.children = {}
+        self.state = {}
+        self.restarts = 0
+        self.stopping = False
+        self.failed = False
+
+    def spawn(self, task_id):
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT):
+                signal.signal(sig, signal.SIG_DFL)
+            code = 0
+            try:
+                self.worker(task_id)
+            except BaseException:
+                log.exception("Worker %s failed", task_id)
+                code = 1
+            finally:
+                os._exit(code)
+
+        log.info("Worker %s started (PID: %s)", task_id, pid)
+        self.children[pid] = task_id
+        state = self.state.setdefault(task_id, {
+            'task': task_id, 'restarts': 0, 'exit': None})
+        state.update({'pid': pid, 'started': self.clock()})
+        self.dump()
+
+    def run(self, handle_signals=True):
+        """forks the workers and supervises them until `stop`"""
+        if handle_signals:
+            for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT):
+                signal.signal(sig, lambda sig, frame: self.stop(sig))
+
+        if self.run_dir:
+            # heartbeats of former workers
+            for path in glob.glob(os.path.join(self.run_dir,
+                                               WORKER_FILE % '*')):
+                os.remove(path)
+
+        for task_id in range(self.nproc):
+            self.spawn(task_id)
+
+        while len(self.children) > 0:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            task_id = self.children.pop(pid, None)
+            if task_id is None:
+                continue
+            self.exited(task_id, status)
+
+        self.dump()
+        if self.failed:
+            raise RuntimeError("Too many worker restarts")
+
+    def exited(self, task_id, status):
+        state = self.state[task_id]
+        if os.WIFSIGNALED(status):
+            state['exit'] = 'signal %s' % os.WTERMSIG(status)
+        else:
+            state['exit'] = 'status %s' % os.WEXITSTATUS(status)
+        state['pid'] = None
+        self.dump()
+
+        if self.stopping:
+            log.info("Worker %s stopped (%s)", task_id, state['exit'])
+            return
+
+        log.warning("Worker %s exited (%s)", task_id, state['exit'])
+        if self.restarts >= self.max_restarts:
+            log.error("Too many restarts, giving up")
+            self.failed = True
+            self.stop()
+            return
+
+        if self.clock() - state['started'] < MIN_UPTIME:
+            # crashing at startup: don't spin
+            self.sleep(MIN_UPTIME)
+            if self.stopping:
+                # stopped while sleeping: nobody would stop the new worker
+                log.info("Worker %s not restarted", task_id)
+                return
+        self.restarts += 1
+        state['restarts'] += 1
+        self.spawn(task_id)
+
+    def stop(self, sig=signal.SIGTERM):
+        """stops the workers, forwarding them `sig`"""
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except OSError:
+                pass
+
+    def dump(self):
+        if self.run_dir:
+            write_json(os.path.join(self.run_dir, SUPERVISOR_FILE), {
+                'pid': os.getpid(),
+                'restarts': self.restarts,
+                'workers': list(self.state.values())
+            })
+
+
+class Heartbeat(object):
+    """
+    Health of a worker, written to `run_dir` every `interval` seconds
+
+    Besides the pid and the time of the last beat, it measures the lag of
+    the IOLoop: how late the beat ran compared to when it was due. `extra`
+    is called at each beat for more details (e.g. downstream usage).
+    """
+
+    def __init__(self, run_dir, task_id, interval=DEFAULT_HEARTBEAT,
+                 extra=None, clock=time.time):
+        self.run_dir = run_dir
+        self.task_id = task_id
+        self.interval = interval
+        self.extra = extra
+        self.clock = clock
+        self.started = clock()
+        self.due = None
+        self.lag = 0.0
+        self.handle = None
+
+    def start(self):
+        self.due = self.clock()
+        self.beat()
+
+    def stop(self):
+        if self.handle is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self.handle)
+            self.handle = None
+
+    def status(self):
+        status = {
+            'task': self.task_id,
+            'pid': os.getpid(),
+            'started': self.started,
+            'heartbeat': self.clock(),
+            'interval': self.interval,
+            'lag': round(self.lag, 6)
+        }
+        if self.extra is not None:
+            status.update(self.extra())
+        return status
+
+    def beat(self):
+        now = self.clock()
+        if self.due is not None:
+            self.lag = max(0.0, now - self.due)
+        if self.run_dir:
+            write_json(os.path.join(self.run_dir, WORKER_FILE % self.task_id),
+                       self.status())
+        self.due = now + self.interval
+        self.handle = tornado.ioloop.IOLoop.current().call_later(
+            self.interval, self.beat)
+
+
+def worker_health(run_dir, clock=time.time):
+    """
+    the health of every worker supervised in `run_dir`
+
+    a worker is alive when the supervisor knows it running and its last
+    heartbeat is no older than three intervals
+    """
+    supervisor = read_json(os.path.join(run_dir, SUPERVISOR_FILE)) or {
+        'pid': None, 'restarts': 0, 'workers': []}
+    beats = {}
+    for path in glob.glob(os.path.join(run_dir, WORKER_FILE % '*')):
+        beat = read_json(path)
+        if beat is not None:
+            beats[beat['task']] = beat
+
+    workers = []
+    for state in sorted(supervisor['workers'], key=lambda s: s['task']):
+        health = dict(state)
+        beat = beats.get(state['task'])
+        fresh = beat is not None and beat['pid'] == state['pid'] and \
+            clock() - beat['heartbeat'] <= 3 * beat['interval']
+        if fresh:
+            health.update(beat)
+        health['alive'] = fresh
+        workers.append(health)
+
+    return {
+        'supervisor': supervisor['pid'],
+        'restarts': supervisor['restarts'],
+        'workers': workers
+    }
@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+
+import time
+import contextlib
+
+from checks.metrics import STAGE_SECONDS
+
+
+def ms(seconds):
+    return round(seconds * 1000.0, 3)
+
+
+class Trace(object):
+    """
+    Timing breakdown of an execution, asked with `?trace=1`
+
+    Spans are the stages of the execution (dep fetches, eval call,
+    comparison...), with their start, relative to the start of the trace,
+    and duration in milliseconds; events are what happens in between
+    (ZERIQ fallbacks, cache hits...). Group executions get a `child` trace
+    per check, sharing the same origin.
+    """
+
+    def __init__(self, clock=time.time, origin=None, **attrs):
+        self.clock = clock
+        self.origin = clock() if origin is None else origin
+        self.attrs = attrs
+        self.spans = []
+        self.events = []
+        self.children = []
+
+    def elapsed(self):
+        return ms(self.clock() - self.origin)
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        span = dict(attrs, name=name, start=self.elapsed())
+        start = self.clock()
+        try:
+            yield span
+        finally:
+            span['duration'] = ms(self.clock() - start)
+            self.spans.append(span)
+
+    def event(self, name, **attrs):
+        self.events.append(dict(attrs, name=name, at=self.elapsed()))
+
+    def child(self, **attrs):
+        child = Trace(self.clock, self.origin, **attrs)
+        self.children.append(child)
+        return child
+
+    def cost(self, name=None, dep=None):
+        """total duration of the spans `name`, or about `dep`"""
+        return round(sum(
+            span['duration'] for span in self.spans
+            if (name is None or span['name'] == name) and
+            (dep is None or span.get('dep') == dep)), 3)
+
+    def to_dict(self):
+        ret = {
+            'total': self.elapsed(),
+            'spans': sorted(self.spans, key=lambda span: span['start']),
+            'events': self.events,
+            'bytes': sum(span.get('bytes', 0) for span in self.spans)
+        }
+        if len(self.children) > 0:
+            ret['checks'] = self.summary()
+        return ret
+
+    def summary(self):
+        """
+        the cost of each child, most expensive first
+
+        deps are shared by the checks of a group: each check is charged
+        with the fetches of all its deps, as if it ran alone
+        """
+        checks = []
+        for child in self.children:
+            deps = sum(self.cost('dep_fetch', dep)
+                       for dep in child.attrs.get('deps', ()))
+            entry = dict((k, v) for k, v in child.attrs.items()
+                         if k != 'deps')
+            entry.update({
+                'deps': round(deps, 3),
+                'eval': child.cost('eval'),
+                'compare': child.cost('compare'),
+                'total': round(deps + child.cost(), 3),
+                'spans': child.spans,
+                'events': child.events
+            })
+            checks.append(entry)
+        return sorted(checks, key=lambda entry: -entry['total'])
+
+
+@contextlib.contextmanager
+def stage(name, trace=None, **attrs):
+    """
+    measures the stage `name` of an execution in `STAGE_SECONDS` and, when
+    given, as a span of `trace`; yields the span so that attributes known
+    only at the end can be added to it
+    """
+    with STAGE_SECONDS.time(stage=name):
+        if trace is None:
+            yield {}
+        else:
+            with trace.span(name, **attrs) as span:
+                yield span
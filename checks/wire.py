@@ -0,0 +1,78 @@
+# -*- coding:utf-8 -*-
+
+from bson import BSON
+from bson.json_util import dumps, loads
+from bson.raw_bson import RawBSONDocument
+
+
+JSON = 'application/json'
+BSON_TYPE = 'application/bson'
+
+
+def accept(fmt):
+    """the Accept header asking for `fmt`, JSON being always acceptable"""
+    if fmt == 'bson':
+        return '%s, %s;q=0.9' % (BSON_TYPE, JSON)
+    return JSON
+
+
+def content_type(res):
+    headers = getattr(res, 'headers', None) or {}
+    value = headers.get('Content-Type', JSON)
+    return value.split(';')[0].strip().lower()
+
+
+def is_raw(doc):
+    return isinstance(doc, RawBSONDocument)
+
+
+def decode_dep(body, ctype=JSON):
+    """
+    decodes a DataService series of Content-Type `ctype`
+
+    BSON series are not parsed: they're kept as `RawBSONDocument` and
+    their buffers passed through untouched to EvalService
+    """
+    if ctype == BSON_TYPE:
+        return RawBSONDocument(body)
+    return loads(body)
+
+
+def decode(body, ctype=JSON):
+    """decodes an EvalService response of Content-Type `ctype`"""
+    if ctype == BSON_TYPE:
+        return BSON(body).decode()
+    return loads(body)
+
+
+def plain(dep):
+    """
+    `dep` as JSON bodies carry it: decoded, without its `formula` (see
+    `DependencyLoader.load_series`)
+    """
+    if not is_raw(dep):
+        return dep
+    dep = BSON(dep.raw).decode()
+    dep.pop('formula', None)
+    return dep
+
+
+def size(body):
+    """
+    approximate encoded size of `body`, to decide whether encoding it is
+    worth offloading; series count 8 bytes per number
+    """
+    if is_raw(body):
+        return len(body.raw)
+    if isinstance(body, dict):
+        return sum(size(value) for value in body.values())
+    if isinstance(body, (list, tuple)):
+        return 8 * len(body)
+    return 8
+
+
+def encode(body, fmt):
+    """returns `body` encoded in `fmt` and its Content-Type"""
+    if fmt == 'bson':
+        return BSON.encode(body), BSON_TYPE
+    return dumps(body), JSON
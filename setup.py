@@ -34,6 +34,7 @@ test_requirements = [
     'pytest',
     'pytest-cov',
     'pytest-bdd',
+    'mongomock-motor',
     'pytest-xdist',
     'pytest-watch',
     'tox',
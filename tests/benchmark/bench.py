@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench
+----------------------------------
+
+Throughput benchmark of the exec endpoints, against the stubs in
+`tests.benchmark.stubs` and an in-memory (or local) MongoDB::
+
+    python -m tests.benchmark.bench --concurrency 20 --latency 0.005
+
+Every scenario is driven by `--requests` requests, `--concurrency` at the
+same time; each request asks for a different tag (modulo `--tags`) so that
+caches only help as much as they would in production.
+"""
+import time
+import logging
+import argparse
+
+import numpy
+
+import tornado.gen
+import tornado.web
+import tornado.ioloop
+import tornado.httpserver
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.testing import bind_unused_port
+from bson.json_util import dumps
+
+from checks.config import make_config
+from checks.cache import SeriesCache, ResultCache
+from checks.downstream import Downstream
+from checks.engine import ExecutionEngine
+from checks.catalogue import Catalogue
+from checks.jobs import JobQueue
+from checks.offload import Offloader
+from checks.resolver import ServiceResolver
+from checks.results import ResultsWriter
+from checks.controllers import CheckExecHandler, GroupChecksExecController
+from checks.controllers import BatchExecHandler, BulkHandler
+
+from tests.benchmark.stubs import Stubs, StubServiceDiscovery
+
+
+SCENARIOS = ('single', 'group', 'batch', 'listing')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[4])
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS,
+                        choices=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--tags', type=int, default=0,
+                        help='distinct tags asked (0: one per request)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the stubs wait before answering')
+    parser.add_argument('--points', type=int, default=1000,
+                        help='numbers in each series')
+    parser.add_argument('--groups', type=int, default=2)
+    parser.add_argument('--checks', type=int, default=50,
+                        help='checks in each group')
+    parser.add_argument('--deps', type=int, default=20,
+                        help='distinct series in each group')
+    parser.add_argument('--batch', type=int, default=10,
+                        help='checks in each batch request')
+    parser.add_argument('--format', default='json', choices=('json', 'bson'))
+    parser.add_argument('--parallelism', type=int, default=8)
+    parser.add_argument('--evaluator', default='remote',
+                        choices=('remote', 'local', 'auto'))
+    parser.add_argument('--offload', default='none',
+                        choices=('none', 'thread', 'process'))
+    parser.add_argument('--offload-threshold', type=int, default=1024 * 1024)
+    parser.add_argument('--memo', action='store_true',
+                        help='memoize the results of the executions')
+    parser.add_argument('--catalogue', action='store_true',
+                        help='look the checks up in memory')
+    parser.add_argument('--mongodb-url', default='',
+                        help='a local mongod, instead of mongomock')
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+def make_checks(groups, size, deps):
+    checks = []
+    for g in range(groups):
+        for i in range(size):
+            a, b = 'S%d' % (i % deps), 'S%d' % ((i + 1) % deps)
+            checks.append({
+                'group': 'g%d' % g,
+                'name': 'c%d' % i,
+                'formula': 'c%d=%s-%s' % (i, a, b),
+                'deps': [a, b],
+                'operator': '<=',
+                'threshold': 1.0,
+                'autore': 'bench'
+            })
+    return checks
+
+
+def make_db(args):
+    if args.mongodb_url != '':
+        from motor import MotorClient
+        return MotorClient(args.mongodb_url)
+
+    from mongomock_motor import AsyncMongoMockClient
+    return AsyncMongoMockClient()
+
+
+def make_app(args, consul):
+    routes = []
+    for handler in (BatchExecHandler, GroupChecksExecController,
+                    CheckExecHandler, BulkHandler):
+        routes.extend(handler.routes())
+    app = tornado.web.Application(routes)
+    app.config = make_config()
+    app.db = make_db(args)
+    app.sd = StubServiceDiscovery(consul)
+    app.resolver = ServiceResolver(app.sd, consul)
+    app.downstream = dict((name, Downstream(name))
+                          for name in ('DataService', 'EvalService'))
+    app.series_cache = SeriesCache()
+    app.results = ResultsWriter(app)
+    app.catalogue = Catalogue(app) if args.catalogue else None
+    app.engine = ExecutionEngine(
+        app, parallelism=args.parallelism, cache=app.series_cache,
+        results=app.results, fmt=args.format,
+        memo=ResultCache() if args.memo else None,
+        evaluator=args.evaluator,
+        offload=Offloader(kind=args.offload,
+                          threshold=args.offload_threshold),
+        catalogue=app.catalogue)
+    app.jobs = JobQueue(app)
+    return app
+
+
+def listen(app):
+    sock, port = bind_unused_port()
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets([sock])
+    return server, 'http://127.0.0.1:%s' % port
+
+
+def make_request(args, scenario, i):
+    """the (path, kwargs) of the i-th request of `scenario`"""
+    tag = 't%d' % (i % args.tags if args.tags > 0 else i)
+    group = 'g%d' % (i % args.groups)
+    if scenario == 'single':
+        return '/checks/%s/c%d/exec/%s' % (group, i % args.checks, tag), {}
+    if scenario == 'group':
+        return '/checks/%s/exec/%s' % (group, tag), {}
+    if scenario == 'batch':
+        checks = [[group, 'c%d' % ((i + k) % args.checks)]
+                  for k in range(args.batch)]
+        return '/exec', {'method': 'POST',
+                         'body': dumps({'checks': checks, 'tags': [tag]})}
+    return '/checks?limit=%d' % args.checks, {}
+
+
+@tornado.gen.coroutine
+def drive(args, url, scenario):
+    """runs `scenario`, returns its report"""
+    client = AsyncHTTPClient(force_instance=True,
+                             max_clients=args.concurrency)
+    latencies = []
+    errors = [0]
+    counter = iter(range(args.requests))
+
+    @tornado.gen.coroutine
+    def worker():
+        for i in counter:
+            path, kwargs = make_request(args, scenario, i)
+            start = time.time()
+            res = yield client.fetch(url + path, raise_error=False,
+                                     request_timeout=600, **kwargs)
+            latencies.append(time.time() - start)
+            if res.code != 200:
+                errors[0] += 1
+
+    start = time.time()
+    yield [worker() for _ in range(args.concurrency)]
+    elapsed = time.time() - start
+    client.close()
+
+    latencies = numpy.array(latencies) * 1000.0
+    raise tornado.gen.Return({
+        'scenario': scenario,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'p50': numpy.percentile(latencies, 50),
+        'p99': numpy.percentile(latencies, 99),
+        'rps': len(latencies) / elapsed
+    })
+
+
+@tornado.gen.coroutine
+def run(args):
+    """runs the `args.scenarios`, returns their reports"""
+    stubs = Stubs(latency=args.latency, points=args.points)
+    stubs_server, stubs_url = listen(stubs)
+    stubs.port = int(stubs_url.rsplit(':', 1)[1])
+
+    app = make_app(args, stubs_url)
+    # make_config installs its own logging
+    logging.getLogger().setLevel(args.log_level)
+    server, url = listen(app)
+    yield app.db.checks.checks.insert_many(
+        make_checks(args.groups, args.checks, args.deps))
+    if app.catalogue is not None:
+        yield app.catalogue.load()
+
+    reports = []
+    try:
+        for scenario in args.scenarios:
+            report = yield drive(args, url, scenario)
+            reports.append(report)
+    finally:
+        server.stop()
+        stubs_server.stop()
+        app.resolver.stop()
+        yield app.results.stop()
+        for downstream in app.downstream.values():
+            downstream.close()
+        app.engine.offload.shutdown()
+    raise tornado.gen.Return(reports)
+
+
+def report(reports):
+    lines = ['%-8s %8s %8s %10s %10s %10s' % (
+        'scenario', 'requests', 'errors', 'p50 (ms)', 'p99 (ms)', 'req/s')]
+    for r in reports:
+        lines.append('%-8s %8d %8d %10.2f %10.2f %10.1f' % (
+            r['scenario'], r['requests'], r['errors'], r['p50'], r['p99'],
+            r['rps']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    reports = tornado.ioloop.IOLoop.current().run_sync(lambda: run(args))
+    print(report(reports))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+stubs
+----------------------------------
+
+In-process stand-ins for DataService, EvalService and Consul, with a
+configurable latency and payload size.
+"""
+import json
+import numpy
+
+import tornado.gen
+import tornado.web
+
+from bson import BSON
+from bson.json_util import dumps, loads
+from tornado.httpclient import HTTPClient
+
+
+class StubHandler(tornado.web.RequestHandler):
+    @tornado.gen.coroutine
+    def delay(self):
+        latency = self.application.latency
+        if latency > 0:
+            yield tornado.gen.sleep(latency)
+
+
+class DataStub(StubHandler):
+    """`/data/<tag>/<dep>`: a series of `points` random numbers"""
+
+    @tornado.gen.coroutine
+    def get(self, tag, name):
+        yield self.delay()
+        if name.startswith('MISSING'):
+            self.send_error(404)
+            return
+
+        series = {'numbers': self.application.series(name), 'formula': name}
+        if 'application/bson' in self.request.headers.get('Accept', ''):
+            self.set_header('Content-Type', 'application/bson')
+            self.finish(BSON.encode(series))
+        else:
+            self.finish(dumps(series))
+
+
+class EvalStub(StubHandler):
+    """`/eval`: evaluates `.formula` over `.deps` as EvalService does"""
+
+    @tornado.gen.coroutine
+    def post(self):
+        yield self.delay()
+        if self.request.headers.get('Content-Type') == 'application/bson':
+            body = BSON(self.request.body).decode()
+        else:
+            body = loads(self.request.body)
+        namespace = dict((name, numpy.array(dep['numbers']))
+                         for name, dep in body['.deps'].items())
+        name, expression = body['.formula'].split('=')
+        result = eval(expression, {'__builtins__': {}}, namespace)
+        self.finish(dumps({name: {'numbers': result.tolist()}}))
+
+
+class ConsulStub(StubHandler):
+    """catalog and health API of Consul, every service on the stubs"""
+
+    @tornado.gen.coroutine
+    def get(self, api, name):
+        yield self.delay()
+        self.finish(json.dumps([{
+            'Node': {'Address': self.application.address},
+            'Service': {'Service': name,
+                        'Address': self.application.address,
+                        'Port': self.application.port},
+            'ServiceAddress': self.application.address,
+            'ServicePort': self.application.port
+        }]))
+
+
+class StubServiceDiscovery(object):
+    """the part of `ServiceDiscovery` used by `ServiceResolver`"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint.rstrip('/')
+
+    def getService(self, name):
+        client = HTTPClient()
+        try:
+            res = client.fetch('%s/v1/catalog/service/%s' % (
+                self.endpoint, name))
+        finally:
+            client.close()
+        service = json.loads(res.body)[0]
+        return 'http://%s:%s' % (service['ServiceAddress'],
+                                 service['ServicePort'])
+
+
+class Stubs(tornado.web.Application):
+    def __init__(self, latency=0.0, points=100, address='127.0.0.1'):
+        super(Stubs, self).__init__([
+            (r'/data/(\w+)/(\w+)', DataStub),
+            (r'/eval', EvalStub),
+            (r'/v1/(catalog|health)/service/(\w+)', ConsulStub)
+        ])
+        self.latency = latency
+        self.points = points
+        self.address = address
+        self.port = None
+        self.cache = {}
+
+    def series(self, name):
+        if name not in self.cache:
+            self.cache[name] = numpy.random.random(self.points).tolist()
+        return self.cache[name]
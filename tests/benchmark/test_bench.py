@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_bench
+----------------------------------
+
+Keeps the benchmark harness working: every scenario on a tiny load.
+"""
+from tornado.testing import AsyncTestCase, gen_test
+
+from tests.benchmark.bench import SCENARIOS, parse_args, run, report
+
+
+class TestBench(AsyncTestCase):
+
+    @gen_test(timeout=60)
+    def test_scenarios(self):
+        args = parse_args(['--requests', '4', '--concurrency', '2',
+                           '--groups', '1', '--checks', '3', '--deps', '2',
+                           '--batch', '2', '--points', '10'])
+        reports = yield run(args)
+        self.assertEqual([r['scenario'] for r in reports], list(SCENARIOS))
+        for r in reports:
+            self.assertEqual((r['requests'], r['errors']), (4, 0))
+        self.assertIn('p99', report(reports))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `checks.cache` module.
+"""
+import unittest
+
+from checks.cache import LRUCache, SeriesCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_evicts_on_bytes(self):
+        cache = LRUCache(maxbytes=10)
+        cache.put('a', 1, nbytes=6)
+        cache.put('b', 2, nbytes=6)
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+        self.assertEqual(cache.bytes, 6)
+        cache.put('c', 3, nbytes=11)
+        self.assertNotIn('c', cache)
+
+    def test_expires_after_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.put('a', 1, nbytes=3)
+        clock.now = 11
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.bytes, 0)
+
+    def test_counts_hits_and_misses(self):
+        cache = SeriesCache()
+        cache.put_series('tag', 'A', {'numbers': [1]}, 10)
+        self.assertEqual(cache.get_series('tag', 'A'), {'numbers': [1]})
+        self.assertIsNone(cache.get_series('tag', 'B'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_catalogue
+----------------------------------
+
+Tests for `checks.catalogue` module.
+"""
+import unittest
+
+import tornado.gen
+
+from tornado.testing import AsyncTestCase, gen_test
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import OperationFailure, CursorNotFound
+
+from checks.cache import check_key
+from checks.catalogue import Catalogue, compile_check
+
+
+CHECK = {'_id': 1, 'group': 'g', 'name': 'c1', 'formula': 'c1=A-B',
+         'deps': ['A', 'B', 'A'], 'operator': ' <= ', 'threshold': '0.5'}
+
+
+class FakeApp(object):
+    def __init__(self, db):
+        self.db = db
+
+
+class FakeStream(object):
+    """a change stream over `changes`, failing when `error` is set"""
+
+    def __init__(self, changes=(), error=None):
+        self.changes = list(changes)
+        self.error = error
+        self.closed = False
+
+    @tornado.gen.coroutine
+    def try_next(self):
+        if self.error is not None:
+            raise self.error
+        raise tornado.gen.Return(None)
+
+    @tornado.gen.coroutine
+    def next(self):
+        if len(self.changes) == 0:
+            raise CursorNotFound('cursor closed')
+        raise tornado.gen.Return(self.changes.pop(0))
+
+    def close(self):
+        self.closed = True
+
+
+class WatchedCollection(object):
+    """a mongomock collection with a `FakeStream` as change stream"""
+
+    def __init__(self, collection, stream):
+        self.collection = collection
+        self.stream = stream
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    def watch(self, **kwargs):
+        return self.stream
+
+
+class WatchedCatalogue(Catalogue):
+    def __init__(self, db, stream):
+        super(WatchedCatalogue, self).__init__(FakeApp(db), interval=60)
+        self.watched = WatchedCollection(db.checks.checks, stream)
+
+    @property
+    def collection(self):
+        return self.watched
+
+
+class TestCompile(unittest.TestCase):
+
+    def test_plan(self):
+        plan = compile_check(CHECK)
+        self.assertEqual(plan['operator'], '<=')
+        self.assertEqual(plan['threshold'], 0.5)
+        self.assertEqual(plan['tolerance'], 0.0)
+        self.assertEqual(plan['deps'], ['A', 'B'])
+        self.assertEqual(CHECK['deps'], ['A', 'B', 'A'])
+
+    def test_key_of_plan(self):
+        plan = compile_check(CHECK)
+        self.assertEqual(check_key(plan, 't1'),
+                         check_key(dict(plan, **{'.definition': None}), 't1'))
+        self.assertNotEqual(check_key(plan, 't1'), check_key(plan, 't2'))
+
+    def test_bad_threshold(self):
+        # kept: fails when executed
+        plan = compile_check(dict(CHECK, threshold='high'))
+        self.assertEqual(plan['threshold'], 'high')
+
+
+class TestCatalogue(unittest.TestCase):
+
+    def setUp(self):
+        self.catalogue = Catalogue(None)
+        self.catalogue.put(CHECK)
+        self.catalogue.put(dict(CHECK, _id=2, name='c2', deps=['C']))
+
+    def test_lookups(self):
+        self.assertEqual(self.catalogue.get('g', 'c1')['threshold'], 0.5)
+        self.assertIsNone(self.catalogue.get('g', 'c3'))
+        self.assertEqual(len(self.catalogue.group('g')), 2)
+        self.assertEqual([plan['name'] for plan in
+                          self.catalogue.affected('g', ['B', 'D'])], ['c1'])
+
+    def test_rename(self):
+        self.catalogue.apply({'operationType': 'replace',
+                              'documentKey': {'_id': 1},
+                              'fullDocument': dict(CHECK, name='c3')})
+        self.assertIsNone(self.catalogue.get('g', 'c1'))
+        self.assertIsNotNone(self.catalogue.get('g', 'c3'))
+        self.assertEqual(len(self.catalogue), 2)
+
+    def test_delete(self):
+        self.catalogue.apply({'operationType': 'delete',
+                              'documentKey': {'_id': 2}})
+        self.assertIsNone(self.catalogue.get('g', 'c2'))
+        self.catalogue.apply({'operationType': 'update',
+                              'documentKey': {'_id': 1},
+                              'fullDocument': None})
+        self.assertEqual(self.catalogue.groups, {})
+
+    def test_drop(self):
+        self.catalogue.apply({'operationType': 'drop'})
+        self.assertEqual(len(self.catalogue), 0)
+
+    def test_forget(self):
+        self.catalogue.put(dict(CHECK, _id=3, group='h'))
+        self.catalogue.forget('g')
+        self.assertEqual(self.catalogue.group('g'), [])
+        self.assertEqual(len(self.catalogue), 1)
+
+    def test_changed_while_reading(self):
+        generation = self.catalogue.generation('g')
+        self.catalogue.apply({'operationType': 'update',
+                              'documentKey': {'_id': 1},
+                              'fullDocument': dict(CHECK, threshold=2)})
+        # read before the change: returned, not kept
+        plans = self.catalogue.put_group('g', [CHECK], generation)
+        self.assertEqual(plans[0]['threshold'], 0.5)
+        self.assertEqual(self.catalogue.get('g', 'c1')['threshold'], 2.0)
+        self.assertFalse(self.catalogue.complete('g'))
+
+        generation = self.catalogue.generation('g')
+        self.catalogue.forget('g')
+        self.catalogue.put(CHECK, generation)
+        self.assertIsNone(self.catalogue.get('g', 'c1'))
+
+        generation = self.catalogue.generation('g')
+        self.catalogue.put_group('g', [CHECK], generation)
+        self.assertTrue(self.catalogue.complete('g'))
+
+    def test_complete_groups(self):
+        # checks put one by one don't make a group
+        self.assertFalse(self.catalogue.complete('g'))
+        self.catalogue.put_group('g', [CHECK])
+        self.assertTrue(self.catalogue.complete('g'))
+        self.assertEqual(len(self.catalogue.group('g')), 1)
+        self.catalogue.forget('g')
+        self.assertFalse(self.catalogue.complete('g'))
+
+
+class TestWatch(AsyncTestCase):
+
+    def setUp(self):
+        super(TestWatch, self).setUp()
+        self.db = AsyncMongoMockClient()
+        self.io_loop.run_sync(
+            lambda: self.db.checks.checks.insert_one(dict(CHECK)))
+
+    @gen_test
+    def test_change_stream(self):
+        stream = FakeStream([
+            {'operationType': 'insert', 'documentKey': {'_id': 2},
+             'fullDocument': dict(CHECK, _id=2, name='c2')},
+            {'operationType': 'delete', 'documentKey': {'_id': 1}}
+        ])
+        catalogue = WatchedCatalogue(self.db, stream)
+        with self.assertRaises(CursorNotFound):
+            yield catalogue.watch()
+        self.assertTrue(catalogue.ready)
+        self.assertIsNone(catalogue.get('g', 'c1'))
+        self.assertEqual(catalogue.get('g', 'c2')['threshold'], 0.5)
+
+    @gen_test
+    def test_invalidated(self):
+        stream = FakeStream([{'operationType': 'invalidate'}])
+        catalogue = WatchedCatalogue(self.db, stream)
+        watching = yield catalogue.watch()
+        self.assertTrue(watching)
+        self.assertEqual(len(catalogue), 0)
+
+    @gen_test
+    def test_polling_without_change_streams(self):
+        stream = FakeStream(error=OperationFailure(
+            'The $changeStream stage is only supported on replica sets',
+            code=40573))
+        catalogue = WatchedCatalogue(self.db, stream)
+        yield catalogue.run()
+        self.assertTrue(catalogue.ready)
+        self.assertIsNotNone(catalogue.periodic)
+        self.assertEqual(catalogue.get('g', 'c1')['deps'], ['A', 'B'])
+        self.assertTrue(catalogue.complete('g'))
+
+        yield self.db.checks.checks.delete_one({'_id': 1})
+        yield catalogue.reload()
+        self.assertIsNone(catalogue.get('g', 'c1'))
+        catalogue.stop()
@@ -16,6 +16,8 @@ class TestChecksApp(AsyncHTTPTestCase):
 
     def get_app(self):
         self.app = checks.app.get_app()
+        # the clients of a worker, as once forked
+        checks.app.init_worker(self.app)
         return self.app
 
     def test_homepage(self):
@@ -24,5 +26,5 @@ class TestChecksApp(AsyncHTTPTestCase):
         self.assertEqual(json.loads(response.body), [])
 
     def tearDown(self):
-        super(AsyncHTTPTestCase, self).tearDown()
-        self.app.db.close()
+        self.io_loop.run_sync(lambda: checks.app.close_worker(self.app))
+        super(TestChecksApp, self).tearDown()
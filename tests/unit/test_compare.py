@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_compare
+----------------------------------
+
+Tests for `checks.compare` module.
+"""
+import unittest
+
+from checks.compare import compare
+
+
+NAN = float('nan')
+
+
+class TestCompare(unittest.TestCase):
+
+    def test_operators(self):
+        data = [0.0, 0.05, 0.2, NAN]
+        self.assertEqual(compare(data, '<=', 0.1), (False, [2]))
+        self.assertEqual(compare(data, '<', 0.05), (False, [1, 2]))
+        self.assertEqual(compare(data, '>=', 0.05), (False, [0]))
+        self.assertEqual(compare(data, '>', -1), (True, []))
+        self.assertEqual(compare(data, '==', 0.05), (False, [0, 2]))
+        self.assertEqual(compare(data, '<>', 0.05), (False, [1]))
+
+    def test_tolerance(self):
+        data = [0.98, 1.0, 1.03]
+        self.assertEqual(compare(data, '==', 1, tolerance=0.05), (True, []))
+        self.assertEqual(compare(data, '<>', 1, tolerance=0.025),
+                         (False, [0, 1]))
+        self.assertEqual(compare(data, '<=', 1, tolerance=0.01),
+                         (False, [2]))
+
+    def test_nulls_are_ignored(self):
+        self.assertEqual(compare([None, 1], '<', 2), (True, []))
+
+    def test_unknown_operator(self):
+        with self.assertRaises(ValueError):
+            compare([1], '=>', 0)
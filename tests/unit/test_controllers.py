@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_controllers
+----------------------------------
+
+Tests for `checks.controllers` module, on an in-memory MongoDB.
+"""
+import os
+import json
+
+import tornado.web
+
+from tornado.testing import AsyncHTTPTestCase
+from mongomock_motor import AsyncMongoMockClient
+
+from checks.config import make_config
+from checks.engine import ExecutionEngine
+from checks.controllers import BulkHandler, CsvBulkHandler
+from checks.controllers import GroupChecksHandler, CheckHandler
+from checks.controllers import ResultsHandler
+
+
+TESTDATA = os.path.join(os.path.dirname(__file__), '..', 'data',
+                        'testdata.csv')
+
+CHECKS = [{
+    'name': 'name%d' % i,
+    'group': 'group%d' % (i % 2),
+    'formula': 'name%d=A-B' % i,
+    'operator': '<=',
+    'threshold': 0.01,
+    'deps': ['A', 'B'],
+    'autore': 'me'
+} for i in range(5)]
+
+
+class ControllersTestCase(AsyncHTTPTestCase):
+    handlers = [CheckHandler, BulkHandler, CsvBulkHandler, GroupChecksHandler,
+                ResultsHandler]
+
+    def get_app(self):
+        routes = []
+        for handler in self.handlers:
+            routes.extend(handler.routes())
+        self.app = tornado.web.Application(routes)
+        self.app.config = make_config()
+        self.app.config.set('MongoDB', 'batch', '2')
+        self.app.db = AsyncMongoMockClient()
+        self.app.engine = ExecutionEngine(self.app)
+        return self.app
+
+    def insert_checks(self):
+        self.io_loop.run_sync(lambda: self.app.db.checks.checks.insert_many(
+            [dict(check) for check in CHECKS]))
+
+
+class TestListing(ControllersTestCase):
+
+    def test_empty_listing(self):
+        response = self.fetch('/checks')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), [])
+
+    def test_listing_streams_all_checks(self):
+        self.insert_checks()
+        response = self.fetch('/checks')
+        names = [check['name'] for check in json.loads(response.body)]
+        self.assertEqual(names, [check['name'] for check in CHECKS])
+
+    def test_group_listing(self):
+        self.insert_checks()
+        response = self.fetch('/checks/group1')
+        names = [check['name'] for check in json.loads(response.body)]
+        self.assertEqual(names, ['name1', 'name3'])
+
+    def test_csv_listing(self):
+        self.insert_checks()
+        response = self.fetch('/checks.csv')
+        lines = response.body.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0], 'name0;group0;name0=A-B;<=;0.01;A;B')
+
+    def test_filters_and_projection(self):
+        self.insert_checks()
+        response = self.fetch('/checks?author=me&dep=B&dep=Z'
+                              '&fields=name,operator')
+        checks = json.loads(response.body)
+        self.assertEqual(len(checks), 5)
+        self.assertEqual(sorted(checks[0]), ['_id', 'name', 'operator'])
+        response = self.fetch('/checks?dep=Z')
+        self.assertEqual(json.loads(response.body), [])
+
+    def test_keyset_pagination(self):
+        self.insert_checks()
+        names, after = [], ''
+        while after is not None:
+            response = self.fetch('/checks?limit=2&after=' + after
+                                  if after else '/checks?limit=2')
+            names.extend(check['name'] for check in json.loads(response.body))
+            after = response.headers.get('X-Next-After')
+        self.assertEqual(names, [check['name'] for check in CHECKS])
+
+    def test_malformed_cursor(self):
+        response = self.fetch('/checks?after=nope')
+        self.assertEqual(response.code, 400)
+
+
+class TestResults(ControllersTestCase):
+
+    def insert_results(self):
+        self.io_loop.run_sync(lambda: self.app.db.checks.results.insert_many(
+            [{'name': 'c', 'tag': 't%d' % (i % 2), 'timestamp': i}
+             for i in range(5)]))
+
+    def test_results_are_paginated(self):
+        self.insert_results()
+        response = self.fetch('/results')
+        self.assertEqual(len(json.loads(response.body)), 2)
+
+        timestamps, after = [], ''
+        while after is not None:
+            response = self.fetch('/results/t0?after=' + after
+                                  if after else '/results/t0')
+            timestamps.extend(result['timestamp']
+                              for result in json.loads(response.body))
+            after = response.headers.get('X-Next-After')
+        # newest first
+        self.assertEqual(timestamps, [4, 2, 0])
+
+    def test_malformed_limit(self):
+        response = self.fetch('/results?limit=many')
+        self.assertEqual(response.code, 400)
+
+
+class TestCsvImport(ControllersTestCase):
+
+    def test_import_upserts_and_reports_errors(self):
+        with open(TESTDATA) as f:
+            body = f.read()
+        body += '\nname3,group1,name3=A-B,=>,0.1,A\nshort,row\n'
+        response = self.fetch('/checks.csv', method='POST', body=body)
+        self.assertEqual(response.code, 201)
+        report = json.loads(response.body)
+        self.assertEqual(report['rows'], 4)
+        self.assertEqual(report['upserted'], 2)
+        self.assertEqual([e['row'] for e in report['errors']], [3, 4])
+
+        response = self.fetch('/checks.csv', method='POST', body=body)
+        report = json.loads(response.body)
+        self.assertEqual((report['upserted'], report['matched']), (0, 2))
+        response = self.fetch('/checks')
+        self.assertEqual(len(json.loads(response.body)), 2)
+
+    def test_unknown_delimiter(self):
+        response = self.fetch('/checks.csv', method='POST', body='abc\n')
+        self.assertEqual(response.code, 400)
+
+
+class TestCRUD(ControllersTestCase):
+
+    def test_create_update_delete(self):
+        check = dict(CHECKS[0])
+        del check['name'], check['group']
+        response = self.fetch('/checks/g/c', method='POST',
+                              body=json.dumps(check))
+        self.assertEqual(response.code, 201)
+        self.assertEqual(json.loads(response.body)['name'], 'c')
+
+        response = self.fetch('/checks/g/c', method='PUT',
+                              body=json.dumps({'threshold': 0.5}))
+        self.assertEqual(json.loads(response.body)['threshold'], 0.5)
+
+        response = self.fetch('/checks/g/c', method='DELETE')
+        self.assertEqual(response.code, 202)
+        response = self.fetch('/checks/g/c')
+        self.assertEqual(response.code, 404)
+
+    def test_invalid_check(self):
+        response = self.fetch('/checks/g/c', method='POST',
+                              body=json.dumps({'formula': 'c=A'}))
+        self.assertEqual(response.code, 400)
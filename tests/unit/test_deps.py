@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_deps
+----------------------------------
+
+Tests for `checks.deps` module.
+"""
+import tornado.gen
+
+from tornado.testing import AsyncTestCase, gen_test
+from bson.json_util import dumps
+
+from checks.cache import SeriesCache
+from checks.deps import DependencyLoader, DependencyError, select
+
+
+class FakeResponse(object):
+    def __init__(self, code, body=None):
+        self.code = code
+        self.body = body
+
+
+class FakeHTTPClient(object):
+    """serves `series` as DataService would, tracking concurrency"""
+
+    def __init__(self, series):
+        self.series = series
+        self.urls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @tornado.gen.coroutine
+    def fetch(self, url, **kwargs):
+        self.urls.append(url)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        yield tornado.gen.sleep(0.01)
+        self.in_flight -= 1
+        name = url.rsplit('/', 1)[-1]
+        if name not in self.series:
+            raise tornado.gen.Return(FakeResponse(404))
+        raise tornado.gen.Return(FakeResponse(200, dumps(self.series[name])))
+
+
+class TestDependencyLoader(AsyncTestCase):
+
+    @gen_test
+    def test_load_is_bounded_by_fanout(self):
+        series = dict(('S%d' % i, {'numbers': [i]}) for i in range(10))
+        client = FakeHTTPClient(series)
+        loader = DependencyLoader(client, 'http://data/data', fanout=3)
+        deps = yield loader.load('tag', sorted(series))
+        self.assertEqual(deps, series)
+        self.assertEqual(client.max_in_flight, 3)
+
+    @gen_test
+    def test_missing_deps_share_one_fallback(self):
+        client = FakeHTTPClient({
+            'A': {'numbers': [1], 'formula': 'A=1'},
+            'ZERIQ': {'numbers': [0]}
+        })
+        loader = DependencyLoader(client, 'http://data/data')
+        deps = yield loader.load('tag', ['A', 'B', 'C'])
+        self.assertEqual(deps['A'], {'numbers': [1]})
+        self.assertEqual(deps['B'], {'numbers': [0]})
+        self.assertEqual(deps['C'], {'numbers': [0]})
+        self.assertEqual(client.urls.count('http://data/data/tag/ZERIQ'), 1)
+
+    @gen_test
+    def test_missing_fallback_raises(self):
+        loader = DependencyLoader(FakeHTTPClient({}), 'http://data/data')
+        with self.assertRaises(DependencyError):
+            yield loader.load('tag', ['A'])
+
+    @gen_test
+    def test_load_shared_fetches_each_dep_once(self):
+        client = FakeHTTPClient({'A': {'numbers': [1]}})
+        loader = DependencyLoader(client, 'http://data/data')
+        shared = yield loader.load_shared('tag', ['A', 'B', 'A'])
+        self.assertEqual(client.urls.count('http://data/data/tag/A'), 1)
+        self.assertEqual(select(shared, ['A']), {'A': {'numbers': [1]}})
+        with self.assertRaises(DependencyError):
+            select(shared, ['A', 'B'])
+
+    @gen_test
+    def test_cached_series_are_not_fetched_again(self):
+        client = FakeHTTPClient({'A': {'numbers': [1]}, 'ZERIQ': {}})
+        cache = SeriesCache()
+        loader = DependencyLoader(client, 'http://data/data', cache=cache)
+        yield loader.load('tag', ['A', 'B'])
+        loader = DependencyLoader(client, 'http://data/data', cache=cache)
+        deps = yield loader.load('tag', ['A', 'B'])
+        self.assertEqual(deps, {'A': {'numbers': [1]}, 'B': {}})
+        # missing B asked again, its fallback cached
+        self.assertEqual(client.urls.count('http://data/data/tag/B'), 2)
+        self.assertEqual(len(client.urls), 4)
+
+    @gen_test
+    def test_series_published_after_a_fallback(self):
+        client = FakeHTTPClient({'ZERIQ': {'numbers': [0]}})
+        cache = SeriesCache()
+        loader = DependencyLoader(client, 'http://data/data', cache=cache)
+        deps = yield loader.load('tag', ['B'])
+        self.assertEqual(deps['B'], {'numbers': [0]})
+        client.series['B'] = {'numbers': [2]}
+        loader = DependencyLoader(client, 'http://data/data', cache=cache)
+        deps = yield loader.load('tag', ['B'])
+        self.assertEqual(deps['B'], {'numbers': [2]})
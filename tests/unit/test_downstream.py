@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_downstream
+----------------------------------
+
+Tests for `checks.downstream` module, against a slow service running in
+the test server.
+"""
+import tornado.gen
+import tornado.web
+
+from tornado.httpclient import HTTPError
+from tornado.simple_httpclient import HTTPTimeoutError
+from tornado.testing import AsyncHTTPTestCase, gen_test, bind_unused_port
+
+from checks.config import make_config
+from checks.downstream import Downstream, transport_code
+
+
+class SlowHandler(tornado.web.RequestHandler):
+    @tornado.gen.coroutine
+    def get(self, code):
+        yield tornado.gen.sleep(0.05)
+        self.set_status(int(code))
+        self.finish('done')
+
+
+class TestDownstream(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return tornado.web.Application([(r'/slow/(\d+)', SlowHandler)])
+
+    def setUp(self):
+        super(TestDownstream, self).setUp()
+        self.downstream = Downstream('DataService', max_clients=2)
+
+    def tearDown(self):
+        self.downstream.close()
+        super(TestDownstream, self).tearDown()
+
+    @gen_test
+    def test_saturation(self):
+        responses = yield [self.downstream.fetch(self.get_url('/slow/200'))
+                           for _ in range(3)]
+        self.assertEqual([res.code for res in responses], [200] * 3)
+        stats = self.downstream.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['peak'], 3)
+        self.assertEqual(stats['saturated'], 1)
+        self.assertEqual((stats['in_flight'], stats['queued']), (0, 0))
+        self.assertEqual(stats['errors'], 0)
+
+    @gen_test
+    def test_in_flight(self):
+        futures = [self.downstream.fetch(self.get_url('/slow/200'))
+                   for _ in range(3)]
+        stats = self.downstream.stats()
+        self.assertEqual((stats['in_flight'], stats['queued']), (3, 1))
+        yield futures
+        self.assertEqual(self.downstream.stats()['in_flight'], 0)
+
+    @gen_test
+    def test_errors(self):
+        with self.assertRaises(HTTPError):
+            yield self.downstream.fetch(self.get_url('/slow/500'))
+        sock, port = bind_unused_port()
+        sock.close()
+        # refused: IOError with the simple client, 599 with curl
+        with self.assertRaises((IOError, HTTPError)):
+            yield self.downstream.fetch('http://127.0.0.1:%s/' % port)
+        stats = self.downstream.stats()
+        self.assertEqual((stats['requests'], stats['errors']), (2, 2))
+        self.assertEqual(stats['in_flight'], 0)
+
+    def test_defaults_from_config(self):
+        downstream = Downstream.from_config(make_config(), 'EvalService')
+        default = Downstream('EvalService')
+        self.assertEqual(
+            (downstream.max_clients, downstream.request_timeout),
+            (default.max_clients, default.request_timeout))
+
+    def test_transport_codes(self):
+        self.assertEqual(transport_code(HTTPTimeoutError('Timeout')), 504)
+        self.assertEqual(transport_code(IOError('refused')), 502)
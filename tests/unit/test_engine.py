@@ -0,0 +1,564 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_engine
+----------------------------------
+
+Tests for `checks.engine` module, against stub DataService and
+EvalService running in the test server.
+"""
+import json
+import numpy
+import socket
+import datetime
+
+import tornado.gen
+import tornado.web
+
+from collections import Counter
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from tornado.iostream import IOStream
+from tornado.testing import AsyncHTTPTestCase, bind_unused_port, gen_test
+from bson import BSON, ObjectId
+from bson.json_util import dumps, loads
+from mongomock_motor import AsyncMongoMockClient
+
+from checks.cache import SeriesCache, ResultCache
+from checks.catalogue import Catalogue
+from checks.config import make_config
+from checks.engine import ExecutionEngine
+from checks.downstream import Downstream
+from checks.jobs import JobQueue
+from checks.offload import Offloader
+from checks.results import ResultsWriter
+from checks.controllers import CheckExecHandler, GroupChecksExecController
+from checks.controllers import BatchExecHandler, JobHandler
+from checks.controllers import JobResultsHandler, GroupChecksRerunHandler
+from checks.controllers import MetricsHandler
+from checks.metrics import log_request
+
+
+SERIES = {
+    'A': [1.0, 2.0, 3.0],
+    'B': [1.0, 2.0, 2.5],
+    'C': [1.0, 2.0, 3.0],
+}
+
+CHECKS = [
+    {'group': 'g', 'name': 'ok1', 'formula': 'ok1=A-C', 'deps': ['A', 'C'],
+     'operator': '<=', 'threshold': 0.01},
+    {'group': 'g', 'name': 'ko1', 'formula': 'ko1=A-B', 'deps': ['A', 'B'],
+     'operator': '<=', 'threshold': 0.01},
+    {'group': 'g', 'name': 'zq1', 'formula': 'zq1=A-X', 'deps': ['A', 'X'],
+     'operator': '>=', 'threshold': 1},
+]
+
+
+class DataStub(tornado.web.RequestHandler):
+    def get(self, tag, name):
+        self.application.data_requests[(tag, name)] += 1
+        if name == 'ZERIQ':
+            series = {'numbers': [0.0, 0.0, 0.0]}
+        elif name in SERIES:
+            series = {'numbers': SERIES[name], 'formula': name}
+        else:
+            self.send_error(404)
+            return
+
+        if 'application/bson' in self.request.headers.get('Accept', ''):
+            self.set_header('Content-Type', 'application/bson')
+            self.finish(BSON.encode(series))
+        else:
+            self.finish(dumps(series))
+
+
+class EvalStub(tornado.web.RequestHandler):
+    @tornado.gen.coroutine
+    def post(self):
+        if self.application.eval_delay:
+            yield tornado.gen.sleep(self.application.eval_delay)
+        content_type = self.request.headers.get('Content-Type')
+        if content_type == 'application/bson':
+            if not self.application.accept_bson:
+                self.send_error(415)
+                return
+            body = BSON(self.request.body).decode()
+        else:
+            body = loads(self.request.body)
+            self.application.json_formulas += sum(
+                'formula' in dep for dep in body['.deps'].values())
+        namespace = dict((name, numpy.array(dep['numbers']))
+                         for name, dep in body['.deps'].items())
+        name, expression = body['.formula'].split('=')
+        result = eval(expression, {}, namespace)
+        self.finish(dumps({name: {'numbers': result.tolist()}}))
+
+
+class FakeResolver(object):
+    """resolves every service to `url`, the `down` ones to a closed port"""
+
+    def __init__(self, url, down=()):
+        self.url = url
+        self.down = down
+        sock, port = bind_unused_port()
+        sock.close()
+        self.closed = 'http://127.0.0.1:%s' % port
+
+    @tornado.gen.coroutine
+    def resolve(self, name):
+        raise tornado.gen.Return(
+            self.closed if name in self.down else self.url)
+
+
+class RacingCollection(object):
+    """a collection whose queries see `change` applied to `catalogue`"""
+
+    def __init__(self, collection, catalogue, change):
+        self.collection = collection
+        self.catalogue = catalogue
+        self.change = change
+
+    def find(self, *args, **kwargs):
+        cursor = self.collection.find(*args, **kwargs)
+        self.catalogue.apply(self.change)
+        return cursor
+
+
+class EngineTestCase(AsyncHTTPTestCase):
+
+    def get_app(self):
+        routes = [
+            (r'/data/(\w+)/(\w+)', DataStub),
+            (r'/eval', EvalStub)
+        ]
+        for handler in (BatchExecHandler, GroupChecksRerunHandler,
+                        GroupChecksExecController, CheckExecHandler,
+                        JobHandler, JobResultsHandler, MetricsHandler):
+            routes.extend(handler.routes())
+        app = tornado.web.Application(routes, log_function=log_request)
+        app.config = make_config()
+        app.db = AsyncMongoMockClient()
+        app.data_requests = Counter()
+        app.accept_bson = True
+        app.json_formulas = 0
+        app.eval_delay = 0
+        app.downstream = dict((name, Downstream(name, max_clients=2))
+                              for name in ('DataService', 'EvalService'))
+        app.results = ResultsWriter(app)
+        app.engine = ExecutionEngine(app, parallelism=2,
+                                     cache=SeriesCache(),
+                                     results=app.results)
+        app.jobs = JobQueue(app, workers=1)
+        self.app = app
+        return app
+
+    def setUp(self):
+        super(EngineTestCase, self).setUp()
+        self.app.resolver = FakeResolver(self.get_url(''))
+        self.io_loop.run_sync(lambda: self.app.db.checks.checks.insert_many(
+            [dict(check) for check in CHECKS]))
+
+
+class TestExecution(EngineTestCase):
+
+    def test_single_check(self):
+        response = self.fetch('/checks/g/ko1/exec/t1')
+        self.assertEqual(response.code, 200)
+        res = json.loads(response.body)
+        self.assertEqual((res['ok'], res['failures']), (False, [2]))
+
+    def test_missing_check(self):
+        response = self.fetch('/checks/g/nope/exec/t1')
+        self.assertEqual(response.code, 404)
+
+    def test_group_shares_deps(self):
+        response = self.fetch('/checks/g/exec/t1')
+        res = json.loads(response.body)
+        self.assertEqual(dict((name, r['ok']) for name, r in res.items()),
+                         {'ok1': True, 'ko1': False, 'zq1': True})
+        self.assertEqual(self.app.data_requests[('t1', 'A')], 1)
+        self.assertEqual(self.app.data_requests[('t1', 'ZERIQ')], 1)
+        stats = self.app.downstream['EvalService'].stats()
+        self.assertEqual((stats['requests'], stats['in_flight']), (3, 0))
+        self.assertLessEqual(stats['peak'], 2)
+
+    def test_group_ndjson(self):
+        response = self.fetch('/checks/g/exec/t1?stream=ndjson')
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/x-ndjson')
+        lines = [json.loads(line) for line in
+                 response.body.decode('utf-8').splitlines()]
+        self.assertEqual(sorted(line['name'] for line in lines),
+                         ['ko1', 'ok1', 'zq1'])
+        ok = dict((line['name'], line['result']['ok']) for line in lines)
+        self.assertEqual(ok, {'ok1': True, 'ko1': False, 'zq1': True})
+
+    def test_group_sse(self):
+        response = self.fetch('/checks/g/exec/t1',
+                              headers={'Accept': 'text/event-stream'})
+        self.assertEqual(response.headers['Content-Type'],
+                         'text/event-stream')
+        events = response.body.decode('utf-8').strip().split('\n\n')
+        self.assertEqual([e.split('\n')[0] for e in events],
+                         ['event: result'] * 3 + ['event: done'])
+        self.assertEqual(json.loads(events[-1].split('data: ')[1]),
+                         {'count': 3})
+
+    @gen_test
+    def test_client_gone(self):
+        self.app.engine.parallelism = 1
+        self.app.eval_delay = 0.05
+        stream = IOStream(socket.socket())
+        yield stream.connect(('127.0.0.1', self.get_http_port()))
+        yield stream.write(b'GET /checks/g/exec/t1?stream=ndjson HTTP/1.1\r\n'
+                           b'Host: test\r\n\r\n')
+        # sent with the first result
+        yield stream.read_until(b'\r\n\r\n')
+        stream.close()
+        yield tornado.gen.sleep(0.2)
+        # the last check didn't run
+        stats = self.app.downstream['EvalService'].stats()
+        self.assertEqual((stats['requests'], stats['in_flight']), (2, 0))
+
+    def test_unknown_stream(self):
+        response = self.fetch('/checks/g/exec/t1?stream=xml')
+        self.assertEqual(response.code, 400)
+
+    def test_batch(self):
+        body = json.dumps({
+            'checks': [['g', 'ok1'], {'group': 'g', 'name': 'ko1'},
+                       ['g', 'nope']],
+            'tags': ['t1', 't2']
+        })
+        response = self.fetch('/exec', method='POST', body=body)
+        lines = [json.loads(line)
+                 for line in response.body.decode('utf-8').splitlines()]
+        self.assertEqual(len(lines), 6)
+        codes = Counter(line['result'].get('code') for line in lines)
+        self.assertEqual(codes, Counter({None: 4, 404: 2}))
+        self.assertEqual(self.app.data_requests[('t2', 'A')], 1)
+
+
+class TestServiceDown(EngineTestCase):
+
+    def down(self, service):
+        self.app.resolver = FakeResolver(self.get_url(''), down=(service,))
+
+    def test_data_service_down(self):
+        self.down('DataService')
+        response = self.fetch('/checks/g/exec/t1')
+        self.assertEqual(response.code, 200)
+        ret = json.loads(response.body)
+        self.assertEqual(dict((name, res['code']) for name, res in
+                              ret.items()),
+                         {'ok1': 502, 'ko1': 502, 'zq1': 502})
+        response = self.fetch('/checks/g/ok1/exec/t1')
+        self.assertEqual(response.code, 502)
+        self.assertEqual(json.loads(response.body)['code'], 502)
+
+    def test_eval_service_down(self):
+        self.down('EvalService')
+        response = self.fetch('/checks/g/exec/t1?stream=ndjson')
+        lines = [json.loads(line) for line in
+                 response.body.decode('utf-8').splitlines()]
+        self.assertEqual([line['result']['code'] for line in lines],
+                         [502] * 3)
+        self.io_loop.run_sync(self.app.results.flush)
+        stored = self.io_loop.run_sync(
+            lambda: self.app.db.checks.results.count_documents({}))
+        self.assertEqual(stored, 3)
+
+
+class TestMetrics(EngineTestCase):
+
+    def test_stages_are_measured(self):
+        self.fetch('/checks/g/exec/t1')
+        response = self.fetch('/metrics')
+        self.assertEqual(response.code, 200)
+        text = response.body.decode('utf-8')
+        for stage in ('check_load', 'sd_lookup', 'dep_fetch', 'eval',
+                      'compare'):
+            self.assertIn('checks_stage_seconds_count{stage="%s"}' % stage,
+                          text)
+        self.assertIn('checks_zeriq_fallbacks_total', text)
+        self.assertIn('checks_requests_total{handler='
+                      '"GroupChecksExecController",method="GET",code="200"}',
+                      text)
+
+
+class TestTrace(EngineTestCase):
+
+    def test_single_check(self):
+        response = self.fetch('/checks/g/zq1/exec/t1?trace=1')
+        res = json.loads(response.body)
+        self.assertTrue(res['ok'])
+        names = [span['name'] for span in res['trace']['spans']]
+        for name in ('check_load', 'sd_lookup', 'dep_fetch', 'eval',
+                     'compare'):
+            self.assertIn(name, names)
+        self.assertIn({'name': 'zeriq_fallback', 'dep': 'X', 'tag': 't1'},
+                      [dict((k, v) for k, v in event.items() if k != 'at')
+                       for event in res['trace']['events']])
+        self.assertGreater(res['trace']['bytes'], 0)
+
+    def test_group(self):
+        response = self.fetch('/checks/g/exec/t1?trace=1')
+        ret = json.loads(response.body)
+        summary = ret.pop('.trace')['checks']
+        self.assertEqual(set(ret), set(['ok1', 'ko1', 'zq1']))
+        self.assertEqual(set(c['check'] for c in summary), set(ret))
+        totals = [c['total'] for c in summary]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+    def test_untraced(self):
+        response = self.fetch('/checks/g/exec/t1')
+        self.assertNotIn('.trace', json.loads(response.body))
+
+
+class TestLocalEvaluator(EngineTestCase):
+
+    def setUp(self):
+        super(TestLocalEvaluator, self).setUp()
+        self.app.engine = ExecutionEngine(self.app, evaluator='local')
+
+    def test_group_in_process(self):
+        response = self.fetch('/checks/g/exec/t1')
+        ret = json.loads(response.body)
+        self.assertEqual(dict((name, res['ok']) for name, res in ret.items()),
+                         {'ok1': True, 'ko1': False, 'zq1': True})
+        self.assertEqual(self.app.downstream['EvalService'].requests, 0)
+
+
+class TestOffload(EngineTestCase):
+
+    def setUp(self):
+        super(TestOffload, self).setUp()
+        self.app.engine = ExecutionEngine(
+            self.app, offload=Offloader(kind='thread', threshold=0))
+
+    def tearDown(self):
+        self.app.engine.offload.shutdown()
+        super(TestOffload, self).tearDown()
+
+    def test_group_offloaded(self):
+        response = self.fetch('/checks/g/exec/t1')
+        ret = json.loads(response.body)
+        self.assertEqual(dict((name, res['ok']) for name, res in ret.items()),
+                         {'ok1': True, 'ko1': False, 'zq1': True})
+
+
+class TestCatalogue(EngineTestCase):
+
+    def setUp(self):
+        super(TestCatalogue, self).setUp()
+        self.catalogue = Catalogue(self.app)
+        self.app.engine.catalogue = self.catalogue
+        self.io_loop.run_sync(self.catalogue.load)
+
+    def test_no_lookup_when_cataloged(self):
+        self.io_loop.run_sync(
+            lambda: self.app.db.checks.checks.delete_many({}))
+        ret = json.loads(self.fetch('/checks/g/exec/t1').body)
+        self.assertEqual(dict((name, res['ok']) for name, res in ret.items()),
+                         {'ok1': True, 'ko1': False, 'zq1': True})
+        response = self.fetch('/checks/g/ok1/exec/t1')
+        self.assertEqual(response.code, 200)
+
+    def test_invalidate_reads_again(self):
+        self.io_loop.run_sync(
+            lambda: self.app.db.checks.checks.update_one(
+                {'name': 'ok1'}, {'$set': {'threshold': -1}}))
+        self.assertTrue(json.loads(
+            self.fetch('/checks/g/ok1/exec/t1').body)['ok'])
+        self.app.engine.invalidate('g', 'ok1')
+        self.assertFalse(json.loads(
+            self.fetch('/checks/g/ok1/exec/t1').body)['ok'])
+        self.assertEqual(self.catalogue.get('g', 'ok1')['threshold'], -1.0)
+        self.assertFalse(self.catalogue.complete('g'))
+
+        # the group is read again as a whole, not just the check looked up
+        ret = json.loads(self.fetch('/checks/g/exec/t1').body)
+        self.assertEqual(sorted(ret), ['ko1', 'ok1', 'zq1'])
+        self.assertTrue(self.catalogue.complete('g'))
+
+    def test_rerun_keeps_plans(self):
+        self.fetch('/checks/g/exec/t1/changed', method='POST',
+                   body=json.dumps({'series': ['B']}))
+        self.assertTrue(self.catalogue.complete('g'))
+        self.assertEqual(len(self.catalogue.group('g')), 3)
+
+    def test_threshold_not_a_number(self):
+        bad = dict(CHECKS[0], name='bad', formula='bad=A-C',
+                   threshold='high')
+        self.io_loop.run_sync(
+            lambda: self.app.db.checks.checks.insert_one(dict(bad)))
+
+        # from the catalogue
+        self.io_loop.run_sync(self.catalogue.load)
+        ret = json.loads(self.fetch('/checks/g/exec/t1').body)
+        self.assertEqual(sorted(ret), ['bad', 'ko1', 'ok1', 'zq1'])
+        self.assertEqual(ret['bad']['code'], 500)
+
+        # from MongoDB
+        self.app.engine.invalidate('g')
+        ret = json.loads(self.fetch('/checks/g/exec/t1').body)
+        self.assertEqual(sorted(ret), ['bad', 'ko1', 'ok1', 'zq1'])
+        self.assertEqual(ret['bad']['code'], 500)
+
+    def test_changed_while_reading(self):
+        self.app.engine.invalidate('g')
+        check = self.io_loop.run_sync(
+            lambda: self.app.db.checks.checks.find_one({'name': 'ok1'}))
+        racing = RacingCollection(self.app.db.checks.checks, self.catalogue, {
+            'operationType': 'update',
+            'documentKey': {'_id': check['_id']},
+            'fullDocument': dict(check, threshold=-1)})
+        with mock.patch.object(ExecutionEngine, 'collection',
+                               property(lambda engine: racing)):
+            ret = json.loads(self.fetch('/checks/g/exec/t1').body)
+        self.assertEqual(sorted(ret), ['ko1', 'ok1', 'zq1'])
+        # the read didn't overwrite the change
+        self.assertEqual(self.catalogue.get('g', 'ok1')['threshold'], -1.0)
+        self.assertFalse(self.catalogue.complete('g'))
+
+    def test_missing_checks_are_read(self):
+        self.io_loop.run_sync(
+            lambda: self.app.db.checks.checks.insert_one(dict(
+                CHECKS[0], name='ok2', formula='ok2=A-C')))
+        response = self.fetch('/checks/g/ok2/exec/t1')
+        self.assertEqual(response.code, 200)
+        self.assertIsNotNone(self.catalogue.get('g', 'ok2'))
+
+
+class TestRerun(EngineTestCase):
+
+    def test_only_affected_checks_run(self):
+        first = json.loads(self.fetch('/checks/g/exec/t1').body)
+        response = self.fetch('/checks/g/exec/t1/changed', method='POST',
+                              body=json.dumps({'series': ['B']}))
+        self.assertEqual(response.headers['X-Executed'], '1')
+        self.assertEqual(json.loads(response.body), first)
+        self.assertEqual(self.app.data_requests[('t1', 'B')], 2)
+        self.assertEqual(self.app.data_requests[('t1', 'A')], 1)
+
+    def test_malformed_series(self):
+        response = self.fetch('/checks/g/exec/t1/changed', method='POST',
+                              body='{}')
+        self.assertEqual(response.code, 400)
+
+
+class TestMemoization(EngineTestCase):
+
+    def setUp(self):
+        super(TestMemoization, self).setUp()
+        self.app.engine.memo = ResultCache()
+        self.app.engine.cache = None
+
+    def test_results_are_memoized(self):
+        first = json.loads(self.fetch('/checks/g/exec/t1').body)
+        second = json.loads(self.fetch('/checks/g/exec/t1').body)
+        self.assertEqual(first, second)
+        self.assertEqual(self.app.data_requests[('t1', 'A')], 1)
+
+    def test_invalidation(self):
+        self.fetch('/checks/g/ok1/exec/t1')
+        self.app.engine.invalidate('g', 'ok1')
+        self.fetch('/checks/g/ok1/exec/t1')
+        self.assertEqual(self.app.data_requests[('t1', 'A')], 2)
+
+    def test_rerun_forgets_every_group(self):
+        self.io_loop.run_sync(lambda: self.app.db.checks.checks.insert_one(
+            dict(CHECKS[1], group='h')))
+        self.fetch('/checks/h/ko1/exec/t1')
+        self.fetch('/checks/g/ok1/exec/t2')
+        self.fetch('/checks/g/exec/t1/changed', method='POST',
+                   body=json.dumps({'series': ['B']}))
+        self.assertEqual(self.app.data_requests[('t1', 'B')], 2)
+        # depends on B in another group: executed again
+        self.fetch('/checks/h/ko1/exec/t1')
+        self.assertEqual(self.app.data_requests[('t1', 'B')], 3)
+        # another tag: still memoized
+        self.fetch('/checks/g/ok1/exec/t2')
+        self.assertEqual(self.app.data_requests[('t2', 'A')], 1)
+
+    def test_evicted_while_running(self):
+        self.app.engine.memo = ResultCache(size=1)
+        first = json.loads(self.fetch('/checks/g/exec/t1').body)
+        response = self.fetch('/checks/g/exec/t1')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), first)
+
+
+class TestJobs(EngineTestCase):
+
+    def test_async_group_execution(self):
+        self.app.jobs.start()
+        response = self.fetch('/checks/g/exec/t1?async=1', method='POST',
+                              body='')
+        self.assertEqual(response.code, 202)
+        job_id = json.loads(response.body)['job']
+
+        job = {'status': 'queued'}
+        while job['status'] in ('queued', 'running'):
+            self.io_loop.run_sync(lambda: tornado.gen.sleep(0.01))
+            job = json.loads(self.fetch('/jobs/' + job_id).body)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual((job['total'], job['done'], job['failures']),
+                         (3, 3, 1))
+
+        self.io_loop.run_sync(self.app.results.flush)
+        response = self.fetch('/jobs/%s/results' % job_id)
+        results = json.loads(response.body)
+        self.assertEqual(sorted(r['name'] for r in results),
+                         ['ko1', 'ok1', 'zq1'])
+        self.app.jobs.stop()
+
+    def test_job_of_a_dead_process(self):
+        # left running by a process which crashed, a minute ago
+        last = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+        stale, alive = ObjectId(), ObjectId()
+        self.io_loop.run_sync(lambda: self.app.db.checks.jobs.insert_many([
+            {'_id': stale, 'status': 'running', 'heartbeat': last,
+             'created': last},
+            {'_id': alive, 'status': 'running',
+             'heartbeat': datetime.datetime.utcnow(), 'created': last}]))
+        job = json.loads(self.fetch('/jobs/%s' % stale).body)
+        self.assertEqual(job['status'], 'failed')
+        job = json.loads(self.fetch('/jobs/%s' % alive).body)
+        self.assertEqual(job['status'], 'running')
+
+        self.io_loop.run_sync(lambda: self.app.db.checks.jobs.update_one(
+            {'_id': alive}, {'$set': {'heartbeat': last}}))
+        self.io_loop.run_sync(self.app.jobs.expire)
+        job = self.io_loop.run_sync(
+            lambda: self.app.db.checks.jobs.find_one({'_id': alive}))
+        self.assertEqual(job['status'], 'failed')
+
+    def test_unknown_job(self):
+        response = self.fetch('/jobs/' + '0' * 24)
+        self.assertEqual(response.code, 404)
+
+
+class TestBSONFormat(EngineTestCase):
+
+    def setUp(self):
+        super(TestBSONFormat, self).setUp()
+        self.app.engine.format = 'bson'
+
+    def test_group_in_bson(self):
+        response = self.fetch('/checks/g/exec/t1')
+        res = json.loads(response.body)
+        self.assertEqual(dict((name, r['ok']) for name, r in res.items()),
+                         {'ok1': True, 'ko1': False, 'zq1': True})
+
+    def test_fallback_to_json(self):
+        self.app.accept_bson = False
+        response = self.fetch('/checks/g/ko1/exec/t1')
+        self.assertEqual(json.loads(response.body)['failures'], [2])
+        # for the request only, the raw deps posted without their formula
+        self.assertEqual(self.app.engine.format, 'bson')
+        self.assertEqual(self.app.json_formulas, 0)
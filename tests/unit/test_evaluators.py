@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_evaluators
+----------------------------------
+
+Tests for `checks.evaluators` module.
+"""
+import math
+import unittest
+
+from tornado.ioloop import IOLoop
+
+from checks.evaluators import EvalError, Formula, LocalEvaluator
+from checks.evaluators import make_evaluator
+
+
+DEPS = {
+    'A': {'numbers': [1.0, 2.0, 3.0]},
+    'B': {'numbers': [1.0, None, 2.0]},
+}
+
+
+def check(formula, deps=('A', 'B')):
+    return {'name': 'c', 'formula': formula, 'deps': list(deps)}
+
+
+class TestFormula(unittest.TestCase):
+
+    def test_compile(self):
+        formula = Formula('c = abs(A - B) / 2 + 1e-3')
+        self.assertEqual(formula.target, 'c')
+        self.assertEqual(formula.names, set(['A', 'B']))
+
+    def test_refused(self):
+        for formula in ('A-B', 'c=A.__class__', 'c=A[0]', "c='x'",
+                        'c=open(A)', 'c=abs(A, out=B)', 'c=lambda: 1',
+                        'c=A-', 'c d=A', 'c=abs', 'c=A + max'):
+            self.assertRaises(EvalError, Formula, formula)
+
+
+class TestLocalEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.evaluator = LocalEvaluator(size=2)
+
+    def evaluate(self, check):
+        return IOLoop.current().run_sync(
+            lambda: self.evaluator.evaluate(check, DEPS))
+
+    def test_evaluate(self):
+        res = self.evaluate(check('c=A-B'))
+        self.assertEqual(res['c']['numbers'][0], 0.0)
+        self.assertTrue(math.isnan(res['c']['numbers'][1]))
+        self.assertEqual(res['c']['numbers'][2], 1.0)
+
+    def test_scalar(self):
+        self.assertEqual(self.evaluate(check('c=2'))['c']['numbers'], [2])
+
+    def test_bounded_constants(self):
+        # big-int arithmetic would block for minutes
+        res = self.evaluate(check('c=A + 9**9**9'))
+        self.assertEqual(res['c']['numbers'], [float('inf')] * 3)
+        res = self.evaluate(check('c=-(7 // 2) + A % 2'))
+        self.assertEqual(res['c']['numbers'], [-2.0, -3.0, -2.0])
+
+    def test_compiled_once(self):
+        self.evaluator.supports(check('c=A-B'))
+        self.evaluate(check('c=A-B'))
+        self.assertEqual(self.evaluator.formulas.stats()['misses'], 1)
+
+    def test_supports(self):
+        self.assertTrue(self.evaluator.supports(check('c=A-B')))
+        self.assertFalse(self.evaluator.supports(check('c=A-C')))
+        self.assertFalse(self.evaluator.supports(check('c=A.real')))
+        # a function, not a number
+        self.assertFalse(self.evaluator.supports(check('c=abs')))
+
+    def test_unknown_names(self):
+        with self.assertRaises(EvalError) as ctx:
+            self.evaluate(check('c=A-C'))
+        self.assertEqual(ctx.exception.code, 422)
+
+    def test_unknown_evaluator(self):
+        self.assertRaises(ValueError, make_evaluator, 'nope', None)
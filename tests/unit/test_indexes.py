@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_indexes
+----------------------------------
+
+Tests for `checks.indexes` module.
+"""
+import json
+import datetime
+
+import tornado.gen
+import tornado.web
+
+from tornado.testing import AsyncTestCase, AsyncHTTPTestCase, gen_test
+from mongomock_motor import AsyncMongoMockClient
+
+from checks.indexes import INDEXES, ensure_indexes, index_stats
+from checks.controllers import IndexStatsHandler
+
+
+SINCE = datetime.datetime(2020, 1, 1)
+
+
+class StatsCursor(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    @tornado.gen.coroutine
+    def to_list(self, length=None):
+        raise tornado.gen.Return(self.docs)
+
+
+class StatsCollection(object):
+    """answers `$indexStats` with an entry per index of `INDEXES`"""
+
+    def __init__(self, name):
+        self.name = name
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return StatsCursor([{
+            'name': index.document['name'],
+            'key': dict(index.document['key']),
+            'accesses': {'ops': i, 'since': SINCE}
+        } for i, index in enumerate(INDEXES[self.name])])
+
+
+class StatsDB(object):
+    def __init__(self):
+        self.checks = dict((name, StatsCollection(name)) for name in INDEXES)
+
+
+def names(collection):
+    return set(index.document['name'] for index in INDEXES[collection])
+
+
+class TestIndexes(AsyncTestCase):
+
+    def setUp(self):
+        super(TestIndexes, self).setUp()
+        self.db = AsyncMongoMockClient()
+
+    @gen_test
+    def test_creates_declared_indexes(self):
+        yield ensure_indexes(self.db)
+        for collection in INDEXES:
+            info = yield self.db.checks[collection].index_information()
+            self.assertEqual(set(info) - {'_id_'}, names(collection))
+        info = yield self.db.checks.checks.index_information()
+        self.assertTrue(info['group_name']['unique'])
+
+    @gen_test
+    def test_idempotent(self):
+        yield ensure_indexes(self.db)
+        yield ensure_indexes(self.db)
+        info = yield self.db.checks.results.index_information()
+        self.assertEqual(set(info) - {'_id_'}, names('results'))
+
+    @gen_test
+    def test_failures_dont_stop_the_others(self):
+        yield self.db.checks.checks.insert_many([
+            {'group': 'g', 'name': 'c'}, {'group': 'g', 'name': 'c'}])
+        yield ensure_indexes(self.db)
+        info = yield self.db.checks.checks.index_information()
+        self.assertNotIn('group_name', info)
+        info = yield self.db.checks.results.index_information()
+        self.assertEqual(set(info) - {'_id_'}, names('results'))
+
+    @gen_test
+    def test_stats(self):
+        db = StatsDB()
+        stats = yield index_stats(db)
+        self.assertEqual(set(stats), set(INDEXES))
+        self.assertEqual(stats['checks']['deps'],
+                         {'key': {'deps': 1}, 'ops': 1, 'since': SINCE})
+        self.assertEqual(db.checks['results'].pipelines,
+                         [[{'$indexStats': {}}]])
+
+
+class TestIndexStatsHandler(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app = tornado.web.Application(IndexStatsHandler.routes())
+        self.app.db = StatsDB()
+        return self.app
+
+    def test_stats(self):
+        response = self.fetch('/admin/indexes')
+        self.assertEqual(response.code, 200)
+        stats = json.loads(response.body)
+        self.assertEqual(set(stats['results']), names('results'))
+        self.assertEqual(stats['checks']['group_name']['key'],
+                         {'group': 1, 'name': 1})
+
+    def test_unsupported(self):
+        # mongomock has no $indexStats
+        self.app.db = AsyncMongoMockClient()
+        response = self.fetch('/admin/indexes')
+        self.assertEqual(response.code, 500)
+        self.assertIn('error', json.loads(response.body))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `checks.metrics` module.
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from checks.metrics import Registry
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.counter = self.registry.counter(
+            'requests_total', 'requests', ('handler',))
+        self.histogram = self.registry.histogram(
+            'stage_seconds', 'stages', ('stage',), buckets=(0.1, 1.0))
+
+    def test_counter(self):
+        self.counter.inc(handler='a')
+        self.counter.inc(2, handler='a')
+        self.counter.inc(handler='b"')
+        text = self.registry.render()
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{handler="a"} 3', text)
+        self.assertIn('requests_total{handler="b\\""} 1', text)
+
+    def test_histogram(self):
+        self.histogram.observe(0.05, stage='eval')
+        self.histogram.observe(0.5, stage='eval')
+        self.histogram.observe(5, stage='eval')
+        text = self.registry.render()
+        self.assertIn('stage_seconds_bucket{stage="eval",le="0.1"} 1', text)
+        self.assertIn('stage_seconds_bucket{stage="eval",le="1.0"} 2', text)
+        self.assertIn('stage_seconds_bucket{stage="eval",le="+Inf"} 3', text)
+        self.assertIn('stage_seconds_count{stage="eval"} 3', text)
+        self.assertIn('stage_seconds_sum{stage="eval"} 5.55', text)
+
+    def test_timer(self):
+        with self.histogram.time(stage='compare'):
+            pass
+        self.assertEqual(self.histogram.values[('compare',)][-2], 1)
+
+    def test_collectors(self):
+        hits = {'n': 0}
+
+        def collector():
+            self.counter.values[('cache',)] = hits['n']
+
+        self.registry.collectors.append(collector)
+        hits['n'] = 7
+        self.assertIn('requests_total{handler="cache"} 7',
+                      self.registry.render())
+
+
+class TestProcesses(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.registry = Registry()
+        self.registry.path = self.path
+        self.counter = self.registry.counter(
+            'requests_total', 'requests', ('handler',))
+        self.histogram = self.registry.histogram(
+            'stage_seconds', 'stages', ('stage',), buckets=(0.1, 1.0))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def other_process(self, snapshot):
+        with open(self.registry.filename(pid=1), 'w') as f:
+            json.dump(snapshot, f)
+
+    def test_merges_processes(self):
+        self.counter.inc(handler='a')
+        self.histogram.observe(0.5, stage='eval')
+        self.other_process({
+            'requests_total': [[['a'], 2], [['b'], 1]],
+            'stage_seconds': [[['eval'], [1, 1, 1, 0.05]]]
+        })
+        text = self.registry.render()
+        self.assertIn('requests_total{handler="a"} 3', text)
+        self.assertIn('requests_total{handler="b"} 1', text)
+        self.assertIn('stage_seconds_bucket{stage="eval",le="0.1"} 1', text)
+        self.assertIn('stage_seconds_count{stage="eval"} 2', text)
+
+    def test_dump_is_not_read_twice(self):
+        self.counter.inc(handler='a')
+        self.registry.dump()
+        self.assertTrue(os.path.exists(self.registry.filename()))
+        self.assertIn('requests_total{handler="a"} 1',
+                      self.registry.render())
+
+    def test_clear(self):
+        self.other_process({'requests_total': [[['a'], 2]]})
+        self.registry.clear(self.path)
+        self.assertNotIn('requests_total{handler="a"}',
+                         self.registry.render())
+
+    def test_unreadable_snapshot(self):
+        with open(self.registry.filename(pid=1), 'w') as f:
+            f.write('{')
+        self.counter.inc(handler='a')
+        self.assertIn('requests_total{handler="a"} 1',
+                      self.registry.render())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_offload
+----------------------------------
+
+Tests for `checks.offload` module.
+"""
+import threading
+import unittest
+
+from bson.json_util import dumps
+from tornado.ioloop import IOLoop
+
+from checks.offload import Offloader
+from checks.wire import decode_dep
+
+
+def current_thread():
+    return threading.current_thread().name
+
+
+class TestOffloader(unittest.TestCase):
+
+    def run_on(self, offload, size, fn, *args):
+        try:
+            return IOLoop.current().run_sync(
+                lambda: offload.run(size, fn, *args))
+        finally:
+            offload.shutdown()
+
+    def test_inline_below_threshold(self):
+        offload = Offloader(kind='thread', threshold=10)
+        self.assertEqual(self.run_on(offload, 9, current_thread),
+                         current_thread())
+
+    def test_thread_pool(self):
+        offload = Offloader(kind='thread', threshold=10)
+        self.assertNotEqual(self.run_on(offload, 10, current_thread),
+                            current_thread())
+
+    def test_none(self):
+        offload = Offloader(kind='none', threshold=0)
+        self.assertEqual(self.run_on(offload, 100, current_thread),
+                         current_thread())
+
+    def test_process_pool(self):
+        offload = Offloader(kind='process', workers=1, threshold=0)
+        body = dumps({'numbers': [1.0, 2.0]})
+        self.assertEqual(self.run_on(offload, len(body), decode_dep, body),
+                         {'numbers': [1.0, 2.0]})
+
+    def test_errors_are_raised(self):
+        offload = Offloader(kind='thread', threshold=0)
+        self.assertRaises(ValueError, self.run_on, offload, 1, decode_dep,
+                          '{')
+
+    def test_unknown_kind(self):
+        self.assertRaises(ValueError, Offloader, kind='gpu')
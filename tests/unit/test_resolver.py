@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_resolver
+----------------------------------
+
+Tests for `checks.resolver` module.
+"""
+import tornado.gen
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from checks.resolver import ServiceResolver, ResolverError
+
+
+class FakeServiceDiscovery(object):
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    def getService(self, name):
+        self.calls += 1
+        if self.fail:
+            raise Exception("Consul is down")
+        return "https://%s:9000" % name.lower()
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class StubResolver(ServiceResolver):
+    """a resolver with a canned list of healthy instances"""
+
+    instances = []
+
+    @tornado.gen.coroutine
+    def healthy(self, name, scheme):
+        raise tornado.gen.Return(
+            ["%s://%s" % (scheme, host) for host in self.instances])
+
+
+class TestServiceResolver(AsyncTestCase):
+
+    def setUp(self):
+        super(TestServiceResolver, self).setUp()
+        self.sd = FakeServiceDiscovery()
+        self.clock = FakeClock()
+
+    @gen_test
+    def test_endpoints_are_cached(self):
+        resolver = StubResolver(self.sd, 'http://consul', ttl=10,
+                                clock=self.clock)
+        url = yield resolver.resolve('DataService')
+        self.assertEqual(url, 'https://dataservice:9000')
+        yield resolver.resolve('DataService')
+        self.assertEqual(self.sd.calls, 1)
+        self.clock.now = 11
+        yield resolver.resolve('DataService')
+        self.assertEqual(self.sd.calls, 2)
+
+    @gen_test
+    def test_round_robin_over_healthy_instances(self):
+        resolver = StubResolver(self.sd, 'http://consul', clock=self.clock)
+        resolver.instances = ['a:1', 'b:1']
+        urls = []
+        for _ in range(3):
+            url = yield resolver.resolve('EvalService')
+            urls.append(url)
+        self.assertEqual(urls, ['https://a:1', 'https://b:1', 'https://a:1'])
+
+    @gen_test
+    def test_stale_endpoints_on_failure(self):
+        resolver = StubResolver(self.sd, 'http://consul', ttl=10,
+                                clock=self.clock)
+        yield resolver.resolve('DataService')
+        self.sd.fail = True
+        self.clock.now = 11
+        url = yield resolver.resolve('DataService')
+        self.assertEqual(url, 'https://dataservice:9000')
+        with self.assertRaises(ResolverError):
+            yield resolver.resolve('EvalService')
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_results
+----------------------------------
+
+Tests for `checks.results` module.
+"""
+import tornado.gen
+
+from tornado.testing import AsyncTestCase, gen_test
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from checks.results import ResultsWriter, make_result
+
+
+class FakeCollection(object):
+    """
+    stores the documents by _id; with `fail` set nothing is stored, with
+    `lost` everything is but the write fails anyway, and past `capacity`
+    documents the writes are partial
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.docs = {}
+        self.fail = False
+        self.lost = False
+        self.capacity = None
+
+    @tornado.gen.coroutine
+    def insert_many(self, docs, ordered=True):
+        yield tornado.gen.moment
+        if self.fail:
+            raise Exception("Mongo is down")
+
+        stored, errors = [], []
+        for index, doc in enumerate(docs):
+            doc.setdefault('_id', ObjectId())
+            if doc['_id'] in self.docs:
+                errors.append({'index': index, 'code': 11000,
+                               'errmsg': 'E11000 duplicate key error'})
+            elif self.capacity is not None and \
+                    len(self.docs) >= self.capacity:
+                errors.append({'index': index, 'code': 91,
+                               'errmsg': 'shutdown in progress'})
+            else:
+                self.docs[doc['_id']] = doc
+                stored.append(doc)
+        if len(stored) > 0:
+            self.batches.append(stored)
+
+        if self.lost:
+            raise Exception("Connection reset")
+        if len(errors) > 0:
+            raise BulkWriteError({'writeErrors': errors,
+                                  'nInserted': len(stored)})
+
+
+class FakeApp(object):
+    def __init__(self):
+        collection = FakeCollection()
+        self.db = type('db', (), {
+            'checks': type('checks', (), {'results': collection})
+        })
+
+
+class TestResultsWriter(AsyncTestCase):
+
+    def setUp(self):
+        super(TestResultsWriter, self).setUp()
+        self.app = FakeApp()
+        self.collection = self.app.db.checks.results
+        self.check = {'group': 'g', 'name': 'n'}
+
+    @gen_test
+    def test_flushes_in_batches(self):
+        writer = ResultsWriter(self.app, batch=2)
+        for _ in range(5):
+            writer.add(make_result(self.check, 't', error=Exception('ko')))
+        yield writer.stop()
+        self.assertEqual([len(b) for b in self.collection.batches],
+                         [2, 2, 1])
+
+    @gen_test
+    def test_failed_writes_are_retried(self):
+        writer = ResultsWriter(self.app, batch=10)
+        writer.add(make_result(self.check, 't', {
+            'n': {'numbers': [1]}, 'ok': True, 'failures': []}))
+        self.collection.fail = True
+        yield writer.flush()
+        self.assertEqual(len(writer.buffer), 1)
+        self.collection.fail = False
+        yield writer.flush()
+        doc = self.collection.batches[0][0]
+        self.assertEqual((doc['tag'], doc['ok']), ('t', True))
+        self.assertEqual(doc['result'], {'numbers': [1]})
+
+    @gen_test
+    def test_partial_writes_retry_the_rest(self):
+        writer = ResultsWriter(self.app, batch=10)
+        for _ in range(3):
+            writer.add(make_result(self.check, 't', error=Exception('ko')))
+        self.collection.capacity = 1
+        yield writer.flush()
+        self.assertEqual(len(self.collection.docs), 1)
+        self.assertEqual(len(writer.buffer), 2)
+        self.collection.capacity = None
+        yield writer.flush()
+        self.assertEqual(len(self.collection.docs), 3)
+        self.assertEqual(writer.buffer, [])
+
+    @gen_test
+    def test_stored_results_are_not_retried(self):
+        writer = ResultsWriter(self.app, batch=10)
+        writer.add(make_result(self.check, 't', error=Exception('ko')))
+        self.collection.lost = True
+        yield writer.flush()
+        self.assertEqual(len(writer.buffer), 1)
+        self.collection.lost = False
+        writer.add(make_result(self.check, 't', error=Exception('ko')))
+        yield writer.flush()
+        self.assertEqual(writer.buffer, [])
+        self.assertEqual(len(self.collection.docs), 2)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_supervisor
+----------------------------------
+
+Tests for `checks.supervisor` module.
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from checks.supervisor import Supervisor, Heartbeat, worker_health
+
+
+def crash(task_id):
+    os._exit(3)
+
+
+def crash_once(run_dir):
+    def worker(task_id):
+        marker = os.path.join(run_dir, 'crashed-%s' % task_id)
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+            os._exit(1)
+        time.sleep(60)
+    return worker
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir)
+
+    def test_restarts_crashed_workers(self):
+        supervisor = Supervisor(2, crash_once(self.run_dir), self.run_dir,
+                                sleep=lambda seconds: None)
+        thread = threading.Thread(target=supervisor.run,
+                                  kwargs={'handle_signals': False})
+        thread.start()
+        try:
+            deadline = time.time() + 10
+            while supervisor.restarts < 2 and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            supervisor.stop()
+            thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(supervisor.restarts, 2)
+        health = worker_health(self.run_dir)
+        self.assertEqual([w['restarts'] for w in health['workers']], [1, 1])
+        self.assertEqual([w['exit'] for w in health['workers']],
+                         ['signal 15', 'signal 15'])
+
+    def test_gives_up(self):
+        supervisor = Supervisor(1, crash, self.run_dir, max_restarts=2,
+                                sleep=lambda seconds: None)
+        self.assertRaises(RuntimeError, supervisor.run, handle_signals=False)
+        self.assertEqual(supervisor.restarts, 2)
+        self.assertEqual(supervisor.state[0]['exit'], 'status 3')
+
+    def test_stopped_while_pausing(self):
+        supervisor = Supervisor(1, crash, self.run_dir)
+        # SIGTERM during the pause after a crash at startup
+        supervisor.sleep = lambda seconds: supervisor.stop()
+        thread = threading.Thread(target=supervisor.run,
+                                  kwargs={'handle_signals': False})
+        thread.start()
+        thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(supervisor.restarts, 0)
+        self.assertEqual(supervisor.children, {})
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        supervisor = Supervisor(1, crash, self.run_dir, clock=self.clock)
+        supervisor.state[0] = {'task': 0, 'pid': os.getpid(), 'restarts': 0,
+                               'exit': None, 'started': self.clock()}
+        supervisor.dump()
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir)
+
+    def test_heartbeat(self):
+        heartbeat = Heartbeat(self.run_dir, 0, interval=1, clock=self.clock,
+                              extra=lambda: {'jobs': 2})
+        heartbeat.due = 99.5
+        heartbeat.beat()
+        heartbeat.stop()
+        health = worker_health(self.run_dir, clock=self.clock)
+        worker = health['workers'][0]
+        self.assertTrue(worker['alive'])
+        self.assertEqual((worker['lag'], worker['jobs']), (0.5, 2))
+
+        self.clock.now += 10
+        health = worker_health(self.run_dir, clock=self.clock)
+        self.assertFalse(health['workers'][0]['alive'])
+
+    def test_no_heartbeat(self):
+        health = worker_health(self.run_dir, clock=self.clock)
+        self.assertFalse(health['workers'][0]['alive'])
+        self.assertEqual(health['supervisor'], os.getpid())
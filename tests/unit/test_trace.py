@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_trace
+----------------------------------
+
+Tests for `checks.trace` module.
+"""
+import unittest
+
+from checks.trace import Trace, stage
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.trace = Trace(clock=self.clock)
+
+    def test_spans(self):
+        self.clock.now = 1
+        with self.trace.span('dep_fetch', dep='A') as span:
+            self.clock.now = 1.5
+            span['bytes'] = 10
+        self.trace.event('zeriq_fallback', dep='X')
+        ret = self.trace.to_dict()
+        self.assertEqual(ret['spans'], [{'name': 'dep_fetch', 'dep': 'A',
+                                         'bytes': 10, 'start': 1000.0,
+                                         'duration': 500.0}])
+        self.assertEqual(ret['events'], [{'name': 'zeriq_fallback',
+                                          'dep': 'X', 'at': 1500.0}])
+        self.assertEqual(ret['bytes'], 10)
+        self.assertEqual(ret['total'], 1500.0)
+
+    def test_summary_sorted_by_cost(self):
+        for dep, duration in (('A', 1), ('B', 3)):
+            with self.trace.span('dep_fetch', dep=dep):
+                self.clock.now += duration
+        cheap = self.trace.child(check='cheap', deps=['A'])
+        costly = self.trace.child(check='costly', deps=['A', 'B'])
+        for child in (cheap, costly):
+            with child.span('eval'):
+                self.clock.now += 1
+        summary = self.trace.to_dict()['checks']
+        self.assertEqual([c['check'] for c in summary], ['costly', 'cheap'])
+        self.assertEqual((summary[0]['deps'], summary[0]['eval'],
+                          summary[0]['total']), (4000.0, 1000.0, 5000.0))
+
+    def test_stage_without_trace(self):
+        with stage('compare') as span:
+            span['ignored'] = True
+        self.assertEqual(self.trace.spans, [])